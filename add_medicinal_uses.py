@@ -1,6 +1,5 @@
 import sqlite3
-
-DATABASE_FILE = "medicinal_plants.db"
+from database import DATABASE_FILE, connect
 
 # This is the data we collected, formatted for our script.
 # (scientific_name, part_used, usage_description)
@@ -27,7 +26,7 @@ medicinal_data = [
 
 def main():
     print(f"Connecting to {DATABASE_FILE}...")
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = connect(DATABASE_FILE)
     cursor = conn.cursor()
 
     uses_added = 0
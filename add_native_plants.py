@@ -1,6 +1,5 @@
 import sqlite3
-
-DATABASE_FILE = "medicinal_plants.db"
+from database import DATABASE_FILE, connect
 
 # Our list of new native plants to add
 native_plants = [
@@ -12,7 +11,7 @@ native_plants = [
 ]
 
 print(f"Connecting to {DATABASE_FILE}...")
-conn = sqlite3.connect(DATABASE_FILE)
+conn = connect(DATABASE_FILE)
 cursor = conn.cursor()
 
 plants_added = 0
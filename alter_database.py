@@ -1,47 +1,15 @@
-import sqlite3
+from database import DATABASE_FILE
+from migrations import migrate
 
-DATABASE_FILE = "medicinal_plants.db"
-
-# The new columns we want to add to the 'Species' table
-new_columns = {
-    'plant_description': 'TEXT',
-    'habitat_type': 'TEXT',
-    'flowering_season': 'TEXT',
-    'general_warnings': 'TEXT'
-}
+# Schema upgrades are applied by the versioned migration runner in migrations.py.
+# The rich-data columns this script used to add are migration 2; each migration
+# is recorded in the database, so nothing is re-applied or silently ignored.
 
 def main():
     print(f"Connecting to {DATABASE_FILE} to upgrade table...")
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    columns_added = 0
-    
-    for column_name, data_type in new_columns.items():
-        try:
-            # We use "ALTER TABLE" to add a new column
-            # This is safer than remaking the whole table
-            cursor.execute(f"ALTER TABLE Species ADD COLUMN {column_name} {data_type}")
-            print(f"Successfully added column: {column_name}")
-            columns_added += 1
-        except sqlite3.OperationalError as e:
-            # This error happens if the column already exists, which is fine
-            if "duplicate column name" in str(e):
-                print(f"Column '{column_name}' already exists. Skipping.")
-            else:
-                print(f"An error occurred with {column_name}: {e}")
-        except Exception as e:
-            print(f"A general error occurred: {e}")
-
-    # Save (commit) changes and close
-    conn.commit()
-    conn.close()
-    
+    version = migrate(DATABASE_FILE)
     print("\n--- Database Upgrade Complete ---")
-    if columns_added > 0:
-        print(f"Successfully added {columns_added} new columns to the 'Species' table.")
-    else:
-        print("All new columns were already present.")
+    print(f"Database is at schema version {version}.")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,14 +1,36 @@
 import os
+import sys
+import hmac
 import time
-import sqlite3
-import pickle
+import atexit
+import signal
+import threading
+from collections import Counter
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import tensorflow as tf
-import cv2  # This is opencv-python
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file, g
 from flask_cors import CORS
-from tensorflow.keras.preprocessing.image import img_to_array
-from tensorflow.keras.applications.resnet50 import preprocess_input
+from inference_scheduler import MicroBatcher, INTERACTIVE, BACKGROUND
+from model_loader import ModelLoader, resolve_artifact_dir
+from model_server import ModelServerClient, RemoteScheduler
+import batch_inference
+from batch_inference import prepare_segmentation_input, prepare_classification_input, segment_and_crop
+from result_cache import ResultCache, content_key
+from embedding_store import EmbeddingStore
+from profile_cache import ProfileCache
+from database import Database
+from migrations import migrate
+import spatial
+import heatmap
+import locations
+from contribution_queue import ContributionQueue
+from image_store import ImageStore, VARIANT_SIZES, image_extension
+import image_decode
+from pipeline_stats import PipelineStats, StageTimer
+import metrics
+from profiling import RequestProfiler
+from plant_names import NAME_MAPPER
 
 # --- 1. GLOBAL SETUP ---
 
@@ -16,95 +38,170 @@ from tensorflow.keras.applications.resnet50 import preprocess_input
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 # Define file paths
-DATABASE_FILE = 'medicinal_plants.db'
-SEGMENTER_MODEL_FILE = 'leaf_segmenter.h5'
-CLASSIFIER_MODEL_FILE = 'leaf_classifier.pkl'
+# (model files are found through model_loader: models/<version>/ or the project folder)
+DATABASE_FILE = os.environ.get('PLANT_DATABASE_FILE', 'medicinal_plants.db')
 
-# Define image dimensions
-SEG_IMG_HEIGHT, SEG_IMG_WIDTH = 256, 256
-CLASS_IMG_HEIGHT, CLASS_IMG_WIDTH = 224, 224
+# Seconds a client is told to wait (Retry-After) while the models are still loading
+MODELS_LOADING_RETRY_AFTER = int(os.environ.get('PLANT_RETRY_AFTER_SECONDS', 10))
 
-# --- 2. LOAD MODELS INTO MEMORY ---
+# Inference path: 'graph' runs both models as traced tf.functions,
+# 'keras' uses the plain Model.predict() path (kept for comparison) and
+# 'tflite' runs quantized conversions of both (see tflite_convert.py)
+INFERENCE_BACKEND = os.environ.get('PLANT_INFERENCE_BACKEND', 'graph')
 
-print("Loading AI models. This may take a moment...")
+# Multi-worker deployments: the Unix socket of a shared model server
+# (python model_server.py). If set, this process loads no models at all.
+MODEL_SERVER = os.environ.get('PLANT_MODEL_SERVER', '')
 
-try:
-    # Load the Segmentation U-Net model
-    segmentation_model = tf.keras.models.load_model(
-        SEGMENTER_MODEL_FILE,
-        custom_objects={'MeanIoU': tf.keras.metrics.MeanIoU(num_classes=2)}
-    )
-    print(f"Successfully loaded segmentation model: {SEGMENTER_MODEL_FILE}")
-
-    # Load the ResNet50 base model (for feature extraction)
-    resnet_model = tf.keras.applications.ResNet50(
-        weights='imagenet',
-        include_top=False,
-        pooling='avg',
-        input_shape=(CLASS_IMG_HEIGHT, CLASS_IMG_WIDTH, 3)
-    )
-    print("Successfully loaded ResNet50 feature extractor.")
+# Species decision on top of the ResNet50 features: 'forest' (the RandomForest
+# pickle) or the embedding index in leaf_knn.npz ('knn' or 'prototype')
+CLASSIFIER_ENGINE = os.environ.get('PLANT_CLASSIFIER_ENGINE', 'forest')
+
+# Most alternatives /predict?top=N lists
+TOP_PREDICTIONS_MAX = 10
+
+# Cascade: classify the whole image first and skip segmentation when the classifier
+# is at least this confident (0 turns the cascade off: every image is segmented)
+CASCADE_THRESHOLD = float(os.environ.get('PLANT_CASCADE_THRESHOLD', 0))
+
+# Micro-batching: concurrent requests are grouped into one forward pass,
+# up to BATCH_MAX_SIZE images or BATCH_MAX_WAIT_MS of waiting, whichever comes first
+BATCH_MAX_SIZE = int(os.environ.get('PLANT_BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get('PLANT_BATCH_MAX_WAIT_MS', 10))
+
+# Largest request body accepted (uploads are also checked from their image header before decoding)
+MAX_UPLOAD_MB = int(os.environ.get('PLANT_MAX_UPLOAD_MB', 256))
+
+# /predict_batch: how many files one request may carry, how many images go
+# through the models per forward pass, and how many threads decode uploads
+PREDICT_BATCH_MAX_FILES = int(os.environ.get('PLANT_PREDICT_BATCH_MAX_FILES', 64))
+PREDICT_BATCH_CHUNK_SIZE = int(os.environ.get('PLANT_PREDICT_BATCH_CHUNK_SIZE', 16))
+DECODE_WORKERS = int(os.environ.get('PLANT_DECODE_WORKERS', 4))
+
+# Result cache for /predict, keyed by a hash of the uploaded bytes.
+# Set PLANT_RESULT_CACHE_DIR to also keep results on disk across restarts.
+RESULT_CACHE_SIZE = int(os.environ.get('PLANT_RESULT_CACHE_SIZE', 1024))
+RESULT_CACHE_TTL_SECONDS = float(os.environ.get('PLANT_RESULT_CACHE_TTL_SECONDS', 24 * 3600))
+RESULT_CACHE_DIR = os.environ.get('PLANT_RESULT_CACHE_DIR', '')
+
+# Every ResNet50 embedding computed by /predict and /contribute is kept here
+# so new classifier heads can be scored without re-running the CNN ('' turns it off)
+EMBEDDING_DIR = os.environ.get('PLANT_EMBEDDING_DIR', 'embeddings')
+
+# Assembled species profiles are cached in memory; this bounds how stale they can
+# get when another process (a loader script, another worker) writes to the database
+PROFILE_CACHE_TTL_SECONDS = float(os.environ.get('PLANT_PROFILE_CACHE_TTL_SECONDS', 600))
+
+# Spatial queries (/observations, /nearby): default and maximum rows per response
+SPATIAL_DEFAULT_LIMIT = 500
+SPATIAL_MAX_LIMIT = int(os.environ.get('PLANT_SPATIAL_MAX_LIMIT', 5000))
+
+# /contribute is write-behind: observations are queued and inserted in group
+# commits of up to CONTRIBUTION_BATCH_MAX_SIZE rows or CONTRIBUTION_BATCH_MAX_WAIT_MS
+CONTRIBUTION_BATCH_MAX_SIZE = int(os.environ.get('PLANT_CONTRIBUTION_BATCH_MAX_SIZE', 64))
+CONTRIBUTION_BATCH_MAX_WAIT_MS = float(os.environ.get('PLANT_CONTRIBUTION_BATCH_MAX_WAIT_MS', 200))
+
+# Contributions are checked by the AI pipeline in the background, by this many
+# threads, at lower priority than /predict traffic
+VERIFY_WORKERS = int(os.environ.get('PLANT_VERIFY_WORKERS', 1))
+
+# Contributed images are stored by content hash under UPLOAD_DIR, with
+# downscaled copies made by THUMBNAIL_WORKERS background threads
+UPLOAD_DIR = os.environ.get('PLANT_UPLOAD_DIR', 'uploads')
+THUMBNAIL_WORKERS = int(os.environ.get('PLANT_THUMBNAIL_WORKERS', 2))
 
-    # Load the trained Random Forest Classifier
-    with open(CLASSIFIER_MODEL_FILE, 'rb') as f:
-        classification_model = pickle.load(f)
-    print(f"Successfully loaded classification model: {CLASSIFIER_MODEL_FILE}")
+# Species locations: profiles embed every coordinate unless this is turned off, in
+# which case clients page through /locations/<species> (or use the heatmap tiles)
+PROFILE_INLINE_LOCATIONS = os.environ.get('PLANT_PROFILE_INLINE_LOCATIONS', '1').lower() in ('1', 'true', 'yes')
+LOCATIONS_DEFAULT_PAGE = 5000
+LOCATIONS_MAX_PAGE = int(os.environ.get('PLANT_LOCATIONS_MAX_PAGE', 50000))
 
-except Exception as e:
-    print(f"FATAL ERROR: Could not load models. {e}")
-    segmentation_model = None
-    classification_model = None
-    resnet_model = None
+# On-demand profiling of live requests (/debug/profile). Off unless a token is set;
+# the token must be sent in the X-Profile-Token header.
+PROFILE_TOKEN = os.environ.get('PLANT_PROFILE_TOKEN', '')
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PLANT_PROFILE_SAMPLE_INTERVAL_MS', 5))
+PROFILE_MAX_REQUESTS = 1000
+
+# --- 2. LOAD MODELS INTO MEMORY (IN THE BACKGROUND) ---
+
+# The models are loaded on a background thread so importing this module (and
+# starting the web server) is instant. They are filled in by on_models_ready().
+segmentation_model = None
+resnet_model = None
+classification_model = None
+inference_backend = None
+
+MODEL_ARTIFACT_DIR, MODEL_VERSION = resolve_artifact_dir()
+if MODEL_SERVER:
+    model_loader = ModelServerClient(MODEL_SERVER)
+else:
+    model_loader = ModelLoader(MODEL_ARTIFACT_DIR, MODEL_VERSION, INFERENCE_BACKEND, classifier_engine=CLASSIFIER_ENGINE)
+
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_SIZE,
+    ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+    disk_path=os.path.join(RESULT_CACHE_DIR, 'results.db') if RESULT_CACHE_DIR else None
+)
+
+embedding_store = EmbeddingStore(EMBEDDING_DIR) if EMBEDDING_DIR else None
+
+# Stage timings and cascade early exits, for /stats
+pipeline_stats = PipelineStats()
+
+# Prometheus metrics, served at /metrics. Per-request stage timings also go
+# out as a Server-Timing header.
+metrics_registry = metrics.Registry()
+http_requests = metrics_registry.counter(
+    'plant_http_requests_total', 'HTTP requests by route, method and status.', ('route', 'method', 'status'))
+http_latency = metrics_registry.histogram(
+    'plant_http_request_duration_seconds', 'Time to build the response, by route.', ('route',))
+http_in_flight = metrics_registry.gauge(
+    'plant_http_requests_in_flight', 'Requests being handled, by route.', ('route',))
+stage_latency = metrics_registry.histogram(
+    'plant_request_stage_duration_seconds', 'Time spent in each pipeline stage of a request.', ('stage',))
+model_batch_latency = metrics_registry.histogram(
+    'plant_model_batch_duration_seconds', 'Time per model batch, by step.', ('step',))
+predictions = metrics_registry.counter(
+    'plant_predictions_total', 'Identifications by predicted classifier label.', ('label',))
+
+# Profiles requests on demand; the stacks of these threads are sampled too,
+# since the model and decode work of a request runs on them
+request_profiler = RequestProfiler(
+    helper_threads=('segmentation-batcher', 'classification-batcher', 'decode', 'contribution-writer'),
+    sample_interval_ms=PROFILE_SAMPLE_INTERVAL_MS,
+)
 
 # --- 3. CREATE FLASK APP ---
 
 app = Flask(__name__)
+# Requests larger than this are refused (413) before they are read into memory
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
 CORS(app)
 
-print("\nFlask app created. Ready to serve requests.")
-
-# --- NEW MAPPING DICTIONARY ---
-NAME_MAPPER = {
-    'Alstonia Scholaris diseased (P2a)': 'Alstonia scholaris',
-    'Alstonia Scholaris healthy (P2b)': 'Alstonia scholaris',
-    'Arjun diseased (P1a)': 'Terminalia arjuna',
-    'Arjun healthy (P1b)': 'Terminalia arjuna',
-    'Bael diseased (P4b)': 'Aegle marmelos',
-    'Basil healthy (P8)': 'Ocimum tenuiflorum',
-    'Chinar diseased (P11b)': 'Platanus orientalis',
-    'Chinar healthy (P11a)': 'Platanus orientalis',
-    'Gauva diseased (P3b)': 'Psidium guajava',
-    'Gauva healthy (P3a)': 'Psidium guajava',
-    'Jamun diseased (P5b)': 'Syzygium cumini',
-    'Jamun healthy (P5a)': 'Syzygium cumini',
-    'Jatropha diseased (P6b)': 'Jatropha curcas',
-    'Jatropha healthy (P6a)': 'Jatropha curcas',
-    'Lemon diseased (P10b)': 'Citrus limon',
-    'Lemon healthy (P10a)': 'Citrus limon',
-    'Mango diseased (P0b)': 'Mangifera indica',
-    'Mango healthy (P0a)': 'Mangifera indica',
-    'Pomegranate diseased (P9b)': 'Punica granatum',
-    'Pomegranate healthy (P9a)': 'Punica granatum',
-    'Pongamia Pinnata diseased (P7b)': 'Millettia pinnata',
-    'Pongamia Pinnata healthy (P7a)': 'Millettia pinnata'
-}
-# --- END OF NEW SECTION ---
+print("\nFlask app created. Models are loading in the background (see /readyz).")
 
 # --- 4. HELPER FUNCTIONS (DATABASE) ---
 
-def get_db_connection():
-    """Connects to the SQLite database."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Bring the schema (tables and indexes) up to date before serving anything
+migrate(DATABASE_FILE)
+
+# Pooled, tuned connections: a read-only connection per thread and one shared
+# writer, with the database in WAL mode so readers never wait for /contribute
+db = Database(DATABASE_FILE)
+
+
+@app.teardown_request
+def release_db_reader(error=None):
+    # The dev server (and many WSGI servers) start a thread per request, so the
+    # request's read connection goes back to the pool instead of dying with it
+    db.release()
 
 
 def get_plant_profile(scientific_name):
     """Queries the database for a full plant profile."""
     profile = {}
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        cursor = db.reader().cursor()
         
         # 1. Get Species info (names)
         # --- UPDATED: Now selects all the new columns ---
@@ -118,7 +215,6 @@ def get_plant_profile(scientific_name):
         species_data = cursor.fetchone()
         
         if not species_data:
-            conn.close()
             return {"error": "Plant not found in database", "scientific_name": scientific_name}
         
         species_id = species_data['species_id']
@@ -143,74 +239,565 @@ def get_plant_profile(scientific_name):
         status_data = cursor.fetchone()
         profile['is_invasive'] = bool(status_data['is_invasive']) if status_data else False
 
-        # 4. Get Map Coordinates
-        cursor.execute("SELECT latitude, longitude FROM Observations WHERE species_id = ?", (species_id,))
-        obs_data = cursor.fetchall()
-        profile['locations'] = [{'lat': row['latitude'], 'lon': row['longitude']} for row in obs_data]
+        # 4. Get Map Coordinates (also pageable on their own at /locations/<name>)
+        cursor.execute("SELECT COUNT(*) FROM Observations WHERE species_id = ?", (species_id,))
+        profile['location_count'] = cursor.fetchone()[0]
+        profile['locations_url'] = f"/locations/{quote(scientific_name)}"
+        if PROFILE_INLINE_LOCATIONS:
+            cursor.execute("SELECT latitude, longitude FROM Observations WHERE species_id = ?", (species_id,))
+            obs_data = cursor.fetchall()
+            profile['locations'] = [{'lat': row['latitude'], 'lon': row['longitude']} for row in obs_data]
 
-        conn.close()
         return profile
 
     except Exception as e:
         print(f"Database error: {e}")
-        if conn:
-            conn.close()
         return {"error": str(e)}
 
+
+# Profiles for every species the classifier can name are built once at startup;
+# /contribute patches the affected species, so identification never waits on SQLite
+profile_cache = ProfileCache(get_plant_profile, ttl_seconds=PROFILE_CACHE_TTL_SECONDS)
+print(f"Profile cache warmed: {profile_cache.warm(sorted(set(NAME_MAPPER.values())))} species.")
+
+
+def profile_response(scientific_name):
+    """Sends a species profile straight from the cache, already serialised."""
+    _, body = profile_cache.get(scientific_name)
+    return Response(body, mimetype='application/json')
+
 # --- 5. HELPER FUNCTIONS (AI PIPELINE) ---
 
-def run_segmentation(image_bytes):
+def decode_image(image_bytes):
+    """Decodes raw image bytes into an upright RGB array, at most DECODE_MAX_SIDE pixels on its longest side.
+
+    The header is checked first and JPEGs are decoded at reduced resolution,
+    so a huge photo never allocates a full-size frame. Raises ValueError for
+    invalid or oversized images.
+    """
+    return image_decode.decode(image_bytes)
+
+
+def decode_image_or_error(image_bytes):
+    """decode_image() for batch work: returns (image, None) or (None, error message)."""
+    try:
+        return decode_image(image_bytes), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def run_segmentation(image_bytes, priority=INTERACTIVE):
     """Takes raw image bytes, runs U-Net, and returns a binary mask."""
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img = decode_image(image_bytes)
+    return img, segment_image(img, priority)
+
 
-    img_resized = cv2.resize(img, (SEG_IMG_HEIGHT, SEG_IMG_WIDTH))
-    img_resized = img_resized / 255.0
-    img_batch = np.expand_dims(img_resized, axis=0)
+def segment_image(img, priority=INTERACTIVE):
+    """Runs the U-Net on an already decoded image and returns its binary mask."""
+    # The scheduler stacks this image with any other waiting requests
+    return segmentation_scheduler(prepare_segmentation_input(img), priority)
 
-    pred_mask = segmentation_model.predict(img_batch)[0]
-    pred_mask = (pred_mask > 0.5).astype(np.uint8)
 
-    return img, pred_mask
+def run_classification(leaf_image, priority=INTERACTIVE):
+    """Takes the cropped leaf, runs ResNet+RF, and returns the species name."""
+    predicted_label, _ = run_classification_with_features(leaf_image, priority)
+    return predicted_label
 
 
-def segment_and_crop(original_image, mask):
-    """Applies the mask to the original image to cut out the leaf."""
-    mask_resized = cv2.resize(mask, (original_image.shape[1], original_image.shape[0]))
-    contours, _ = cv2.findContours(mask_resized, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+def run_classification_with_features(leaf_image, priority=INTERACTIVE):
+    """Like run_classification, but also returns the 2048-d ResNet50 features."""
+    predicted_label, features, _ = run_classification_scored(leaf_image, priority)
+    return predicted_label, features
 
-    if not contours:
-        return original_image
 
-    c = max(contours, key=cv2.contourArea)
-    x, y, w, h = cv2.boundingRect(c)
-    cropped_leaf = original_image[y:y + h, x:x + w]
+def run_classification_scored(leaf_image, priority=INTERACTIVE):
+    """Returns (label, features, confidence), confidence being the classifier's probability for the label."""
+    # The scheduler stacks this image with any other waiting requests
+    return classification_scheduler(prepare_classification_input(leaf_image), priority)
 
-    return cropped_leaf
 
+def rank_features(features, top):
+    """The `top` best (label, score) pairs for one feature vector (ranked in the model server, if one is set)."""
+    if MODEL_SERVER:
+        return model_loader.rank([features], top)[0]
+    return batch_inference.rank_batch(classification_model, [features], top)[0]
 
-def run_classification(leaf_image):
-    """Takes the cropped leaf, runs ResNet+RF, and returns the species name."""
-    img_resized = cv2.resize(leaf_image, (CLASS_IMG_HEIGHT, CLASS_IMG_WIDTH))
-    img_array = img_to_array(img_resized)
-    img_batch = np.expand_dims(img_array, axis=0)
-    img_preprocessed = preprocess_input(img_batch)
 
-    features = resnet_model.predict(img_preprocessed)
-    features_flat = features.flatten()
-    prediction = classification_model.predict([features_flat])
+def identify_image(image_bytes, timer=None, top=0):
+    """Runs the pipeline on one upload and returns its result, {'label': ...}.
+
+    With the cascade on, the whole image is classified first and segmentation
+    only runs when that answer's confidence is below CASCADE_THRESHOLD.
+    Results are cached by content hash, so re-uploads of the same photo (and
+    concurrent identical uploads) only run the models once. Stage timings go
+    into `timer` (a StageTimer) and the pipeline statistics. With top > 0 the
+    result also holds 'top', the `top` best (label, score) pairs.
+    """
+    image_hash = content_key(image_bytes)
+    timer = timer or StageTimer()
+
+    def result(predicted_label, features):
+        if not top:
+            return {'label': predicted_label}
+        with timer.stage('ranking'):
+            # Ranked as deep as any request may ask, so one cached entry serves every N
+            ranking = rank_features(features, TOP_PREDICTIONS_MAX)
+            return {'label': predicted_label, 'top': ranking, 'top_n': TOP_PREDICTIONS_MAX}
+
+    def compute():
+        with timer.stage('decode'):
+            img = decode_image(image_bytes)
+
+        confidence = None
+        if CASCADE_THRESHOLD > 0:
+            with timer.stage('classify_whole'):
+                predicted_label, features, confidence = run_classification_scored(img)
+            if confidence >= CASCADE_THRESHOLD:
+                pipeline_stats.record(timer.timings, early_exit=True, confidence=confidence)
+                record_embeddings([features], [image_hash], source='predict_whole')
+                return result(predicted_label, features)
+
+        with timer.stage('segmentation'):
+            mask = segment_image(img)
+        with timer.stage('crop'):
+            cropped_leaf = segment_and_crop(img, mask)
+        with timer.stage('classification'):
+            predicted_label, features = run_classification_with_features(cropped_leaf)
+        pipeline_stats.record(timer.timings, early_exit=False, confidence=confidence)
+        record_embeddings([features], [image_hash])
+        return result(predicted_label, features)
+
+    if not top:
+        return result_cache.get_or_compute(image_hash, compute)
+    # Results cached by a plain /predict hold no ranking, so those are computed again
+    ranked = result_cache.get_or_compute(image_hash, compute, accept=lambda cached: cached.get('top_n', 0) >= top)
+    return dict(ranked, top=ranked['top'][:top])
+
+
+def segment_batch(images):
+    """Runs one U-Net forward pass over a list of 256x256 images (in the model server, if one is set)."""
+    if MODEL_SERVER:
+        return model_loader.segment(images)
+    timer = StageTimer()
+    masks = batch_inference.segment_batch(inference_backend, images, timer)
+    observe_model_batch(timer)
+    return masks
+
+
+def classify_batch(leaf_arrays):
+    """Runs one ResNet50 pass and one classifier-head call over a list of 224x224 leaves.
+
+    Returns a (label, features, confidence) triple per leaf, where confidence
+    is the classifier's probability for the returned label.
+    """
+    if MODEL_SERVER:
+        return model_loader.classify(leaf_arrays)
+    timer = StageTimer()
+    results = batch_inference.classify_batch(inference_backend, classification_model, leaf_arrays, timer)
+    observe_model_batch(timer)
+    return results
+
+
+def observe_model_batch(timer):
+    for step, ms in timer.timings.items():
+        model_batch_latency.observe(ms / 1000.0, step)
+
+# --- 5.5. INFERENCE SCHEDULERS ---
+
+segmentation_scheduler = None
+classification_scheduler = None
+
+
+def on_models_ready(loader):
+    """Called by the model loader once every model is loaded and warm."""
+    global segmentation_model, resnet_model, classification_model, inference_backend
+    global segmentation_scheduler, classification_scheduler
+
+    # Cached results from an older classifier (or another cascade threshold) must not be served
+    result_cache.set_model_version(f"{loader.classifier_version}:cascade={CASCADE_THRESHOLD}")
+
+    if MODEL_SERVER:
+        # The model server batches images from every worker, so each one is sent straight away
+        segmentation_scheduler = RemoteScheduler('segmentation', loader, 'segment')
+        classification_scheduler = RemoteScheduler('classification', loader, 'classify')
+        return
+
+    segmentation_model = loader.segmentation_model
+    resnet_model = loader.resnet_model
+    classification_model = loader.classification_model
+    inference_backend = loader.inference_backend
+
+    segmentation_scheduler = MicroBatcher(
+        'segmentation', segment_batch,
+        max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS
+    )
+    classification_scheduler = MicroBatcher(
+        'classification', classify_batch,
+        max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS
+    )
+    print(f"Inference schedulers started (max batch {BATCH_MAX_SIZE}, max wait {BATCH_MAX_WAIT_MS} ms).")
+
+
+model_loader.on_ready = on_models_ready
+model_loader.start()
+if MODEL_SERVER:
+    atexit.register(model_loader.close)
+
+# Shared thread pool for decoding and cropping (OpenCV releases the GIL)
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='decode')
+
+# Background work that must not slow down a request
+embedding_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embeddings')
+verification_pool = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix='verification')
+heatmap_rebuilder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='heatmap')
+heatmap_rebuilds = set()  # species queued on heatmap_rebuilder
+heatmap_rebuilds_lock = threading.Lock()
+
+
+def insert_observation(conn, contribution):
+    """Inserts one queued contribution (inside the queue's group commit). Returns its observation_id."""
+    cursor = conn.execute(
+        """
+        INSERT INTO Observations 
+        (species_id, latitude, longitude, data_source, timestamp, health_condition, image_url,
+         is_verified, verification_status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            contribution['species_id'],
+            contribution['latitude'],
+            contribution['longitude'],
+            'Crowdsourced',
+            contribution['timestamp'],
+            contribution['health_condition'],
+            contribution['image_path'],
+            False, # Set by verify_contribution() once the AI has checked the image
+            'pending'
+        )
+    )
+    # Same transaction, so the heatmap grids always match Observations
+    heatmap.add_observation(conn, contribution['species_id'], contribution['latitude'], contribution['longitude'])
+    return cursor.lastrowid
+
+
+def contributions_committed(contributions):
+    """Runs after each group commit: patch the cached profiles and queue the AI verification."""
+    for contribution in contributions:
+        profile_cache.add_location(contribution['scientific_name'], contribution['latitude'], contribution['longitude'])
+        verification_pool.submit(
+            verify_contribution, contribution['observation_id'], contribution['image_path'], contribution['scientific_name']
+        )
+        print(f"--- CROWDSOURCE: New observation for '{contribution['scientific_name']}' added! ---")
+
+
+image_store = ImageStore(UPLOAD_DIR, workers=THUMBNAIL_WORKERS)
+atexit.register(image_store.close)
+
+contribution_queue = ContributionQueue(
+    db, image_store, insert_observation, on_committed=contributions_committed,
+    max_batch_size=CONTRIBUTION_BATCH_MAX_SIZE, max_wait_ms=CONTRIBUTION_BATCH_MAX_WAIT_MS
+)
+# Everything accepted by /contribute is committed before the process exits
+atexit.register(contribution_queue.close)
+
+
+def run_pipeline_batch(images, cascade=True, timer=None):
+    """Runs segmentation, cropping and classification over a list of decoded images.
+
+    Images are pushed through the models in stacked chunks of
+    PREDICT_BATCH_CHUNK_SIZE. With the cascade on (and cascade=True), the
+    whole images are classified first and only the uncertain ones are
+    segmented. Stage times (summed over the chunks) go into `timer`.
+    Returns one (label, features, early_exit) triple per image, in order.
+    """
+    cascade = cascade and CASCADE_THRESHOLD > 0
+    timer = timer or StageTimer()
+    results = []
+    for start in range(0, len(images), PREDICT_BATCH_CHUNK_SIZE):
+        chunk = images[start:start + PREDICT_BATCH_CHUNK_SIZE]
+        chunk_results = [None] * len(chunk)
+        hard = list(range(len(chunk)))
+
+        if cascade:
+            with timer.stage('classify_whole'):
+                whole = classify_batch(list(decode_pool.map(prepare_classification_input, chunk)))
+            hard = [i for i, (_, _, confidence) in enumerate(whole) if confidence < CASCADE_THRESHOLD]
+            for i, (label, features, confidence) in enumerate(whole):
+                if i not in hard:
+                    chunk_results[i] = (label, features, True)
+                pipeline_stats.record({}, early_exit=i not in hard, confidence=confidence)
+
+        if hard:
+            hard_images = [chunk[i] for i in hard]
+            with timer.stage('segmentation'):
+                masks = segment_batch(list(decode_pool.map(prepare_segmentation_input, hard_images)))
+            with timer.stage('crop'):
+                crops = list(decode_pool.map(segment_and_crop, hard_images, masks))
+            with timer.stage('classification'):
+                classified = classify_batch(list(decode_pool.map(prepare_classification_input, crops)))
+            for i, (label, features, _) in zip(hard, classified):
+                chunk_results[i] = (label, features, False)
+            if not cascade:
+                for _ in hard:
+                    pipeline_stats.record({}, early_exit=False)
+
+        results.extend(chunk_results)
+    return results
+
+
+def record_embeddings(features, image_hashes, observation_ids=None, source='predict'):
+    """Queues ResNet50 embeddings for the embedding store, off the request path."""
+    if embedding_store is not None:
+        embedding_writer.submit(append_embeddings, np.asarray(features), list(image_hashes), observation_ids, source)
+
+
+def append_embeddings(features, image_hashes, observation_ids, source):
+    """Writes embeddings to the store. Identification-only images are stored once per hash."""
+    try:
+        if observation_ids is None:
+            keep = [i for i, image_hash in enumerate(image_hashes) if not embedding_store.has_image(image_hash)]
+            features = features[keep]
+            image_hashes = [image_hashes[i] for i in keep]
+        if image_hashes:
+            embedding_store.append(
+                features, image_hashes, observation_ids,
+                # Backend precision included, so TFLite int8/float16 features are never mixed with float32 ones
+                source=source, model_version=model_loader.feature_version
+            )
+    except Exception as e:
+        print(f"Embedding store error: {e}")
+
+
+def queue_heatmap_rebuild(species_id):
+    """Rebuilds a stale species' heatmap grids in the background, once however many tile requests ask."""
+    with heatmap_rebuilds_lock:
+        if species_id in heatmap_rebuilds:
+            return
+        heatmap_rebuilds.add(species_id)
+    heatmap_rebuilder.submit(rebuild_heatmap, species_id)
+
+
+def rebuild_heatmap(species_id):
+    try:
+        with db.write() as conn:
+            heatmap.rebuild_stale(conn, [species_id])
+    except Exception as e:
+        print(f"Could not rebuild the heatmap of species {species_id}: {e}")
+    finally:
+        with heatmap_rebuilds_lock:
+            heatmap_rebuilds.discard(species_id)
+
+
+verification_counters = Counter()
+verification_lock = threading.Lock()
+
+
+def verify_contribution(observation_id, image_path, scientific_name):
+    """Checks a contributed image with the AI pipeline and records the outcome on its observation.
+
+    Runs on verification_pool at BACKGROUND priority, so /predict requests are
+    always batched ahead of it. Also stores the image's embedding.
+    """
+    if not model_loader.wait():
+        return  # No models: the observation stays pending until the next start
+
+    predicted_label = None
+    try:
+        with open(image_path, 'rb') as f:
+            image_bytes = f.read()
+        original_image, mask = run_segmentation(image_bytes, BACKGROUND)
+        cropped_leaf = segment_and_crop(original_image, mask)
+        predicted_label, features = run_classification_with_features(cropped_leaf, BACKGROUND)
+        matches = NAME_MAPPER.get(predicted_label) == scientific_name
+        status = 'verified' if matches else 'mismatch'
+    except Exception as e:
+        print(f"Could not verify contribution {observation_id}: {e}")
+        features, matches, status = None, None, 'failed'
+
+    with db.write() as conn:
+        conn.execute(
+            """
+            UPDATE Observations
+            SET verification_status = ?, predicted_label = ?, label_matches = ?, is_verified = ?, verified_at = ?
+            WHERE observation_id = ?
+            """,
+            (status, predicted_label, matches, bool(matches), time.strftime('%Y-%m-%dT%H:%M:%SZ'), observation_id)
+        )
+    with verification_lock:
+        verification_counters[status] += 1
+
+    if features is not None and embedding_store is not None:
+        append_embeddings(np.asarray([features]), [content_key(image_bytes)], [observation_id], 'contribute')
 
-    return prediction[0]
+
+def queue_pending_verifications():
+    """Re-queues observations still waiting for verification (e.g. after a restart)."""
+    rows = db.reader().execute(
+        """
+        SELECT o.observation_id, o.image_url, s.scientific_name
+        FROM Observations o JOIN Species s ON s.species_id = o.species_id
+        WHERE o.verification_status = 'pending'
+        """
+    ).fetchall()
+    for row in rows:
+        verification_pool.submit(verify_contribution, row['observation_id'], row['image_url'], row['scientific_name'])
+    return len(rows)
+
+
+def verification_stats():
+    with verification_lock:
+        stats = {status: verification_counters[status] for status in ('verified', 'mismatch', 'failed')}
+    stats['pending'] = db.reader().execute(
+        "SELECT COUNT(*) FROM Observations WHERE verification_status = 'pending'"
+    ).fetchone()[0]
+    return stats
+
+
+print(f"Contributions waiting for verification: {queue_pending_verifications()}")
 
 # --- 6. FLASK API ROUTES ---
 
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.timer = StageTimer()
+    # The URL rule (e.g. /images/<key>), not the path, so the label set stays small
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_in_flight.inc(g.metrics_route)
+
+
+@app.after_request
+def finish_request_metrics(response):
+    """Counts the request, observes its latency and stage timings, and adds the Server-Timing header."""
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    http_requests.inc(g.metrics_route, request.method, str(response.status_code))
+    http_latency.observe(elapsed, g.metrics_route)
+    for stage, ms in g.timer.timings.items():
+        stage_latency.observe(ms / 1000.0, stage)
+    response.headers['Server-Timing'] = metrics.server_timing(g.timer.timings, elapsed * 1000.0)
+    return response
+
+
+@app.teardown_request
+def end_request_metrics(error=None):
+    if 'metrics_route' in g:
+        http_in_flight.dec(g.metrics_route)
+
+
+def has_profile_token():
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(request.headers.get('X-Profile-Token', ''), PROFILE_TOKEN)
+
+
+@app.before_request
+def start_request_profile():
+    """Profiles this request if a profiling window wants it, or if it carries the profiling token."""
+    if not PROFILE_TOKEN or g.metrics_route.startswith('/debug/'):
+        return
+    if request_profiler.should_profile(g.metrics_route):
+        g.profile = request_profiler.start()
+    elif 'X-Profile-Token' in request.headers and has_profile_token():
+        g.profile = request_profiler.force_start()
+
+
+@app.teardown_request
+def stop_request_profile(error=None):
+    session = g.pop('profile', None)
+    if session is not None:
+        request_profiler.stop(session, g.metrics_route)
+
+
+@metrics_registry.collector
+def runtime_metrics():
+    """Values other components already keep, read at scrape time."""
+    status = model_loader.status()
+    load_seconds = status.get('load_seconds') or status.get('server', {}).get('load_seconds', {})
+    contributions = contribution_queue.stats()
+    queue_depths = [({'queue': 'contributions'}, contributions['queue_depth'])]
+    if not MODEL_SERVER:
+        for scheduler in (segmentation_scheduler, classification_scheduler):
+            if scheduler:
+                queue_depths.append(({'queue': scheduler.name}, scheduler.stats()['queue_depth']))
+    cache = result_cache.stats()
+    pipeline = pipeline_stats.stats()
+    with verification_lock:
+        verifications = dict(verification_counters)
+    return [
+        ('plant_models_ready', 'gauge', '1 once every model is loaded and warm.',
+         [({}, int(model_loader.is_ready))]),
+        ('plant_model_load_seconds', 'gauge', 'Time each model-loading step took.',
+         [({'step': step}, seconds) for step, seconds in sorted(load_seconds.items())]),
+        ('plant_queue_depth', 'gauge', 'Items waiting in each queue.', queue_depths),
+        ('plant_result_cache_lookups_total', 'counter', 'Identification result-cache lookups.',
+         [({'result': 'hit'}, cache['hits']), ({'result': 'miss'}, cache.get('misses', 0))]),
+        ('plant_cascade_images_total', 'counter', 'Images through the pipeline, by whether the cascade exited early.',
+         [({'early_exit': 'true'}, pipeline['early_exits']),
+          ({'early_exit': 'false'}, pipeline['images'] - pipeline['early_exits'])]),
+        ('plant_contributions_total', 'counter', 'Contributions by queue outcome.',
+         [({'state': state}, contributions[state]) for state in ('accepted', 'committed', 'failed')]),
+        ('plant_verifications_total', 'counter', 'Verified contributions by outcome.',
+         [({'status': status}, n) for status, n in sorted(verifications.items())]),
+    ]
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text-format metrics for this process."""
+    return Response(metrics_registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def models_not_ready_response():
+    """503 answer for AI routes while the models are loading (or failed to load)."""
+    if model_loader.state == 'failed':
+        return jsonify({"error": "Server is not ready or models not loaded"}), 503
+
+    response = jsonify({"error": "Models are still loading. Please retry shortly."})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(MODELS_LOADING_RETRY_AFTER)
+    return response
+
+
 @app.route('/', methods=['GET'])
 def index():
     """A simple test route to see if the server is alive."""
     return "Hello! The Plant API server is running."
 
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return jsonify({"status": "ok"})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: 200 once every model is loaded and warm, 503 before that."""
+    return jsonify(model_loader.status()), (200 if model_loader.is_ready else 503)
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Reports runtime statistics, e.g. inference batch sizes and queue waits."""
+    batching = {}
+    if MODEL_SERVER:
+        # The server's batches (across all workers) and this worker's round trips to it
+        batching = model_loader.stats() if model_loader.is_ready else {}
+    else:
+        for scheduler in (segmentation_scheduler, classification_scheduler):
+            if scheduler:
+                batching[scheduler.name] = scheduler.stats()
+    return jsonify({
+        "batching": batching,
+        "result_cache": result_cache.stats(),
+        "profile_cache": profile_cache.stats(),
+        "pipeline": pipeline_stats.stats(),
+        "contributions": contribution_queue.stats(),
+        "images": image_store.stats(),
+        "verification": verification_stats(),
+    })
+
+
 @app.route('/predict', methods=['POST'])
 def predict():
     """Main endpoint: receives an image and returns a full JSON profile."""
@@ -222,30 +809,307 @@ def predict():
     if file.filename == '':
         return jsonify({"error": "No file selected"}), 400
 
-    if file and segmentation_model and classification_model:
+    # ?top=N also lists the N most likely labels with their scores
+    top = request.args.get('top', '0')
+    if not top.isdigit() or int(top) > TOP_PREDICTIONS_MAX:
+        return jsonify({"error": f"top must be a whole number from 0 to {TOP_PREDICTIONS_MAX}"}), 400
+    top = int(top)
+
+    if file and model_loader.is_ready:
         try:
             image_bytes = file.read()
-
-            original_image, mask = run_segmentation(image_bytes)
-            cropped_leaf = segment_and_crop(original_image, mask)
-            predicted_label = run_classification(cropped_leaf)
+            result = identify_image(image_bytes, g.timer, top)
+            predicted_label = result['label']
+            predictions.inc(predicted_label)
 
             scientific_name_to_find = NAME_MAPPER.get(predicted_label, None)
+            top_predictions = [
+                {"label": label, "scientific_name": NAME_MAPPER.get(label), "score": score}
+                for label, score in result.get('top', [])
+            ]
 
             if not scientific_name_to_find:
-                return jsonify({
+                response = {
                     "error": "Plant identified, but not in our medicinal database.",
                     "scientific_name": predicted_label
-                })
+                }
+                if top:
+                    response["top_predictions"] = top_predictions
+                return jsonify(response)
 
-            plant_profile = get_plant_profile(scientific_name_to_find)
-            return jsonify(plant_profile)
+            with g.timer.stage('db'):
+                if top:
+                    profile, _ = profile_cache.get(scientific_name_to_find)
+                    return jsonify(dict(profile, top_predictions=top_predictions))
+                return profile_response(scientific_name_to_find)
 
+        except ValueError as e:
+            return jsonify({"error": f"Invalid image: {e}"}), 400
         except Exception as e:
             print(f"Error during prediction: {e}")
             return jsonify({"error": f"An error occurred: {e}"}), 500
 
-    return jsonify({"error": "Server is not ready or models not loaded"}), 503
+    return models_not_ready_response()
+
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """Identifies many images in one request.
+
+    Expects a multipart list of files under the 'files' field. Returns one
+    result per file, in input order, plus each distinct species profile once.
+    """
+    files = [f for f in request.files.getlist('files') if f and f.filename != '']
+    if not files:
+        return jsonify({"error": "No files in the request (use the 'files' field)"}), 400
+    if len(files) > PREDICT_BATCH_MAX_FILES:
+        return jsonify({"error": f"Too many files: at most {PREDICT_BATCH_MAX_FILES} per request"}), 413
+
+    if not model_loader.is_ready:
+        return models_not_ready_response()
+
+    try:
+        results = [{"filename": f.filename} for f in files]
+        uploads = [f.read() for f in files]
+        keys = [content_key(image_bytes) for image_bytes in uploads]
+
+        # 1. Reuse cached results; decode the remaining uploads in parallel
+        labels = {}
+        for i, key in enumerate(keys):
+            cached = result_cache.get(key)
+            if cached is not None:
+                labels[i] = cached['label']
+
+        pending = [i for i in range(len(files)) if i not in labels]
+        images = {}
+        with g.timer.stage('decode'):
+            decoded_uploads = list(decode_pool.map(decode_image_or_error, [uploads[i] for i in pending]))
+        for i, (image, error) in zip(pending, decoded_uploads):
+            images[i] = image
+            if error:
+                results[i]["error"] = f"Invalid image: {error}"
+
+        decoded = [i for i in pending if images[i] is not None]
+
+        # 2. Segment and classify the decodable images as stacked batches
+        if decoded:
+            pipeline_results = run_pipeline_batch([images[i] for i in decoded], timer=g.timer)
+            for i, (predicted_label, _, _) in zip(decoded, pipeline_results):
+                labels[i] = predicted_label
+                result_cache.put(keys[i], {'label': predicted_label})
+            for early_exit, source in ((False, 'predict'), (True, 'predict_whole')):
+                picked = [(keys[i], features) for i, (_, features, exited) in zip(decoded, pipeline_results)
+                          if exited == early_exit]
+                if picked:
+                    record_embeddings([features for _, features in picked], [key for key, _ in picked], source=source)
+
+        # 3. Fetch each distinct species profile only once
+        profiles = {}
+        for i, predicted_label in sorted(labels.items()):
+            # Every returned label counts, cached or not, as in /predict
+            predictions.inc(predicted_label)
+            scientific_name = NAME_MAPPER.get(predicted_label, None)
+            results[i]["predicted_label"] = predicted_label
+
+            if not scientific_name:
+                results[i]["error"] = "Plant identified, but not in our medicinal database."
+                continue
+
+            if scientific_name not in profiles:
+                with g.timer.stage('db'):
+                    profiles[scientific_name], _ = profile_cache.get(scientific_name)
+            results[i]["scientific_name"] = scientific_name
+
+        return jsonify({"results": results, "profiles": profiles})
+
+    except Exception as e:
+        print(f"Error during batch prediction: {e}")
+        return jsonify({"error": f"An error occurred: {e}"}), 500
+
+# --- 6.1. FLASK API ROUTES (PROFILING) ---
+
+@app.route('/debug/profile', methods=['GET', 'POST', 'DELETE'])
+def debug_profile():
+    """GET: profiling status. POST: profile the next ?requests=N requests. DELETE: stop early.
+
+    POST also takes sample_rate (0-1, profile a random share of requests),
+    route (e.g. /predict) and memory=1 (tracemalloc). Results are at
+    /debug/profile/pstats, /debug/profile/collapsed and /debug/profile/memory.
+    """
+    if not PROFILE_TOKEN:
+        return jsonify({"error": "Profiling is disabled (set PLANT_PROFILE_TOKEN)"}), 404
+    if not has_profile_token():
+        return jsonify({"error": "Missing or wrong X-Profile-Token"}), 403
+
+    if request.method == 'POST':
+        params = request.get_json(silent=True) or request.values
+        try:
+            requests_wanted = int(params.get('requests', 10))
+            sample_rate = float(params.get('sample_rate', 1.0))
+            if not 1 <= requests_wanted <= PROFILE_MAX_REQUESTS:
+                raise ValueError(f"requests must be between 1 and {PROFILE_MAX_REQUESTS}")
+            if not 0 < sample_rate <= 1:
+                raise ValueError("sample_rate must be in (0, 1]")
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid profiling request: {e}"}), 400
+        memory = str(params.get('memory', 'false')).lower() in ('1', 'true', 'yes')
+        request_profiler.arm(requests_wanted, sample_rate, params.get('route') or None, memory)
+    elif request.method == 'DELETE':
+        request_profiler.disarm()
+    return jsonify(request_profiler.status())
+
+
+@app.route('/debug/profile/<kind>', methods=['GET'])
+def debug_profile_results(kind):
+    """Downloads the current window's results: pstats (?format=text for a summary), collapsed or memory."""
+    if not PROFILE_TOKEN:
+        return jsonify({"error": "Profiling is disabled (set PLANT_PROFILE_TOKEN)"}), 404
+    if not has_profile_token():
+        return jsonify({"error": "Missing or wrong X-Profile-Token"}), 403
+
+    if kind == 'pstats':
+        if request.args.get('format') == 'text':
+            body = request_profiler.pstats_text()
+            mimetype = 'text/plain'
+        else:
+            body = request_profiler.pstats_bytes()
+            mimetype = 'application/octet-stream'
+        if body is None:
+            return jsonify({"error": "No requests profiled yet"}), 404
+        response = Response(body, mimetype=mimetype)
+        if mimetype == 'application/octet-stream':
+            response.headers['Content-Disposition'] = 'attachment; filename=plant-requests.pstats'
+        return response
+    if kind == 'collapsed':
+        response = Response(request_profiler.collapsed(), mimetype='text/plain')
+        response.headers['Content-Disposition'] = 'attachment; filename=plant-requests.collapsed'
+        return response
+    if kind == 'memory':
+        return jsonify(request_profiler.memory())
+    return jsonify({"error": f"Unknown profile result '{kind}' (pstats, collapsed or memory)"}), 404
+
+
+# --- 6.2. FLASK API ROUTES (MAP QUERIES) ---
+
+def spatial_filters():
+    """Reads the optional species / medicinal_only / limit query parameters shared by the map routes."""
+    names = [name.strip() for name in request.args.getlist('species') for name in name.split(',') if name.strip()]
+    species_ids = None
+    if names:
+        species_ids = spatial.species_ids_for_names(db.reader(), names)
+        if not species_ids:
+            raise LookupError(f"None of the requested species were found: {', '.join(names)}")
+
+    medicinal_only = request.args.get('medicinal_only', 'false').lower() in ('1', 'true', 'yes')
+
+    limit = int(request.args.get('limit', SPATIAL_DEFAULT_LIMIT))
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    return species_ids, medicinal_only, min(limit, SPATIAL_MAX_LIMIT)
+
+
+@app.route('/observations', methods=['GET'])
+def observations():
+    """Observations inside a map viewport: ?bbox=min_lon,min_lat,max_lon,max_lat[&species=...][&limit=...]"""
+    if 'bbox' not in request.args:
+        return jsonify({"error": "Missing bbox (min_lon,min_lat,max_lon,max_lat)"}), 400
+
+    try:
+        bbox = spatial.parse_bbox(request.args['bbox'])
+        species_ids, medicinal_only, limit = spatial_filters()
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+
+    rows = spatial.observations_in_bbox(db.reader(), bbox, species_ids, medicinal_only, limit)
+    return jsonify({"count": len(rows), "limit": limit, "observations": rows})
+
+
+@app.route('/nearby', methods=['GET'])
+def nearby():
+    """Observations within a radius, nearest first: ?lat=&lon=&radius_km=[&species=...][&medicinal_only=true]"""
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        radius_km = float(request.args.get('radius_km', 5))
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError("lat/lon out of range")
+        if not (0 < radius_km <= 500):
+            raise ValueError("radius_km must be between 0 and 500")
+        species_ids, medicinal_only, limit = spatial_filters()
+    except KeyError:
+        return jsonify({"error": "Missing lat or lon"}), 400
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+
+    rows = spatial.observations_near(db.reader(), lat, lon, radius_km, species_ids, medicinal_only, limit)
+    return jsonify({"count": len(rows), "limit": limit, "observations": rows})
+
+
+@app.route('/heatmap/<path:scientific_name>/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def heatmap_tile(scientific_name, z, x, y):
+    """One precomputed density tile for a species: non-empty cells of a grid x grid raster."""
+    if not heatmap.valid_tile(z, x, y):
+        return jsonify({"error": f"No heatmap tile {z}/{x}/{y} (zoom 0-{heatmap.MAX_ZOOM})"}), 404
+
+    species_ids = spatial.species_ids_for_names(db.reader(), [scientific_name])
+    if not species_ids:
+        return jsonify({"error": f"Species '{scientific_name}' not found in our database."}), 404
+
+    # Observations of this species were moved or deleted since its grids were built:
+    # this request gets the last built tile, and the rebuild happens off the request path
+    if heatmap.is_stale(db.reader(), species_ids[0]):
+        queue_heatmap_rebuild(species_ids[0])
+
+    return jsonify(heatmap.tile(db.reader(), species_ids[0], z, x, y))
+
+
+@app.route('/locations/<path:scientific_name>', methods=['GET'])
+def species_locations(scientific_name):
+    """One page of a species' coordinates, streamed: ?after=<cursor>&limit=N&format=json|columnar|f32
+
+    The next page starts at the returned next_after (JSON field, and the
+    X-Next-After header for every format); it is null/absent on the last page.
+    """
+    try:
+        after = int(request.args.get('after', 0))
+        limit = int(request.args.get('limit', LOCATIONS_DEFAULT_PAGE))
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        limit = min(limit, LOCATIONS_MAX_PAGE)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+
+    fmt = request.args.get('format', 'json')
+    if fmt not in locations.FORMATS:
+        return jsonify({"error": f"Unknown format '{fmt}' (use one of: {', '.join(locations.FORMATS)})"}), 400
+
+    conn = db.reader()
+    species_ids = spatial.species_ids_for_names(conn, [scientific_name])
+    if not species_ids:
+        return jsonify({"error": f"Species '{scientific_name}' not found in our database."}), 404
+
+    count, next_after = locations.page_bounds(conn, species_ids[0], after, limit)
+    header = {"scientific_name": scientific_name, "count": count, "next_after": next_after}
+    # The rows are read while the body streams, after the request's teardown,
+    # so the connection stays with this response until it is closed
+    conn = db.detach()
+    body = locations.encode(locations.iter_coordinates(conn, species_ids[0], after, limit), fmt, header)
+
+    headers = {'X-Location-Count': str(count), 'Vary': 'Accept-Encoding'}
+    if next_after is not None:
+        headers['X-Next-After'] = str(next_after)
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = locations.gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+
+    response = Response(body, mimetype=locations.MIMETYPES[fmt], headers=headers)
+    response.call_on_close(lambda: db.release(conn))
+    return response
+
 # --- 6.5. FLASK API ROUTE (FOR CROWDSOURCING) ---
 
 @app.route('/contribute', methods=['POST'])
@@ -265,58 +1129,86 @@ def contribute():
     if not all([file, scientific_name, latitude, longitude]):
         return jsonify({"error": "Missing required data (file, name, lat, or lon)"}), 400
 
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except ValueError:
+        return jsonify({"error": "Latitude and longitude must be numbers"}), 400
+    # Also rejects nan and inf, which compare false
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return jsonify({"error": "Latitude must be between -90 and 90 and longitude between -180 and 180"}), 400
+
+    image_bytes = file.read()
+    if image_extension(image_bytes) is None:
+        return jsonify({"error": "The file is not a supported image (JPEG, PNG, WebP, GIF or BMP)"}), 400
+
     # 2. Find the species_id in our database
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT species_id FROM Species WHERE scientific_name = ?", (scientific_name,))
-        species_data = cursor.fetchone()
+        with g.timer.stage('db'):
+            cursor = db.reader().cursor()
+            cursor.execute("SELECT species_id FROM Species WHERE scientific_name = ?", (scientific_name,))
+            species_data = cursor.fetchone()
         
         if not species_data:
-            conn.close()
             return jsonify({"error": f"Species '{scientific_name}' not found in our database."}), 404
             
         species_id = species_data['species_id']
 
-        # 3. Save the image to the 'uploads' folder
-        # We create a unique filename to avoid overwrites
-        filename = f"{species_id}_{int(time.time())}_{file.filename}"
-        image_path = os.path.join('uploads', filename)
-        file.save(image_path)
-        
-        # 4. Insert the new observation into the database
-        cursor.execute(
-            """
-            INSERT INTO Observations 
-            (species_id, latitude, longitude, data_source, timestamp, health_condition, image_url, is_verified)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                species_id,
-                float(latitude),
-                float(longitude),
-                'Crowdsourced',
-                time.strftime('%Y-%m-%dT%H:%M:%SZ'), # ISO 8601 format
-                health_condition,
-                image_path,
-                True # We'll assume True since our AI will verify it first
-            )
-        )
-        
-        conn.commit()
-        conn.close()
-        
-        print(f"--- CROWDSOURCE: New observation for '{scientific_name}' added! ---")
-        return jsonify({"success": True, "message": "Contribution received. Thank you!"})
+        # 3. Queue the observation. The image is stored (once per distinct
+        # content) and the row inserted by the contribution queue's writer,
+        # batched with other contributions.
+        with g.timer.stage('queue'):
+            contribution_id = contribution_queue.submit({
+                'species_id': species_id,
+                'scientific_name': scientific_name,
+                'latitude': latitude,
+                'longitude': longitude,
+                'health_condition': health_condition,
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ'), # ISO 8601 format
+                'image_bytes': image_bytes,
+            })
+
+        return jsonify({
+            "success": True,
+            "message": "Contribution received. Thank you!",
+            "contribution_id": contribution_id,
+            "status_url": f"/contribute/{contribution_id}",
+        }), 202
 
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         print(f"Error during contribution: {e}")
-        if conn:
-            conn.close()
         return jsonify({"error": f"An error occurred: {e}"}), 500
 
+
+@app.route('/contribute/<contribution_id>', methods=['GET'])
+def contribution_status(contribution_id):
+    """Whether a queued contribution has been committed yet (and its observation_id once it has)."""
+    status = contribution_queue.status(contribution_id)
+    if status is None:
+        return jsonify({"error": "Unknown contribution id"}), 404
+    return jsonify(dict(status, contribution_id=contribution_id))
+
+
+@app.route('/images/<key>', methods=['GET'])
+def stored_image(key):
+    """A contributed image by content hash: ?size=thumb|preview|original (default thumb)."""
+    size = request.args.get('size', 'thumb')
+    if size != 'original' and size not in VARIANT_SIZES:
+        return jsonify({"error": f"Unknown size '{size}'"}), 400
+
+    path = image_store.path(key, size)
+    if path is None:
+        return jsonify({"error": "Image not found"}), 404
+
+    # Content-addressed, so a URL never changes what it points to
+    response = send_file(os.path.abspath(path), max_age=365 * 24 * 3600)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 # --- 7. START THE SERVER ---
 
 if __name__ == '__main__':
+    # Exit through atexit on SIGTERM too, so queued contributions are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run(host='0.0.0.0', port=5000, debug=False)
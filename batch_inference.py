@@ -0,0 +1,116 @@
+import numpy as np
+import cv2  # This is opencv-python
+from pipeline_stats import StageTimer
+
+# Shared by the web app (in-process models), model_server.py and the offline
+# tools. Only numpy and OpenCV are imported here, so a web worker that sends its
+# work to a model server never loads TensorFlow.
+
+# Model input sizes
+SEG_IMG_HEIGHT, SEG_IMG_WIDTH = 256, 256
+CLASS_IMG_HEIGHT, CLASS_IMG_WIDTH = 224, 224
+
+# ResNet50 'caffe' preprocessing: RGB -> BGR, then subtract the ImageNet channel means
+RESNET_MEAN_BGR = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+
+def prepare_segmentation_input(img):
+    """Resizes and scales an RGB image into the U-Net's 256x256 input."""
+    img_resized = cv2.resize(img, (SEG_IMG_HEIGHT, SEG_IMG_WIDTH))
+    return img_resized / 255.0
+
+
+def prepare_classification_input(leaf_image):
+    """Resizes a leaf crop into the ResNet50's 224x224 input."""
+    img_resized = cv2.resize(leaf_image, (CLASS_IMG_HEIGHT, CLASS_IMG_WIDTH))
+    return img_resized.astype(np.float32)
+
+
+def segment_and_crop(original_image, mask):
+    """Applies the mask to the original image to cut out the leaf."""
+    mask_resized = cv2.resize(mask, (original_image.shape[1], original_image.shape[0]))
+    contours, _ = cv2.findContours(mask_resized, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    if not contours:
+        return original_image
+
+    c = max(contours, key=cv2.contourArea)
+    x, y, w, h = cv2.boundingRect(c)
+    cropped_leaf = original_image[y:y + h, x:x + w]
+
+    return cropped_leaf
+
+
+def preprocess_resnet_input(img_batch):
+    """Same result as keras' resnet50.preprocess_input, without importing TensorFlow here."""
+    return img_batch[..., ::-1] - RESNET_MEAN_BGR
+
+
+def segment_batch(backend, images, timer=None):
+    """Runs one U-Net forward pass over a list of 256x256 images. Returns one binary mask per image.
+
+    The batch's time goes into `timer` (a StageTimer) as 'segmentation'.
+    """
+    timer = timer or StageTimer()
+    with timer.stage('segmentation'):
+        img_batch = np.stack(images).astype(np.float32)
+        pred_masks = backend.segment(img_batch)
+        return list((pred_masks > 0.5).astype(np.uint8))
+
+
+def extract_features_batch(backend, leaf_arrays, timer=None):
+    """Runs one ResNet50 pass over a list of 224x224 leaves. Returns a (N, 2048) array of features.
+
+    The pass's time goes into `timer` as 'feature_extraction'.
+    """
+    timer = timer or StageTimer()
+    with timer.stage('feature_extraction'):
+        img_preprocessed = preprocess_resnet_input(np.stack(leaf_arrays))
+        features = backend.extract_features(img_preprocessed)
+        return features.reshape(len(leaf_arrays), -1)
+
+
+def classify_batch(backend, classifier, leaf_arrays, timer=None):
+    """Runs one ResNet50 pass and one classifier-head call over a list of 224x224 leaves.
+
+    Returns a (label, features, confidence) triple per leaf, where confidence
+    is the classifier's probability for the returned label. The two steps'
+    times go into `timer` as 'feature_extraction' and 'classifier_head'.
+    """
+    timer = timer or StageTimer()
+    features_flat = extract_features_batch(backend, leaf_arrays, timer)
+    with timer.stage('classifier_head'):
+        # Same decision as predict(): the most probable class
+        probabilities = classifier.predict_proba(features_flat)
+        best = np.argmax(probabilities, axis=1)
+        labels = classifier.classes_[best]
+        confidences = probabilities[np.arange(len(best)), best]
+    # numpy string labels are converted so they can be cached and serialised
+    return [(str(label), feature_row, float(confidence))
+            for label, feature_row, confidence in zip(labels, features_flat, confidences)]
+
+
+def rank_batch(classifier, features, top):
+    """The `top` best (label, score) pairs for each feature row, best first.
+
+    Scores are cosine similarities for the embedding-index heads (their
+    predict_topk()) and class probabilities for the RandomForest.
+    """
+    features = np.asarray(features, dtype=np.float32).reshape(len(features), -1)
+    if hasattr(classifier, 'predict_topk'):
+        return classifier.predict_topk(features, top)
+    probabilities = classifier.predict_proba(features)
+    best = np.argsort(-probabilities, axis=1)[:, :top]
+    return [[(str(classifier.classes_[c]), float(probabilities[i, c])) for c in row] for i, row in enumerate(best)]
+
+
+def embed_batch(backend, images, timer=None):
+    """Segmentation, crop and ResNet50 features of decoded images, in this process and without a classifier head.
+
+    For the offline tools. Returns a (N, 2048) array of features.
+    """
+    timer = timer or StageTimer()
+    masks = segment_batch(backend, [prepare_segmentation_input(img) for img in images], timer)
+    with timer.stage('crop'):
+        crops = [prepare_classification_input(segment_and_crop(img, mask)) for img, mask in zip(images, masks)]
+    return extract_features_batch(backend, crops, timer)
@@ -0,0 +1,71 @@
+import os
+import time
+import pickle
+import argparse
+import numpy as np
+from model_loader import CLASSIFIER_FILE, KNN_INDEX_FILE, resolve_artifact_dir
+from knn_classifier import EmbeddingIndexClassifier
+
+BATCH_SIZES = (1, 32)
+
+
+def split_references(index, holdout, seed=0):
+    """Splits the index's references into (train vectors, train labels, test vectors, test labels), per label."""
+    rng = np.random.default_rng(seed)
+    train, test = [], []
+    for label_id in range(len(index.labels)):
+        rows = rng.permutation(np.flatnonzero(index.vector_labels == label_id))
+        n_test = int(round(len(rows) * holdout)) if len(rows) > 1 else 0
+        test.extend(rows[:n_test])
+        train.extend(rows[n_test:])
+    labels = np.asarray(index.labels, dtype=object)
+    return (index.vectors[train], labels[index.vector_labels[train]],
+            index.vectors[test], labels[index.vector_labels[test]])
+
+
+def latency_ms(classifier, vectors, batch_size, iterations):
+    batch = vectors[np.arange(batch_size) % len(vectors)]
+    classifier.predict(batch)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        classifier.predict(batch)
+    return (time.perf_counter() - start) * 1000.0 / iterations
+
+
+def main():
+    artifact_dir, _ = resolve_artifact_dir()
+    parser = argparse.ArgumentParser(description="Compare the RandomForest head with the embedding-index heads.")
+    parser.add_argument('--forest', default=os.path.join(artifact_dir, CLASSIFIER_FILE))
+    parser.add_argument('--index', default=os.path.join(artifact_dir, KNN_INDEX_FILE),
+                        help="Labelled reference embeddings (built with knn_classifier.py).")
+    parser.add_argument('--holdout', type=float, default=0.2, help="Share of each label's references kept for testing.")
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    index = EmbeddingIndexClassifier.load(args.index)
+    if len(index) < 2:
+        raise SystemExit(f"{args.index} needs labelled references; see `python knn_classifier.py --help`.")
+    train_vectors, train_labels, test_vectors, test_labels = split_references(index, args.holdout)
+    print(f"{len(train_labels)} reference / {len(test_labels)} test embeddings over {len(index.labels)} labels")
+
+    heads = {}
+    if os.path.exists(args.forest):
+        with open(args.forest, 'rb') as f:
+            heads['forest'] = pickle.load(f)
+    for mode in ('knn', 'prototype'):
+        head = EmbeddingIndexClassifier(mode=mode)
+        head.add(train_vectors, list(train_labels))
+        heads[mode] = head
+
+    header = f"{'engine':>10} {'accuracy':>9}" + ''.join(f" {f'batch {n} (ms)':>15}" for n in BATCH_SIZES)
+    print(header)
+    for name, head in heads.items():
+        # The forest was trained on its own data, so its accuracy here may include training images
+        accuracy = float(np.mean(head.predict(test_vectors) == test_labels)) if len(test_labels) else float('nan')
+        timings = ''.join(f" {latency_ms(head, test_vectors if len(test_labels) else train_vectors, n, args.iterations):>15.3f}"
+                          for n in BATCH_SIZES)
+        print(f"{name:>10} {accuracy:>9.3f}{timings}")
+
+
+if __name__ == '__main__':
+    main()
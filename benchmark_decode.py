@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tempfile
+import numpy as np
+import cv2
+import image_decode
+
+SEG_SIZE = 256
+CLASS_SIZE = 224
+
+# Phone-camera sizes to test (width x height)
+DEFAULT_SIZES = '4000x3000,8000x6000'
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, or None where it can't be read (Windows)."""
+    # Linux: VmHWM starts afresh at exec (ru_maxrss can carry over the parent's peak)
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, the other Unixes KiB
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def full_decode(image_bytes):
+    """The original path: decode every pixel, convert the whole frame to RGB."""
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def bounded_decode(image_bytes):
+    return image_decode.decode(image_bytes)
+
+
+PATHS = {'full': full_decode, 'bounded': bounded_decode}
+
+
+def model_inputs(img):
+    """What the pipeline makes from a decoded image: the U-Net input and a 224x224 crop of the middle."""
+    seg_input = cv2.resize(img, (SEG_SIZE, SEG_SIZE)) / 255.0
+    h, w = img.shape[:2]
+    crop = img[h // 4:h * 3 // 4, w // 4:w * 3 // 4]
+    return seg_input, cv2.resize(crop, (CLASS_SIZE, CLASS_SIZE)).astype(np.float32)
+
+
+def make_photo(width, height, path):
+    """A synthetic JPEG with smooth gradients plus noise, so it compresses like a photo."""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.stack([x / width * 255, y / height * 255, (x + y) / (width + height) * 255], axis=-1)
+    img += np.random.default_rng(0).normal(0, 12, img.shape).astype(np.float32)
+    cv2.imwrite(path, np.clip(img, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+
+def run_worker(path_name, image_path, iterations):
+    """Runs one decode path in this (fresh) process and prints its latency and memory as JSON."""
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    baseline = peak_rss_mb()
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        model_inputs(PATHS[path_name](image_bytes))
+        latencies.append((time.perf_counter() - start) * 1000.0)
+
+    peak = peak_rss_mb()
+    print(json.dumps({
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'mean_ms': float(np.mean(latencies)),
+        'peak_rss_delta_mb': (peak - baseline) if peak is not None else None,
+    }))
+
+
+def measure(path_name, image_path, iterations):
+    """Each path runs in its own process, so one path's peak memory can't hide the other's."""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', path_name, '--image', image_path,
+         '--iterations', str(iterations)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare decode latency and peak memory: full-size vs bounded decode.")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="Comma-separated WIDTHxHEIGHT photos to generate.")
+    parser.add_argument('--image', help="Benchmark this JPEG instead of generated ones.")
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--worker', choices=sorted(PATHS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.image, args.iterations)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images = []
+        if args.image:
+            images.append((os.path.basename(args.image), args.image))
+        else:
+            for size in args.sizes.split(','):
+                width, height = (int(n) for n in size.lower().split('x'))
+                path = os.path.join(tmp, f"{size}.jpg")
+                make_photo(width, height, path)
+                images.append((f"{size} ({width * height / 1e6:.0f} MP)", path))
+
+        print(f"{'image':>22} {'path':>8} {'p50 (ms)':>9} {'mean (ms)':>10} {'peak RSS +MB':>13}")
+        for label, path in images:
+            for path_name in PATHS:
+                result = measure(path_name, path, args.iterations)
+                rss = result['peak_rss_delta_mb']
+                rss_text = f"{rss:>13.0f}" if rss is not None else f"{'n/a':>13}"
+                print(f"{label:>22} {path_name:>8} {result['p50_ms']:>9.1f} {result['mean_ms']:>10.1f} {rss_text}")
+
+
+if __name__ == '__main__':
+    main()
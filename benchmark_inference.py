@@ -0,0 +1,83 @@
+import os
+import time
+import argparse
+import numpy as np
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import tensorflow as tf
+from inference_backends import BACKENDS, make_backend, SEG_INPUT_SHAPE, CLASS_INPUT_SHAPE
+
+SEGMENTER_MODEL_FILE = 'leaf_segmenter.h5'
+
+
+def load_models():
+    """Loads the U-Net (if present) and an untrained ResNet50 of the real architecture.
+
+    ResNet50's latency does not depend on its weight values, so random weights
+    keep this benchmark offline without changing what it measures.
+    """
+    segmentation_model = None
+    if os.path.exists(SEGMENTER_MODEL_FILE):
+        segmentation_model = tf.keras.models.load_model(
+            SEGMENTER_MODEL_FILE,
+            custom_objects={'MeanIoU': tf.keras.metrics.MeanIoU(num_classes=2)}
+        )
+    else:
+        print(f"{SEGMENTER_MODEL_FILE} not found: only the ResNet50 path will be benchmarked.")
+
+    resnet_model = tf.keras.applications.ResNet50(
+        weights=None,
+        include_top=False,
+        pooling='avg',
+        input_shape=CLASS_INPUT_SHAPE
+    )
+    return segmentation_model, resnet_model
+
+
+def time_calls(fn, batch, iterations):
+    """Calls fn(batch) `iterations` times and returns the latencies in ms."""
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(batch)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-call latency of the inference backends.")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=1)
+    args = parser.parse_args()
+
+    segmentation_model, resnet_model = load_models()
+
+    seg_batch = np.random.rand(args.batch_size, *SEG_INPUT_SHAPE).astype(np.float32)
+    class_batch = (np.random.rand(args.batch_size, *CLASS_INPUT_SHAPE) * 255.0).astype(np.float32)
+
+    results = {}
+    for name in BACKENDS:
+        backend = make_backend(name, segmentation_model, resnet_model)
+        stages = {'resnet50': (backend.extract_features, class_batch)}
+        if segmentation_model is not None:
+            stages['unet'] = (backend.segment, seg_batch)
+
+        for stage, (fn, batch) in stages.items():
+            fn(batch)  # warm up (traces the graph for the 'graph' backend)
+            results[(name, stage)] = time_calls(fn, batch, args.iterations)
+
+    print(f"\n--- Per-call latency, batch size {args.batch_size}, {args.iterations} iterations ---")
+    print(f"{'backend':<8} {'model':<9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for (name, stage), latencies in results.items():
+        print(f"{name:<8} {stage:<9} {latencies.mean():9.2f} "
+              f"{np.percentile(latencies, 50):9.2f} {np.percentile(latencies, 95):9.2f}")
+
+    for stage in ('unet', 'resnet50'):
+        if ('keras', stage) in results and ('graph', stage) in results:
+            speedup = np.median(results[('keras', stage)]) / np.median(results[('graph', stage)])
+            print(f"{stage}: graph path is {speedup:.2f}x faster than Model.predict() (median)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import tempfile
+import datetime
+import tracemalloc
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from benchmark_decode import make_photo, peak_rss_mb
+# The database module before anything that loads TensorFlow, which can leave sqlite3 without the R*Tree module
+from database import connect, DATABASE_FILE
+from benchmark_profile_lookup import lookup_profile
+from model_loader import (resolve_artifact_dir, load_for_tool, SEGMENTER_FILE, CLASSIFIER_FILE, RESNET_WEIGHTS_FILE,
+                          CLASS_INPUT_SHAPE)
+from image_decode import decode
+from batch_inference import (prepare_segmentation_input, prepare_classification_input, segment_and_crop,
+                             preprocess_resnet_input, segment_batch)
+from plant_names import NAME_MAPPER
+
+# Phone and camera sizes to test (width x height)
+DEFAULT_SIZES = '640x480,1600x1200,4000x3000,8000x6000'
+
+# The stages of one /predict call, in order, plus their sum
+STAGES = ('decode', 'segmentation', 'crop', 'resnet50', 'classifier_head', 'profile')
+TOTAL = 'total'
+
+# A stage has regressed when its latency grew by more than the tolerance AND by
+# at least this much (sub-millisecond stages are too noisy for a ratio alone)
+MIN_REGRESSION_MS = 1.0
+
+STANDIN_VERSION = 'standin'
+STANDIN_TREES = 100
+
+
+# --- Stand-in models (used when the real artifacts are not on this machine) ---
+
+def standin_labels(limit=22):
+    """Species names from the database, so the profile stage finds what the stand-in forest predicts."""
+    conn = connect(DATABASE_FILE, readonly=True)
+    names = [row[0] for row in conn.execute("SELECT scientific_name FROM Species ORDER BY species_id LIMIT ?", (limit,))]
+    conn.close()
+    return names or ['Mangifera indica']
+
+
+def make_standins(target, labels):
+    """Writes stand-in models with the real input and output shapes into `target`.
+
+    ResNet50 is the real architecture with random weights (its latency does
+    not depend on the weight values); the U-Net is a small encoder-decoder
+    (256x256x3 -> 256x256x1) and the RandomForest is fitted on random
+    2048-d features for `labels`.
+    """
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+    import tensorflow as tf
+    from sklearn.ensemble import RandomForestClassifier
+
+    layers = tf.keras.layers
+    inputs = tf.keras.Input((256, 256, 3))
+    down1 = layers.Conv2D(16, 3, padding='same', activation='relu')(inputs)
+    down2 = layers.Conv2D(32, 3, padding='same', activation='relu')(layers.MaxPooling2D()(down1))
+    bottom = layers.Conv2D(64, 3, padding='same', activation='relu')(layers.MaxPooling2D()(down2))
+    up2 = layers.Conv2D(32, 3, padding='same', activation='relu')(
+        layers.Concatenate()([layers.UpSampling2D()(bottom), down2]))
+    up1 = layers.Conv2D(16, 3, padding='same', activation='relu')(
+        layers.Concatenate()([layers.UpSampling2D()(up2), down1]))
+    outputs = layers.Conv2D(1, 1, activation='sigmoid')(up1)
+    tf.keras.Model(inputs, outputs).save(os.path.join(target, SEGMENTER_FILE))
+
+    resnet = tf.keras.applications.ResNet50(weights=None, include_top=False, pooling='avg',
+                                            input_shape=CLASS_INPUT_SHAPE)
+    resnet.save_weights(os.path.join(target, RESNET_WEIGHTS_FILE))
+
+    rng = np.random.default_rng(0)
+    labels = [labels[i % len(labels)] for i in range(20 * len(labels))]
+    forest = RandomForestClassifier(n_estimators=STANDIN_TREES, random_state=0)
+    forest.fit(rng.random((len(labels), 2048), dtype=np.float32), labels)
+    with open(os.path.join(target, CLASSIFIER_FILE), 'wb') as f:
+        pickle.dump(forest, f)
+
+
+def prepare(sizes, workdir, use_standins):
+    """Makes the synthetic photos (and stand-in models) in a child process.
+
+    Generating a 48 MP photo takes far more memory than the pipeline does, so
+    it must not count towards this process's peak.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        if use_standins:
+            model_dir = os.path.join(workdir, 'models', STANDIN_VERSION)
+            os.makedirs(model_dir)
+            pool.submit(make_standins, model_dir, standin_labels()).result()
+        photos = []
+        for width, height in sizes:
+            path = os.path.join(workdir, f"{width}x{height}.jpg")
+            pool.submit(make_photo, width, height, path).result()
+            photos.append((f"{width}x{height}", path))
+    return photos
+
+
+# --- Measuring ---
+
+class StageRecorder:
+    """Runs each stage through `record(name, fn)`.
+
+    Normally it times the stage. With trace_memory=True it instead records the
+    peak memory the stage allocated on top of what was already in use
+    (tracemalloc sees numpy and OpenCV buffers, not TensorFlow's own).
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.latencies = {stage: [] for stage in STAGES + (TOTAL,)}
+        self.peak_mb = {stage: None for stage in STAGES + (TOTAL,)}
+
+    def record(self, name, fn):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            in_use = tracemalloc.get_traced_memory()[0]
+            result = fn()
+            self.peak_mb[name] = (tracemalloc.get_traced_memory()[1] - in_use) / (1024.0 * 1024.0)
+            return result
+        start = time.perf_counter()
+        result = fn()
+        self.latencies[name].append((time.perf_counter() - start) * 1000.0)
+        return result
+
+    def end_request(self):
+        if self.trace_memory:
+            self.peak_mb[TOTAL] = max(self.peak_mb[stage] for stage in STAGES)
+        else:
+            self.latencies[TOTAL].append(sum(self.latencies[stage][-1] for stage in STAGES))
+
+    def summary(self, memory):
+        """Latency percentiles and throughput per stage, with the peaks from `memory` (a trace_memory recorder)."""
+        results = {}
+        for stage, values in self.latencies.items():
+            values = np.array(values)
+            results[stage] = {
+                'p50_ms': float(np.percentile(values, 50)),
+                'p95_ms': float(np.percentile(values, 95)),
+                'p99_ms': float(np.percentile(values, 99)),
+                'mean_ms': float(values.mean()),
+                'per_second': float(1000.0 / values.mean()) if values.mean() > 0 else None,
+                'peak_alloc_mb': memory.peak_mb[stage],
+            }
+        return results
+
+
+def run_request(loader, conn, recorder, image_bytes):
+    """One /predict call, stage by stage, without the schedulers' queueing."""
+    backend, classifier = loader.inference_backend, loader.classification_model
+    img = recorder.record('decode', lambda: decode(image_bytes))
+    mask = recorder.record('segmentation', lambda: segment_batch(backend, [prepare_segmentation_input(img)])[0])
+    leaf = recorder.record('crop', lambda: segment_and_crop(img, mask))
+    features = recorder.record('resnet50', lambda: backend.extract_features(
+        preprocess_resnet_input(prepare_classification_input(leaf)[np.newaxis])))
+    probabilities = recorder.record('classifier_head', lambda: classifier.predict_proba(features.reshape(1, -1)))
+    label = str(classifier.classes_[int(np.argmax(probabilities[0]))])
+    recorder.record('profile', lambda: lookup_profile(conn, NAME_MAPPER.get(label, label)))
+    recorder.end_request()
+
+
+def benchmark(photos, iterations, warmup=2):
+    """Runs in a fresh process, so the models load from the configured (or stand-in) folder
+    and the memory figures start clean. Returns (results, models, backend).
+
+    The models are loaded directly, not through app, so the benchmark never
+    migrates or writes the database; the profile stage only reads it.
+    """
+    loader = load_for_tool()
+    conn = connect(DATABASE_FILE, readonly=True)
+
+    results = {}
+    for name, path in photos:
+        with open(path, 'rb') as f:
+            image_bytes = f.read()
+        for _ in range(warmup):
+            run_request(loader, conn, StageRecorder(), image_bytes)
+
+        # Memory is traced in its own (untimed) request, as tracing slows every allocation
+        memory = StageRecorder(trace_memory=True)
+        tracemalloc.start()
+        run_request(loader, conn, memory, image_bytes)
+        tracemalloc.stop()
+
+        recorder = StageRecorder()
+        for _ in range(iterations):
+            run_request(loader, conn, recorder, image_bytes)
+        results[name] = recorder.summary(memory)
+        print_table(name, results[name], iterations)
+        rss = peak_rss_mb()
+        if rss is not None:
+            print(f"Process peak RSS so far: {rss:.0f} MB")
+    conn.close()
+    return results, loader.version, loader.backend_name
+
+
+def print_table(name, stages, iterations):
+    width, height = (int(n) for n in name.split('x'))
+    print(f"\n--- {name} ({width * height / 1e6:.1f} MP), {iterations} requests ---")
+    print(f"{'stage':<16} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'per s':>8} {'peak alloc MB':>14}")
+    for stage, row in stages.items():
+        print(f"{stage:<16} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f} "
+              f"{row['per_second']:>8.1f} {row['peak_alloc_mb']:>14.1f}")
+
+
+# --- Baselines ---
+
+def compare(baseline, results, metric, tolerance):
+    """Stages whose `metric` grew past the tolerance, as (image, stage, before, after) rows."""
+    regressions = []
+    for image, stages in results.items():
+        for stage, row in stages.items():
+            before = baseline['results'].get(image, {}).get(stage, {}).get(metric)
+            if before is None:
+                continue
+            after = row[metric]
+            if after > before * (1.0 + tolerance) and after - before >= MIN_REGRESSION_MS:
+                regressions.append((image, stage, before, after))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each stage of a /predict call on synthetic photos.")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="Comma-separated WIDTHxHEIGHT photos to generate.")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--standins', action='store_true',
+                        help="Use stand-in models even if the real ones are present.")
+    parser.add_argument('--save-baseline', metavar='PATH', help="Write the results to PATH as the new baseline.")
+    parser.add_argument('--baseline', metavar='PATH', help="Compare with a saved baseline; exit 1 on a regression.")
+    parser.add_argument('--metric', choices=('p50_ms', 'p95_ms', 'p99_ms'), default='p50_ms')
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown per stage (0.2 = 20%%).")
+    args = parser.parse_args()
+
+    sizes = [tuple(int(n) for n in size.lower().split('x')) for size in args.sizes.split(',')]
+    artifact_dir, _ = resolve_artifact_dir()
+    missing = [name for name in (SEGMENTER_FILE, CLASSIFIER_FILE, RESNET_WEIGHTS_FILE)
+               if not os.path.exists(os.path.join(artifact_dir, name))]
+    use_standins = args.standins or bool(missing)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        photos = prepare(sizes, workdir, use_standins)
+        if use_standins:
+            print(f"Using stand-in models ({', '.join(missing) + ' not found' if missing else '--standins'}).")
+            os.environ['PLANT_MODEL_DIR'] = os.path.join(workdir, 'models')
+            os.environ['PLANT_MODEL_VERSION'] = STANDIN_VERSION
+        os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            try:
+                results, models, backend = pool.submit(benchmark, photos, args.iterations).result()
+            except RuntimeError as e:
+                raise SystemExit(str(e))
+
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'models': models,
+        'backend': backend,
+        'iterations': args.iterations,
+        'python': sys.version.split()[0],
+        'results': results,
+    }
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if (baseline['models'], baseline['backend']) != (models, backend):
+            print(f"\nWARNING: baseline was measured with models '{baseline['models']}' on the "
+                  f"'{baseline['backend']}' backend; this run used '{models}' on '{backend}'.")
+        regressions = compare(baseline, results, args.metric, args.tolerance)
+        print(f"\n--- Against {args.baseline} ({args.metric}, tolerance {args.tolerance:.0%}) ---")
+        for image, stage, before, after in regressions:
+            print(f"REGRESSION {image:>10} {stage:<16} {before:9.2f} -> {after:9.2f} ms (+{after / before - 1:.0%})")
+        print(f"{len(regressions)} stage(s) regressed." if regressions else "No regressions.")
+        failed = bool(regressions)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
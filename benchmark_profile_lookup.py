@@ -0,0 +1,102 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+from database import connect
+from migrations import migrate
+
+# The species whose profile we time; every other species only adds rows
+TARGET_SPECIES = 'Mangifera indica'
+SPECIES_COUNT = 300
+TARGET_OBSERVATIONS = 200
+INDEX_MIGRATION = 3
+
+
+def lookup_profile(conn, scientific_name):
+    """The queries get_plant_profile() runs, with the locations inlined (the default)."""
+    species = conn.execute("SELECT * FROM Species WHERE scientific_name = ?", (scientific_name,)).fetchone()
+    species_id = species['species_id']
+    conn.execute("SELECT part_used, usage_description FROM MedicinalUses WHERE species_id = ?", (species_id,)).fetchall()
+    conn.execute("SELECT is_invasive FROM InvasiveStatus WHERE species_id = ?", (species_id,)).fetchone()
+    conn.execute("SELECT COUNT(*) FROM Observations WHERE species_id = ?", (species_id,)).fetchone()
+    return conn.execute("SELECT latitude, longitude FROM Observations WHERE species_id = ?", (species_id,)).fetchall()
+
+
+def seed(conn):
+    conn.executemany(
+        "INSERT INTO Species (scientific_name, kingdom) VALUES (?, 'Plantae')",
+        [(TARGET_SPECIES,)] + [(f"Benchmark species {i}",) for i in range(1, SPECIES_COUNT)]
+    )
+    conn.executemany(
+        "INSERT INTO MedicinalUses (species_id, part_used, usage_description) VALUES (?, 'Leaf', 'Benchmark use')",
+        [(i,) for i in range(1, SPECIES_COUNT + 1)]
+    )
+    conn.executemany(
+        "INSERT INTO InvasiveStatus (species_id, is_invasive) VALUES (?, 0)",
+        [(i,) for i in range(1, SPECIES_COUNT + 1)]
+    )
+    conn.executemany(
+        "INSERT INTO Observations (species_id, latitude, longitude, data_source) VALUES (1, ?, ?, 'Benchmark')",
+        [(random.uniform(8, 35), random.uniform(68, 97)) for _ in range(TARGET_OBSERVATIONS)]
+    )
+    conn.commit()
+
+
+def grow_observations(conn, total_rows, chunk=100000):
+    """Adds rows for the other species until Observations holds total_rows."""
+    existing = conn.execute("SELECT COUNT(*) FROM Observations").fetchone()[0]
+    while existing < total_rows:
+        n = min(chunk, total_rows - existing)
+        conn.executemany(
+            "INSERT INTO Observations (species_id, latitude, longitude, data_source) VALUES (?, ?, ?, 'Benchmark')",
+            [(random.randint(2, SPECIES_COUNT), random.uniform(8, 35), random.uniform(68, 97)) for _ in range(n)]
+        )
+        conn.commit()
+        existing += n
+
+
+def time_lookups(conn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        lookup_profile(conn, TARGET_SPECIES)
+    return (time.perf_counter() - start) * 1000.0 / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time profile lookups with and without the species_id indexes.")
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help="Comma-separated Observations table sizes to test.")
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain_db = os.path.join(tmp, 'no_indexes.db')
+        indexed_db = os.path.join(tmp, 'indexed.db')
+        migrate(plain_db, target=INDEX_MIGRATION - 1, verbose=False)
+        migrate(indexed_db, verbose=False)
+
+        plain, indexed = connect(plain_db), connect(indexed_db)
+        random.seed(42)
+        seed(plain)
+        random.seed(42)
+        seed(indexed)
+
+        print(f"{'observations':>13} {'no index (ms)':>14} {'indexed (ms)':>13} {'speedup':>8}")
+        for size in sizes:
+            random.seed(size)
+            grow_observations(plain, size)
+            random.seed(size)
+            grow_observations(indexed, size)
+
+            before = time_lookups(plain, args.iterations)
+            after = time_lookups(indexed, args.iterations)
+            print(f"{size:>13,} {before:>14.3f} {after:>13.3f} {before / after:>7.0f}x")
+
+        plain.close()
+        indexed.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import uuid
+import time
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# How often a failed group commit is retried before its contributions are marked failed
+COMMIT_RETRIES = 5
+RETRY_DELAY_SECONDS = 0.5
+
+# How many recent contribution ids we remember for status lookups
+STATUS_HISTORY = 10000
+
+
+class ContributionQueue:
+    """Write-behind queue for crowdsourced observations.
+
+    `submit()` only queues the contribution (its image bytes included) and
+    returns an id. One worker thread takes the first waiting contribution,
+    collects more until `max_batch_size` are in hand or `max_wait_ms` has
+    passed, stores their images in `image_store` (which sets each one's
+    'image_path'), and inserts all of them in a single transaction (`insert_fn(conn, contribution)` per row, returning the new
+    observation_id). Each row gets its own savepoint, so a row that fails is
+    marked failed on its own and the rest still commit.
+    `on_committed(contributions)` runs after each commit with the rows that
+    were committed.
+
+    `close()` stops accepting new work and returns once everything already
+    accepted has been committed.
+    """
+
+    def __init__(self, db, image_store, insert_fn, on_committed=None, max_batch_size=64, max_wait_ms=200.0):
+        self.db = db
+        self.image_store = image_store
+        self.insert_fn = insert_fn
+        self.on_committed = on_committed
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._submit_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._statuses = OrderedDict()  # contribution id -> {'state': ..., 'observation_id': ...}
+        self._counters = {'accepted': 0, 'committed': 0, 'failed': 0, 'batches': 0, 'failed_commits': 0}
+        self._total_commit_seconds = 0.0
+
+        self._thread = threading.Thread(target=self._run, name='contribution-writer', daemon=True)
+        self._thread.start()
+
+    # --- Public API ---
+
+    def submit(self, contribution):
+        """Queues one contribution (a dict of Observations fields plus 'image_bytes'). Returns its id."""
+        contribution_id = uuid.uuid4().hex
+        contribution = dict(contribution, id=contribution_id, accepted_at=time.time())
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("The contribution queue is shut down.")
+            self._set_status(contribution_id, 'queued')
+            with self._stats_lock:
+                self._counters['accepted'] += 1
+            self._queue.put(contribution)
+        return contribution_id
+
+    def status(self, contribution_id):
+        """{'state': 'queued' | 'committed' | 'failed', ...} for a recent contribution, or None."""
+        with self._stats_lock:
+            entry = self._statuses.get(contribution_id)
+            return dict(entry) if entry is not None else None
+
+    def close(self):
+        """Stops accepting contributions and waits until every accepted one is committed."""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._counters)
+            batches = stats['batches']
+            stats['queue_depth'] = self._queue.qsize()
+            stats['max_batch_size'] = self.max_batch_size
+            stats['max_wait_ms'] = self.max_wait * 1000.0
+            stats['mean_batch_size'] = (stats['committed'] / batches) if batches else 0.0
+            stats['mean_commit_ms'] = (self._total_commit_seconds * 1000.0 / batches) if batches else 0.0
+            return stats
+
+    # --- Worker ---
+
+    def _set_status(self, contribution_id, state, **details):
+        with self._stats_lock:
+            self._statuses[contribution_id] = dict(details, state=state)
+            self._statuses.move_to_end(contribution_id)
+            while len(self._statuses) > STATUS_HISTORY:
+                self._statuses.popitem(last=False)
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                # Put the shutdown marker back so the main loop sees it
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _save_images(self, batch):
+        for contribution in batch:
+            if contribution.get('image_bytes') is None:
+                continue
+            contribution['image_hash'], contribution['image_path'] = self.image_store.put(contribution['image_bytes'])
+            # The bytes are on disk now; don't keep them in memory until the commit
+            contribution['image_bytes'] = None
+
+    def _commit(self, batch):
+        """Saves the images and inserts every row in one transaction.
+
+        Returns one observation id per contribution, None for a row that
+        could not be inserted. Errors of the database itself (locked, I/O)
+        still fail the whole transaction, which is then retried.
+        """
+        self._save_images(batch)
+        observation_ids = []
+        with self.db.write() as conn:
+            for contribution in batch:
+                conn.execute("SAVEPOINT contribution")
+                try:
+                    observation_ids.append(self.insert_fn(conn, contribution))
+                except sqlite3.OperationalError:
+                    raise
+                except Exception as e:
+                    conn.execute("ROLLBACK TO contribution")
+                    print(f"Error inserting contribution {contribution['id']}: {e}")
+                    observation_ids.append(None)
+                conn.execute("RELEASE contribution")
+        return observation_ids
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = self._collect_batch(first)
+
+            started = time.perf_counter()
+            observation_ids = None
+            for attempt in range(COMMIT_RETRIES):
+                try:
+                    observation_ids = self._commit(batch)
+                    break
+                except Exception as e:
+                    print(f"Error committing {len(batch)} contributions (attempt {attempt + 1}): {e}")
+                    with self._stats_lock:
+                        self._counters['failed_commits'] += 1
+                    time.sleep(RETRY_DELAY_SECONDS * (attempt + 1))
+
+            if observation_ids is None:
+                for contribution in batch:
+                    self._set_status(contribution['id'], 'failed')
+                with self._stats_lock:
+                    self._counters['failed'] += len(batch)
+                continue
+
+            committed = []
+            for contribution, observation_id in zip(batch, observation_ids):
+                if observation_id is None:
+                    self._set_status(contribution['id'], 'failed')
+                    continue
+                contribution['observation_id'] = observation_id
+                self._set_status(contribution['id'], 'committed', observation_id=observation_id,
+                                 image_hash=contribution.get('image_hash'))
+                committed.append(contribution)
+            with self._stats_lock:
+                self._counters['committed'] += len(committed)
+                self._counters['failed'] += len(batch) - len(committed)
+                self._counters['batches'] += 1
+                self._total_commit_seconds += time.perf_counter() - started
+
+            if self.on_committed is not None and committed:
+                try:
+                    self.on_committed(committed)
+                except Exception as e:
+                    print(f"Error after committing contributions: {e}")
@@ -0,0 +1,161 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DATABASE_FILE = os.environ.get('PLANT_DATABASE_FILE', 'medicinal_plants.db')
+
+# How long a connection waits for a lock before raising "database is locked"
+BUSY_TIMEOUT_MS = int(os.environ.get('PLANT_DB_BUSY_TIMEOUT_MS', 5000))
+
+# Size of sqlite3's own per-connection statement cache (the `cached_statements`
+# argument). Nothing else is prepared ahead: this only saves re-parsing SQL that
+# is run again on the same connection.
+STATEMENT_CACHE_SIZE = 256
+
+# Idle read-only connections kept for reuse. A thread takes one on its first
+# read and hands it back with release() (the API does this after every request).
+READER_POOL_SIZE = int(os.environ.get('PLANT_DB_READER_POOL_SIZE', 16))
+
+# Applied to every connection. cache_size is negative = KiB, so -65536 is 64 MB.
+CONNECTION_PRAGMAS = {
+    'synchronous': 'NORMAL',        # safe with WAL, and no fsync on every commit
+    'cache_size': -65536,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': BUSY_TIMEOUT_MS,
+}
+
+
+def apply_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def connect(db_file=DATABASE_FILE, readonly=False, autocommit=False):
+    """Opens one tuned connection to the database.
+
+    The database is switched to WAL mode (a persistent setting) the first time
+    a writable connection opens it, so readers never wait for the writer.
+    Rows come back as sqlite3.Row, which supports both row['name'] and row[0].
+    """
+    if readonly:
+        conn = sqlite3.connect(
+            f"file:{os.path.abspath(db_file)}?mode=ro", uri=True,
+            timeout=BUSY_TIMEOUT_MS / 1000.0,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=False
+        )
+    else:
+        conn = sqlite3.connect(
+            db_file,
+            timeout=BUSY_TIMEOUT_MS / 1000.0,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+
+    if autocommit:
+        conn.isolation_level = None
+    conn.row_factory = sqlite3.Row
+    apply_pragmas(conn, CONNECTION_PRAGMAS)
+    return conn
+
+
+class Database:
+    """Connection manager shared by the API.
+
+    Reads use a read-only connection taken from a pool by each thread on its
+    first read; `release()` returns it, so a server that starts a thread per
+    request still keeps a bounded number of connections. Writes go through one shared writer connection, serialised by
+    a lock and wrapped in BEGIN IMMEDIATE ... COMMIT. With WAL, readers see the
+    last committed state and are never blocked by the writer.
+    """
+
+    def __init__(self, db_file=DATABASE_FILE, pool_size=READER_POOL_SIZE):
+        self.db_file = db_file
+        self._local = threading.local()
+        self._idle_readers = queue.Queue(maxsize=max(1, pool_size))
+        self._write_lock = threading.RLock()
+        self._writer = None
+        self._all_readers = []
+        self._readers_lock = threading.Lock()
+
+    def reader(self):
+        """This thread's read-only connection (taken from the pool, or opened, on first use)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            try:
+                conn = self._idle_readers.get_nowait()
+            except queue.Empty:
+                # Make sure WAL is on before the first read-only connection opens
+                self._get_writer()
+                conn = connect(self.db_file, readonly=True)
+                with self._readers_lock:
+                    self._all_readers.append(conn)
+            self._local.conn = conn
+        return conn
+
+    def detach(self):
+        """Takes this thread's read connection away from the thread and returns it.
+
+        For a response that keeps reading after the request has ended (a
+        streamed body): the request's release() then leaves it alone, and the
+        caller hands it back with release(conn) once the body is sent.
+        """
+        conn = self.reader()
+        self._local.conn = None
+        return conn
+
+    def release(self, conn=None):
+        """Returns this thread's read connection (or a detached one) to the pool, closing it if the pool is full."""
+        if conn is None:
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                return
+            self._local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle_readers.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+            with self._readers_lock:
+                self._all_readers.remove(conn)
+
+    @contextmanager
+    def read(self):
+        """Yields this thread's read connection. The thread keeps it until release()."""
+        yield self.reader()
+
+    @contextmanager
+    def write(self):
+        """Yields the writer connection inside one transaction (committed on success)."""
+        with self._write_lock:
+            conn = self._get_writer()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers = []
+        self._idle_readers = queue.Queue(maxsize=self._idle_readers.maxsize)
+        self._local = threading.local()
+
+    def _get_writer(self):
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = connect(self.db_file, autocommit=True)
+            return self._writer
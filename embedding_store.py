@@ -0,0 +1,195 @@
+import os
+import time
+import pickle
+import sqlite3
+import argparse
+import threading
+from collections import Counter
+import numpy as np
+
+# ResNet50 (include_top=False, pooling='avg') produces 2048 features per image
+EMBEDDING_DIM = 2048
+
+VECTORS_FILE = 'vectors.f32'
+INDEX_FILE = 'index.db'
+
+
+class EmbeddingStore:
+    """Append-only store of ResNet50 embeddings.
+
+    Vectors are appended as raw float32 rows to one file, which is read back
+    through a memory map, so scoring a new classifier head over every stored
+    image never re-runs the CNN. A small SQLite index maps each row to the
+    image hash, the observation it belongs to (if any) and the feature
+    extractor version that produced it.
+    """
+
+    def __init__(self, directory, dim=EMBEDDING_DIM):
+        self.directory = directory
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.vectors_path = os.path.join(directory, VECTORS_FILE)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._index.execute("PRAGMA journal_mode=WAL")
+        self._index.execute("PRAGMA synchronous=NORMAL")
+        self._index.execute(
+            """
+            CREATE TABLE IF NOT EXISTS Embeddings (
+                row_id INTEGER PRIMARY KEY,
+                image_hash TEXT NOT NULL,
+                observation_id INTEGER,
+                source TEXT,
+                model_version TEXT,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._index.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_hash ON Embeddings (image_hash)")
+        self._index.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_observation ON Embeddings (observation_id)")
+        self._index.commit()
+
+        self._count = self._recover()
+        self._mmap = None
+
+    def _recover(self):
+        """Drops any vector rows written after the last committed index row (e.g. after a crash)."""
+        indexed = self._index.execute("SELECT COALESCE(MAX(row_id) + 1, 0) FROM Embeddings").fetchone()[0]
+        if not os.path.exists(self.vectors_path):
+            open(self.vectors_path, 'wb').close()
+        stored = os.path.getsize(self.vectors_path) // self.row_bytes
+        if stored < indexed:
+            raise RuntimeError(
+                f"{self.vectors_path} holds {stored} rows but the index expects {indexed}; the store is damaged."
+            )
+        if stored > indexed or os.path.getsize(self.vectors_path) % self.row_bytes:
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(indexed * self.row_bytes)
+        return indexed
+
+    def __len__(self):
+        return self._count
+
+    # --- Writing ---
+
+    def append(self, vectors, image_hashes, observation_ids=None, source=None, model_version=None):
+        """Appends a (N, dim) block of vectors and returns their row ids."""
+        vectors = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        if len(vectors) != len(image_hashes):
+            raise ValueError("One image hash is needed per vector")
+        if observation_ids is None:
+            observation_ids = [None] * len(vectors)
+
+        with self._lock:
+            first_row = self._count
+            now = time.time()
+            try:
+                with open(self.vectors_path, 'ab') as f:
+                    f.write(vectors.tobytes())
+                self._index.executemany(
+                    """
+                    INSERT INTO Embeddings (row_id, image_hash, observation_id, source, model_version, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (first_row + i, image_hash, observation_id, source, model_version, now)
+                        for i, (image_hash, observation_id) in enumerate(zip(image_hashes, observation_ids))
+                    ]
+                )
+                self._index.commit()
+            except Exception:
+                # Otherwise the file keeps rows the index never got, and the next
+                # append's vectors would land after them, out of step with their row ids
+                self._index.rollback()
+                with open(self.vectors_path, 'r+b') as f:
+                    f.truncate(first_row * self.row_bytes)
+                raise
+            self._count += len(vectors)
+            return list(range(first_row, self._count))
+
+    # --- Reading ---
+
+    def matrix(self):
+        """Read-only (N, dim) memory map over every stored vector."""
+        with self._lock:
+            if self._count == 0:
+                return np.empty((0, self.dim), dtype=np.float32)
+            if self._mmap is None or len(self._mmap) != self._count:
+                self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self._count, self.dim))
+            return self._mmap
+
+    def get(self, row_ids):
+        """Returns the vectors for the given row ids as a (len(row_ids), dim) array."""
+        return np.asarray(self.matrix()[np.asarray(row_ids, dtype=np.int64)])
+
+    def iter_batches(self, batch_size=65536):
+        """Yields (row_ids, vectors) blocks over the whole store, in row order."""
+        matrix = self.matrix()
+        for start in range(0, len(matrix), batch_size):
+            stop = min(start + batch_size, len(matrix))
+            yield np.arange(start, stop), matrix[start:stop]
+
+    def has_image(self, image_hash):
+        return bool(self._query("SELECT 1 FROM Embeddings WHERE image_hash = ? LIMIT 1", (image_hash,)))
+
+    def rows_for_image(self, image_hash):
+        return [row[0] for row in self._query("SELECT row_id FROM Embeddings WHERE image_hash = ?", (image_hash,))]
+
+    def rows_for_observation(self, observation_id):
+        return [row[0] for row in self._query("SELECT row_id FROM Embeddings WHERE observation_id = ?", (observation_id,))]
+
+    def linked_count(self):
+        """How many stored embeddings belong to an observation."""
+        return self._query("SELECT COUNT(*) FROM Embeddings WHERE observation_id IS NOT NULL")[0][0]
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._index.execute(sql, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._mmap = None
+            self._index.close()
+
+
+# --- Command line: inspect the store or score a classifier head over it ---
+
+def score(store, classifier_file, batch_size):
+    """Runs a pickled classifier over every stored embedding and prints the label counts."""
+    with open(classifier_file, 'rb') as f:
+        classifier = pickle.load(f)
+
+    counts = Counter()
+    start = time.perf_counter()
+    for _, vectors in store.iter_batches(batch_size):
+        counts.update(str(label) for label in classifier.predict(vectors))
+    elapsed = time.perf_counter() - start
+
+    print(f"Scored {len(store)} embeddings in {elapsed:.2f}s ({len(store) / max(elapsed, 1e-9):.0f} rows/s).")
+    for label, count in counts.most_common():
+        print(f"  {count:8d}  {label}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the ResNet50 embedding store.")
+    parser.add_argument('--dir', default=os.environ.get('PLANT_EMBEDDING_DIR', 'embeddings'))
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('stats', help="Print how many embeddings are stored.")
+    score_parser = sub.add_parser('score', help="Score a pickled classifier over every stored embedding.")
+    score_parser.add_argument('classifier', help="Path to a pickled scikit-learn style classifier.")
+    score_parser.add_argument('--batch-size', type=int, default=65536)
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.dir)
+    if args.command == 'stats':
+        print(f"{len(store)} embeddings in {args.dir} ({store.linked_count()} linked to observations).")
+    else:
+        score(store, args.classifier, args.batch_size)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import math
+import argparse
+import numpy as np
+from database import DATABASE_FILE, connect
+
+# Per-species observation counts, pre-binned on the standard web-map tile
+# pyramid (Web Mercator, z/x/y as used by Leaflet and OpenStreetMap). Every
+# tile is split into TILE_GRID x TILE_GRID cells and only non-empty cells are
+# stored, in the HeatmapCells table (migration 5). A new observation adds 1 to
+# one cell per zoom level, so the grids never need a full rebuild; `rebuild()`
+# is only for bulk loaders that write Observations directly. Moving or
+# deleting an observation can't be undone cell by cell in SQL, so triggers
+# (migration 10) list the species in HeatmapStale instead, and
+# `rebuild_stale()` recomputes just those species.
+
+TILE_GRID = 32
+MAX_ZOOM = 10  # ~1.2 km cells; past this, map clients can fetch raw points from /observations
+
+# Web Mercator stops at about +/-85.05 degrees
+MAX_LATITUDE = 85.05112878
+
+
+def point_cells(lat, lon, zooms=range(MAX_ZOOM + 1)):
+    """(zoom, tile_x, tile_y, cell) of one point at each zoom level.
+
+    cell = row * TILE_GRID + column inside the tile, with row 0 at the top (north).
+    """
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    fx = (lon + 180.0) / 360.0
+    sin_lat = math.sin(math.radians(lat))
+    fy = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+
+    cells = []
+    for zoom in zooms:
+        size = TILE_GRID << zoom
+        gx = min(size - 1, max(0, int(fx * size)))
+        gy = min(size - 1, max(0, int(fy * size)))
+        cells.append((zoom, gx // TILE_GRID, gy // TILE_GRID, (gy % TILE_GRID) * TILE_GRID + gx % TILE_GRID))
+    return cells
+
+
+def _grid_coordinates(lats, lons):
+    """Vectorised point_cells(): fractional Web Mercator x/y in [0, 1) for arrays of points."""
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE)
+    fx = (np.asarray(lons, dtype=np.float64) + 180.0) / 360.0
+    sin_lat = np.sin(np.radians(lats))
+    fy = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)
+    return fx, fy
+
+
+def add_observation(conn, species_id, lat, lon, count=1):
+    """Adds one observation to every zoom level. Run it in the transaction that inserts the row."""
+    conn.executemany(
+        """
+        INSERT INTO HeatmapCells (species_id, zoom, tile_x, tile_y, cell, count)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (species_id, zoom, tile_x, tile_y, cell) DO UPDATE SET count = count + excluded.count
+        """,
+        [(species_id, zoom, tx, ty, cell, count) for zoom, tx, ty, cell in point_cells(lat, lon)]
+    )
+
+
+def rebuild(conn, species_ids=None):
+    """Recomputes the grids from Observations (all species, or just the given ones)."""
+    if species_ids is None:
+        species_ids = [row[0] for row in conn.execute("SELECT DISTINCT species_id FROM Observations")]
+        conn.execute("DELETE FROM HeatmapCells")
+    else:
+        conn.executemany("DELETE FROM HeatmapCells WHERE species_id = ?", [(sid,) for sid in species_ids])
+
+    cells_written = 0
+    for species_id in species_ids:
+        coords = np.array(
+            conn.execute("SELECT latitude, longitude FROM Observations WHERE species_id = ?", (species_id,)).fetchall(),
+            dtype=np.float64
+        ).reshape(-1, 2)
+        if not len(coords):
+            continue
+        fx, fy = _grid_coordinates(coords[:, 0], coords[:, 1])
+
+        for zoom in range(MAX_ZOOM + 1):
+            size = TILE_GRID << zoom
+            gx = np.clip((fx * size).astype(np.int64), 0, size - 1)
+            gy = np.clip((fy * size).astype(np.int64), 0, size - 1)
+            keys, counts = np.unique(gy * size + gx, return_counts=True)
+            gy, gx = np.divmod(keys, size)
+            rows = zip(
+                (gx // TILE_GRID).tolist(), (gy // TILE_GRID).tolist(),
+                ((gy % TILE_GRID) * TILE_GRID + gx % TILE_GRID).tolist(), counts.tolist()
+            )
+            conn.executemany(
+                "INSERT INTO HeatmapCells (species_id, zoom, tile_x, tile_y, cell, count) VALUES (?, ?, ?, ?, ?, ?)",
+                [(species_id, zoom, tx, ty, cell, n) for tx, ty, cell, n in rows]
+            )
+            cells_written += len(keys)
+    return cells_written
+
+
+def is_stale(conn, species_id):
+    return conn.execute("SELECT 1 FROM HeatmapStale WHERE species_id = ?", (species_id,)).fetchone() is not None
+
+
+def rebuild_stale(conn, species_ids=None):
+    """Rebuilds the species marked stale (all of them, or those among species_ids). Returns the species rebuilt."""
+    stale = [row[0] for row in conn.execute("SELECT species_id FROM HeatmapStale")]
+    if species_ids is not None:
+        wanted = set(species_ids)
+        stale = [sid for sid in stale if sid in wanted]
+    if stale:
+        rebuild(conn, stale)
+        conn.executemany("DELETE FROM HeatmapStale WHERE species_id = ?", [(sid,) for sid in stale])
+    return stale
+
+
+def tile(conn, species_id, zoom, x, y):
+    """One tile as parallel arrays of non-empty cell indexes and their counts."""
+    rows = conn.execute(
+        """
+        SELECT cell, count FROM HeatmapCells
+        WHERE species_id = ? AND zoom = ? AND tile_x = ? AND tile_y = ?
+        ORDER BY cell
+        """,
+        (species_id, zoom, x, y)
+    ).fetchall()
+    counts = [row[1] for row in rows]
+    return {
+        'z': zoom, 'x': x, 'y': y,
+        'grid': TILE_GRID,
+        'cells': [row[0] for row in rows],
+        'counts': counts,
+        'max': max(counts, default=0),
+    }
+
+
+def valid_tile(zoom, x, y):
+    return 0 <= zoom <= MAX_ZOOM and 0 <= x < (1 << zoom) and 0 <= y < (1 << zoom)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the precomputed heatmap grids from Observations.")
+    parser.add_argument('--db', default=DATABASE_FILE)
+    parser.add_argument('--stale', action='store_true',
+                        help="Only rebuild the species whose observations were moved or deleted.")
+    args = parser.parse_args()
+
+    # Here, not at the top: migrations imports this module
+    from migrations import migrate
+    migrate(args.db, verbose=False)
+    conn = connect(args.db, autocommit=True)
+    conn.execute("BEGIN IMMEDIATE")
+    if args.stale:
+        species = rebuild_stale(conn)
+        conn.execute("COMMIT")
+        conn.close()
+        print(f"--- Heatmap rebuilt for {len(species)} stale species ---")
+        return
+    cells = rebuild(conn)
+    conn.execute("DELETE FROM HeatmapStale")
+    conn.execute("COMMIT")
+    conn.close()
+    print(f"--- Heatmap rebuilt: {cells} cells over zoom 0-{MAX_ZOOM} ---")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import io
+import os
+import warnings
+import numpy as np
+import cv2
+from PIL import Image
+
+# Uploads are checked from their header before any pixels are decoded
+MAX_IMAGE_PIXELS = int(os.environ.get('PLANT_MAX_IMAGE_PIXELS', 120_000_000))
+MAX_IMAGE_SIDE = 20000
+
+# Longest side of the decoded working image. The models only see 256x256 and
+# 224x224 inputs; this leaves room for a leaf that fills a quarter of the frame
+# to still give the classifier a full-resolution crop.
+DECODE_MAX_SIDE = int(os.environ.get('PLANT_DECODE_MAX_SIDE', 1024))
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+# EXIF orientation -> operations that make the pixels upright
+ORIENTATION_FIXES = {
+    2: [lambda img: cv2.flip(img, 1)],
+    3: [lambda img: cv2.rotate(img, cv2.ROTATE_180)],
+    4: [lambda img: cv2.flip(img, 0)],
+    5: [lambda img: cv2.transpose(img)],
+    6: [lambda img: cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)],
+    7: [lambda img: cv2.transpose(img), lambda img: cv2.rotate(img, cv2.ROTATE_180)],
+    8: [lambda img: cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)],
+}
+
+# Reduced decoding: libjpeg can scale by 1/2, 1/4 or 1/8 while decoding, so the
+# full-resolution frame is never allocated
+REDUCED_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+
+def read_header(image_bytes):
+    """(format, width, height, EXIF orientation) from the image header, without decoding the pixels.
+
+    Raises ValueError for data that is not an image, or one over the size limits.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(image_bytes)) as image:
+                image_format, (width, height) = image.format, image.size
+                orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except Image.DecompressionBombError:
+        raise ValueError("Image is too large")
+    except Exception:
+        raise ValueError("Could not read the image header")
+
+    if width < 1 or height < 1:
+        raise ValueError("Image has no pixels")
+    if width * height > MAX_IMAGE_PIXELS or max(width, height) > MAX_IMAGE_SIDE:
+        raise ValueError(f"Image is too large ({width}x{height}, limit {MAX_IMAGE_PIXELS // 1_000_000} MP)")
+    return image_format, width, height, orientation
+
+
+def reduction_factor(width, height, max_side=DECODE_MAX_SIDE):
+    """Largest JPEG scale-down (8, 4, 2 or 1) that keeps the longest side at or above max_side."""
+    longest = max(width, height)
+    for factor, _ in REDUCED_FLAGS:
+        if longest // factor >= max_side:
+            return factor
+    return 1
+
+
+def decode(image_bytes, max_side=DECODE_MAX_SIDE, rgb=True):
+    """Decodes an upload into an upright image no larger than max_side on its longest side.
+
+    JPEGs are decoded straight at a reduced resolution; other formats are
+    decoded in full (after the header check bounded their size) and scaled
+    down. Returns an RGB array (BGR if rgb=False). Raises ValueError for
+    invalid or oversized images.
+    """
+    image_format, width, height, orientation = read_header(image_bytes)
+    buffer = np.frombuffer(image_bytes, np.uint8)
+
+    flags = cv2.IMREAD_COLOR
+    if image_format == 'JPEG':
+        factor = reduction_factor(width, height, max_side)
+        flags = dict(REDUCED_FLAGS).get(factor, cv2.IMREAD_COLOR)
+    img = cv2.imdecode(buffer, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is None:
+        raise ValueError("Could not decode the uploaded image")
+
+    longest = max(img.shape[:2])
+    if longest > max_side:
+        scale = max_side / float(longest)
+        img = cv2.resize(img, (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale))),
+                         interpolation=cv2.INTER_AREA)
+
+    for fix in ORIENTATION_FIXES.get(orientation, []):
+        img = fix(img)
+
+    if rgb:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return img
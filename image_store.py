@@ -0,0 +1,152 @@
+import os
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from result_cache import content_key
+import image_decode
+
+# Downscaled copies made for every stored image: name -> longest side in pixels
+VARIANT_SIZES = {'thumb': 256, 'preview': 1024}
+VARIANT_JPEG_QUALITY = 85
+
+# File signatures of the image types we accept, and the extension each is stored under
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+]
+EXTENSIONS = sorted({extension for _, extension in IMAGE_SIGNATURES} | {'webp'})
+
+
+def image_extension(image_bytes):
+    """File extension for an image, from its leading bytes (None if it isn't a supported type)."""
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'webp'
+    for signature, extension in IMAGE_SIGNATURES:
+        if image_bytes.startswith(signature):
+            return extension
+    return None
+
+
+class ImageStore:
+    """Content-addressed image storage.
+
+    Every image is stored once, under the SHA-256 of its bytes, in two levels
+    of subdirectories (originals/ab/cd/abcd....jpg), so uploading the same
+    photo twice costs no extra disk. The client's filename is never used.
+    Downscaled JPEG copies (see VARIANT_SIZES) are made by a small pool of
+    background workers after a new image is written; `path()` makes one on
+    the spot if it is asked for before the worker got to it.
+    """
+
+    def __init__(self, root='uploads', workers=2):
+        self.root = root
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+        self._lock = threading.Lock()
+        self._counters = {'stored': 0, 'duplicates': 0, 'variants': 0, 'variant_errors': 0, 'pending_variants': 0}
+
+    def _path(self, variant, key, extension):
+        return os.path.join(self.root, variant, key[:2], key[2:4], f"{key}.{extension}")
+
+    def put(self, image_bytes, key=None):
+        """Stores an image (if it isn't stored already). Returns (key, path of the original).
+
+        Raises ValueError for data that is not a supported image type.
+        """
+        extension = image_extension(image_bytes)
+        if extension is None:
+            raise ValueError("Unsupported image type")
+        key = key or content_key(image_bytes)
+        path = self._path('originals', key, extension)
+
+        if os.path.exists(path):
+            with self._lock:
+                self._counters['duplicates'] += 1
+            return key, path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name and rename, so a half-written file is never visible
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._counters['stored'] += 1
+            self._counters['pending_variants'] += 1
+        self._pool.submit(self._background_variants, key, path)
+        return key, path
+
+    def path(self, key, variant='original'):
+        """Path of a stored image or one of its downscaled copies, or None if the key is unknown."""
+        original = self._find_original(key)
+        if original is None or variant == 'original':
+            return original
+        if variant not in VARIANT_SIZES:
+            raise ValueError(f"Unknown image size '{variant}'")
+
+        path = self._path(variant, key, 'jpg')
+        if not os.path.exists(path):
+            self._make_variants(key, original)
+        return path if os.path.exists(path) else original
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def _find_original(self, key):
+        if len(key) != 64 or not all(ch in '0123456789abcdef' for ch in key):
+            return None
+        directory = os.path.dirname(self._path('originals', key, 'jpg'))
+        for extension in EXTENSIONS:
+            path = os.path.join(directory, f"{key}.{extension}")
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _background_variants(self, key, original_path):
+        try:
+            self._make_variants(key, original_path)
+        finally:
+            with self._lock:
+                self._counters['pending_variants'] -= 1
+
+    def _make_variants(self, key, original_path):
+        """Writes every missing downscaled copy of one image."""
+        try:
+            missing = {name: size for name, size in VARIANT_SIZES.items()
+                       if not os.path.exists(self._path(name, key, 'jpg'))}
+            if not missing:
+                return
+            with open(original_path, 'rb') as f:
+                # Decoded (upright, at reduced resolution) only as large as the biggest copy needs
+                image = image_decode.decode(f.read(), max_side=max(missing.values()), rgb=False)
+
+            # Largest first, each one scaled down from the previous (cheaper than from the original)
+            for name, size in sorted(missing.items(), key=lambda item: -item[1]):
+                height, width = image.shape[:2]
+                scale = size / float(max(height, width))
+                if scale < 1.0:
+                    image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                                       interpolation=cv2.INTER_AREA)
+                ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, VARIANT_JPEG_QUALITY])
+                if not ok:
+                    raise ValueError(f"could not encode the {name} copy of {key}")
+
+                path = self._path(name, key, 'jpg')
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                encoded.tofile(tmp_path)
+                os.replace(tmp_path, path)
+                with self._lock:
+                    self._counters['variants'] += 1
+        except Exception as e:
+            print(f"Thumbnail error for {key}: {e}")
+            with self._lock:
+                self._counters['variant_errors'] += 1
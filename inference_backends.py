@@ -0,0 +1,139 @@
+import threading
+import numpy as np
+import tensorflow as tf
+
+# Per-image input shapes the models are traced for
+SEG_INPUT_SHAPE = (256, 256, 3)
+CLASS_INPUT_SHAPE = (224, 224, 3)
+
+
+class KerasBackend:
+    """Runs the models through the regular Keras `Model.predict()` path."""
+
+    name = 'keras'
+
+    def __init__(self, segmentation_model, resnet_model):
+        self.segmentation_model = segmentation_model
+        self.resnet_model = resnet_model
+
+    def warmup(self, batch_sizes=(1,)):
+        """Keras builds its predict function lazily; one dummy call per model is enough."""
+        for batch_size in batch_sizes:
+            self.segment(np.zeros((batch_size,) + SEG_INPUT_SHAPE, np.float32))
+            self.extract_features(np.zeros((batch_size,) + CLASS_INPUT_SHAPE, np.float32))
+
+    def segment(self, img_batch):
+        """U-Net forward pass: (N, 256, 256, 3) in [0, 1] -> (N, 256, 256, 1) probabilities."""
+        return self.segmentation_model.predict(img_batch, verbose=0)
+
+    def extract_features(self, img_batch):
+        """ResNet50 forward pass: preprocessed (N, 224, 224, 3) -> (N, 2048) features."""
+        return self.resnet_model.predict(img_batch, verbose=0)
+
+
+class GraphBackend:
+    """Runs the models as tf.function graphs with a fixed input signature.
+
+    Each graph is traced once for its per-image shape (the batch dimension is
+    left open so micro-batches do not trigger a retrace) and warmed up with
+    dummy tensors, so a request only pays for the forward pass itself, not for
+    the data adapter and callbacks `Model.predict()` builds on every call.
+    """
+
+    name = 'graph'
+
+    def __init__(self, segmentation_model, resnet_model):
+        self.segmentation_model = segmentation_model
+        self.resnet_model = resnet_model
+
+        self._segment_fn = tf.function(
+            lambda x: segmentation_model(x, training=False),
+            input_signature=[tf.TensorSpec((None,) + SEG_INPUT_SHAPE, tf.float32)],
+        )
+        self._features_fn = tf.function(
+            lambda x: resnet_model(x, training=False),
+            input_signature=[tf.TensorSpec((None,) + CLASS_INPUT_SHAPE, tf.float32)],
+        )
+
+    def warmup(self, batch_sizes=(1,)):
+        """Traces both graphs and runs them once on zeros so the first request is not slow."""
+        for batch_size in batch_sizes:
+            self.segment(np.zeros((batch_size,) + SEG_INPUT_SHAPE, np.float32))
+            self.extract_features(np.zeros((batch_size,) + CLASS_INPUT_SHAPE, np.float32))
+
+    def segment(self, img_batch):
+        """U-Net forward pass: (N, 256, 256, 3) in [0, 1] -> (N, 256, 256, 1) probabilities."""
+        return self._segment_fn(tf.convert_to_tensor(img_batch, tf.float32)).numpy()
+
+    def extract_features(self, img_batch):
+        """ResNet50 forward pass: preprocessed (N, 224, 224, 3) -> (N, 2048) features."""
+        return self._features_fn(tf.convert_to_tensor(img_batch, tf.float32)).numpy()
+
+
+class TFLiteBackend:
+    """Runs quantized (int8 or float16) TFLite conversions of both models on the CPU.
+
+    The .tflite files are made offline by `python tflite_convert.py convert`;
+    the float Keras models are not loaded at all. Inputs and outputs stay
+    float32, so the backend is a drop-in for the other two.
+    """
+
+    name = 'tflite'
+
+    def __init__(self, segmenter_path, resnet_path, num_threads=None):
+        self._segmenter = TFLiteModel(segmenter_path, num_threads)
+        self._resnet = TFLiteModel(resnet_path, num_threads)
+
+    def warmup(self, batch_sizes=(1,)):
+        """Allocates the interpreters' tensors and runs them once on zeros."""
+        for batch_size in batch_sizes:
+            self.segment(np.zeros((batch_size,) + SEG_INPUT_SHAPE, np.float32))
+            self.extract_features(np.zeros((batch_size,) + CLASS_INPUT_SHAPE, np.float32))
+
+    def segment(self, img_batch):
+        """U-Net forward pass: (N, 256, 256, 3) in [0, 1] -> (N, 256, 256, 1) probabilities."""
+        return self._segmenter.run(img_batch)
+
+    def extract_features(self, img_batch):
+        """ResNet50 forward pass: preprocessed (N, 224, 224, 3) -> (N, 2048) features."""
+        return self._resnet.run(img_batch)
+
+
+class TFLiteModel:
+    """One TFLite interpreter with a resizable batch dimension.
+
+    An interpreter is not thread-safe, so calls are serialised; its input is
+    only resized (and its tensors reallocated) when the batch size changes.
+    """
+
+    def __init__(self, path, num_threads=None):
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=num_threads)
+        self._input = self.interpreter.get_input_details()[0]['index']
+        self._output = self.interpreter.get_output_details()[0]['index']
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    def run(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        with self._lock:
+            if len(batch) != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input, batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            self.interpreter.set_tensor(self._input, batch)
+            self.interpreter.invoke()
+            # get_tensor() returns a copy, so the next call cannot overwrite it
+            return self.interpreter.get_tensor(self._output)
+
+
+BACKENDS = {
+    KerasBackend.name: KerasBackend,
+    GraphBackend.name: GraphBackend,
+}
+
+
+def make_backend(name, segmentation_model, resnet_model):
+    """Builds the inference backend registered under `name`."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+    return BACKENDS[name](segmentation_model, resnet_model)
@@ -0,0 +1,157 @@
+import threading
+import itertools
+import queue
+import time
+from collections import deque, Counter
+from concurrent.futures import Future
+
+# How many recent queue-wait samples we keep for the percentile report
+WAIT_SAMPLE_SIZE = 1000
+
+# Lower numbers are served first. Background work (e.g. verifying contributions)
+# uses BACKGROUND so it never delays a user waiting on /predict.
+INTERACTIVE = 0
+BACKGROUND = 10
+_SHUTDOWN = float('inf')
+
+
+class MicroBatcher:
+    """Collects concurrent requests for one model and runs them as batches.
+
+    Callers use `submit(item)` (returns a Future) or simply call the batcher
+    like a function. A single worker thread takes the first waiting item,
+    then keeps collecting more until either `max_batch_size` items are in
+    hand or `max_wait_ms` has passed, and hands the whole list to
+    `batch_fn`. `batch_fn` must return one result per item, in order.
+
+    Waiting items are taken in priority order (then arrival order), so
+    INTERACTIVE requests overtake queued BACKGROUND ones.
+    """
+
+    def __init__(self, name, batch_fn, max_batch_size=8, max_wait_ms=10.0):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._waits = deque(maxlen=WAIT_SAMPLE_SIZE)
+        self._total_requests = 0
+        self._total_batches = 0
+        self._total_wait = 0.0
+        self._failed_batches = 0
+
+        self._thread = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._thread.start()
+
+    # --- Public API ---
+
+    def submit(self, item, priority=INTERACTIVE):
+        """Queues one item and returns a Future for its result."""
+        future = Future()
+        self._queue.put((priority, next(self._sequence), (item, future, time.perf_counter())))
+        return future
+
+    def __call__(self, item, priority=INTERACTIVE):
+        """Blocking helper: submit one item and wait for its result."""
+        return self.submit(item, priority).result()
+
+    def close(self):
+        """Stops the worker thread after it finishes the queued work."""
+        self._put_shutdown()
+        self._thread.join()
+
+    def _put_shutdown(self):
+        self._queue.put((_SHUTDOWN, next(self._sequence), None))
+
+    def stats(self):
+        """Returns batch-size and queue-wait statistics as a plain dict."""
+        with self._stats_lock:
+            waits_ms = sorted(w * 1000.0 for w in self._waits)
+            batches = self._total_batches
+            requests_seen = self._total_requests
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'queue_depth': self._queue.qsize(),
+                'requests': requests_seen,
+                'batches': batches,
+                'failed_batches': self._failed_batches,
+                'mean_batch_size': (requests_seen / batches) if batches else 0.0,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                'queue_wait_ms': {
+                    'mean': (self._total_wait * 1000.0 / requests_seen) if requests_seen else 0.0,
+                    'p50': _percentile(waits_ms, 50),
+                    'p95': _percentile(waits_ms, 95),
+                    'max': waits_ms[-1] if waits_ms else 0.0,
+                },
+            }
+
+    # --- Worker ---
+
+    def _collect_batch(self, first):
+        """Keeps pulling items until the batch is full or the wait runs out."""
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    _, _, entry = self._queue.get(timeout=remaining)
+                else:
+                    _, _, entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                # Put the shutdown marker back so the main loop sees it
+                self._put_shutdown()
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            _, _, first = self._queue.get()
+            if first is None:
+                break
+
+            batch = self._collect_batch(first)
+            started = time.perf_counter()
+            items = [entry[0] for entry in batch]
+
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(
+                        f"{self.name}: batch_fn returned {len(results)} results for {len(items)} items"
+                    )
+            except Exception as e:
+                print(f"Error in {self.name} batch: {e}")
+                with self._stats_lock:
+                    self._failed_batches += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            with self._stats_lock:
+                self._total_batches += 1
+                self._total_requests += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                for _, _, enqueued in batch:
+                    wait = started - enqueued
+                    self._total_wait += wait
+                    self._waits.append(wait)
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
@@ -0,0 +1,253 @@
+import os
+import argparse
+import threading
+import numpy as np
+
+# Classifier engines the server can use on top of the ResNet50 features:
+#   forest     the pickled scikit-learn RandomForest (leaf_classifier.pkl)
+#   knn        k nearest reference embeddings, weighted by cosine similarity
+#   prototype  cosine similarity to each class's mean reference embedding
+ENGINES = ('forest', 'knn', 'prototype')
+DEFAULT_K = 5
+
+# Reference images embedded per forward pass by `add`
+EMBED_BATCH_SIZE = 16
+
+# predict_proba() for prototypes: softmax over cosine similarities at this temperature
+PROTOTYPE_TEMPERATURE = 0.05
+
+
+def normalise(vectors):
+    """Rows scaled to unit length (float32), so a dot product is a cosine similarity."""
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingIndexClassifier:
+    """Nearest-neighbour classifier head over normalised ResNet50 embeddings.
+
+    Every reference image is one unit-length row; scoring a batch of queries
+    is a single matrix multiply against the references (knn) or against one
+    mean vector per class (prototype). New references can be added at any time
+    with `add()`; nothing is retrained. `predict()` matches the scikit-learn
+    call the RandomForest answers, so either can sit behind classify_batch().
+    """
+
+    def __init__(self, mode='knn', k=DEFAULT_K):
+        if mode not in ('knn', 'prototype'):
+            raise ValueError(f"Unknown mode '{mode}' (use 'knn' or 'prototype')")
+        self.mode = mode
+        self.k = k
+        self.labels = []           # class index -> label
+        self.vectors = None        # (n, d) unit-length references
+        self.vector_labels = np.zeros(0, dtype=np.int32)
+        self.sources = []          # where each reference came from (e.g. an image hash)
+        self.prototypes = None     # (classes, d) unit-length class means
+        self._class_sums = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.vector_labels)
+
+    # --- Building ---
+
+    def add(self, vectors, labels, sources=None):
+        """Adds reference embeddings with their labels. References whose source is already known are skipped.
+
+        Returns how many were added.
+        """
+        vectors = normalise(vectors)
+        sources = list(sources) if sources is not None else [None] * len(vectors)
+        with self._lock:
+            known = {source for source in self.sources if source is not None}
+            keep = [i for i, source in enumerate(sources) if source is None or source not in known]
+            if not keep:
+                return 0
+
+            label_ids = []
+            for i in keep:
+                if labels[i] not in self.labels:
+                    self.labels.append(labels[i])
+                label_ids.append(self.labels.index(labels[i]))
+            label_ids = np.asarray(label_ids, dtype=np.int32)
+            new_vectors = vectors[keep]
+
+            # Class sums grow with the number of classes; prototypes are their normalised rows
+            sums = np.zeros((len(self.labels), new_vectors.shape[1]), dtype=np.float64)
+            if self._class_sums is not None:
+                sums[:len(self._class_sums)] = self._class_sums
+            np.add.at(sums, label_ids, new_vectors)
+
+            self.vectors = new_vectors if self.vectors is None else np.vstack([self.vectors, new_vectors])
+            self.vector_labels = np.concatenate([self.vector_labels, label_ids])
+            self.sources.extend(sources[i] for i in keep)
+            self._class_sums = sums
+            self.prototypes = normalise(sums)
+            return len(keep)
+
+    # --- Scoring ---
+
+    def class_scores(self, features):
+        """(n, classes) similarity of each query to each class, in [-1, 1]."""
+        queries = normalise(features)
+        with self._lock:
+            vectors, vector_labels, prototypes = self.vectors, self.vector_labels, self.prototypes
+            class_count = len(self.labels)
+        if self.mode == 'prototype':
+            return queries @ prototypes.T
+
+        similarities = queries @ vectors.T
+        k = min(self.k, similarities.shape[1])
+        neighbours = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        neighbour_similarities = np.take_along_axis(similarities, neighbours, axis=1)
+
+        # Each neighbour votes for its class with its similarity; averaged over k
+        scores = np.zeros((len(queries), class_count), dtype=np.float32)
+        rows = np.repeat(np.arange(len(queries)), k)
+        np.add.at(scores, (rows, vector_labels[neighbours].ravel()), neighbour_similarities.ravel())
+        return scores / k
+
+    def predict_topk(self, features, top=3):
+        """The `top` best (label, score) pairs for each query, best first."""
+        scores = self.class_scores(features)
+        top = min(top, scores.shape[1])
+        best = np.argsort(-scores, axis=1)[:, :top]
+        return [[(self.labels[c], float(scores[i, c])) for c in row] for i, row in enumerate(best)]
+
+    def predict(self, features):
+        scores = self.class_scores(features)
+        return self.classes_[np.argmax(scores, axis=1)]
+
+    def predict_proba(self, features):
+        """Per-class confidences that sum to 1, columns in `classes_` order (like scikit-learn).
+
+        knn: each class's share of the neighbour votes. prototype: a softmax
+        over the similarities (see PROTOTYPE_TEMPERATURE).
+        """
+        scores = self.class_scores(features)
+        if self.mode == 'prototype':
+            scores = np.exp((scores - scores.max(axis=1, keepdims=True)) / PROTOTYPE_TEMPERATURE)
+        else:
+            scores = np.maximum(scores, 0.0)
+        return scores / np.maximum(scores.sum(axis=1, keepdims=True), 1e-12)
+
+    @property
+    def classes_(self):
+        return np.asarray(self.labels, dtype=object)
+
+    # --- Persistence ---
+
+    def save(self, path):
+        """Writes the references to a .npz file (atomically)."""
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            vectors=self.vectors if self.vectors is not None else np.zeros((0, 0), dtype=np.float32),
+            vector_labels=self.vector_labels,
+            labels=np.asarray(self.labels, dtype=str),
+            sources=np.asarray([source or '' for source in self.sources], dtype=str),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mode='knn', k=DEFAULT_K):
+        head = cls(mode=mode, k=k)
+        if not os.path.exists(path):
+            return head
+        with np.load(path) as data:
+            labels = [str(label) for label in data['labels']]
+            if len(data['vector_labels']):
+                head.add(
+                    data['vectors'],
+                    [labels[i] for i in data['vector_labels']],
+                    [source or None for source in data['sources'].tolist()],
+                )
+        return head
+
+
+# --- Command line: build and grow the reference index ---
+
+def add_verified_contributions(head, store_dir, db_file):
+    """Adds the embeddings of AI-verified contributions, labelled with the label they were verified under."""
+    from database import connect
+    from embedding_store import EmbeddingStore
+
+    conn = connect(db_file, readonly=True)
+    rows = conn.execute(
+        "SELECT observation_id, predicted_label FROM Observations WHERE verification_status = 'verified'"
+    ).fetchall()
+    conn.close()
+
+    store = EmbeddingStore(store_dir)
+    vectors, labels, sources = [], [], []
+    for row in rows:
+        for row_id in store.rows_for_observation(row['observation_id']):
+            vectors.append(np.array(store.get([row_id])[0]))
+            labels.append(row['predicted_label'])
+            sources.append(f"observation:{row['observation_id']}")
+    store.close()
+    return head.add(vectors, labels, sources) if vectors else 0
+
+
+def add_images(head, label, image_paths):
+    """Adds reference images for one label, embedded by the same pipeline the server uses."""
+    # The database module first: importing TensorFlow before sqlite3 can lose the R*Tree module
+    import database  # noqa: F401
+    from model_loader import load_for_tool
+    from image_decode import decode
+    from batch_inference import embed_batch
+    from result_cache import content_key
+
+    # Only the backend is used. The forest head is what gets loaded with it
+    # because it ships with every model version, while the index may not exist yet
+    loader = load_for_tool(classifier_engine='forest')
+
+    features, keys = [], []
+    for start in range(0, len(image_paths), EMBED_BATCH_SIZE):
+        uploads = []
+        for path in image_paths[start:start + EMBED_BATCH_SIZE]:
+            with open(path, 'rb') as f:
+                uploads.append(f.read())
+        features.extend(embed_batch(loader.inference_backend, [decode(b) for b in uploads]))
+        keys.extend(content_key(b) for b in uploads)
+    return head.add(features, [label] * len(keys), keys)
+
+
+def main():
+    from database import DATABASE_FILE
+
+    parser = argparse.ArgumentParser(description="Build the nearest-neighbour classifier index (leaf_knn.npz).")
+    parser.add_argument('--index', required=True, help="Path of the .npz index, e.g. models/v1/leaf_knn.npz")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    images = sub.add_parser('add', help="Add reference images for one label.")
+    images.add_argument('--label', required=True, help="Classifier label, e.g. 'Mango healthy (P0a)'")
+    images.add_argument('images', nargs='+')
+
+    verified = sub.add_parser('add-verified', help="Add every AI-verified contribution from the embedding store.")
+    verified.add_argument('--store', default=os.environ.get('PLANT_EMBEDDING_DIR', 'embeddings'))
+    verified.add_argument('--db', default=DATABASE_FILE)
+
+    sub.add_parser('stats', help="Print the references per label.")
+    args = parser.parse_args()
+
+    head = EmbeddingIndexClassifier.load(args.index)
+    if args.command == 'stats':
+        counts = np.bincount(head.vector_labels, minlength=len(head.labels))
+        print(f"{len(head)} references, {len(head.labels)} labels in {args.index}")
+        for label, count in sorted(zip(head.labels, counts.tolist())):
+            print(f"  {count:>6}  {label}")
+        return
+
+    if args.command == 'add':
+        added = add_images(head, args.label, args.images)
+    else:
+        added = add_verified_contributions(head, args.store, args.db)
+    head.save(args.index)
+    print(f"--- Added {added} references; {args.index} now holds {len(head)} ---")
+    print("Restart the server (or model server) to use them: the index is read when the models load.")
+
+
+if __name__ == '__main__':
+    main()
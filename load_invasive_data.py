@@ -1,116 +1,194 @@
-import sqlite3
 import csv
-import os
+import sys
+import time
+import argparse
+from database import DATABASE_FILE, connect, apply_pragmas
+from migrations import migrate
 
-DATABASE_FILE = "medicinal_plants.db"
 TAXON_FILE = "taxon.txt"
 PROFILE_FILE = "speciesprofile.txt"
+SOURCE_DB = "GRIIS-India"
 
-def main():
-    # --- Part 1: Read the data files into memory ---
-    
-    # We use a dictionary to store data from speciesprofile.txt
-    # We will use the species 'id' as the key.
-    species_profiles = {}
+# Rows per executemany batch while staging
+BATCH_SIZE = 50000
+
+# For the load only: no fsync per commit, a bigger page cache, and the staging
+# table on disk. The database stays in WAL mode, so the API can keep reading
+# while a checklist loads.
+BULK_LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+    'cache_size': -262144,
+    'temp_store': 'FILE',
+}
+
+# Rows are first streamed into a staging table, one row per name (a name the
+# checklist lists more than once counts as invasive if any of its rows says so)
+CREATE_STAGING = """
+    CREATE TEMP TABLE IF NOT EXISTS StagedInvasiveStatus (
+        scientific_name TEXT PRIMARY KEY,
+        is_invasive INTEGER NOT NULL
+    ) WITHOUT ROWID
+"""
+STAGE_ROW = """
+    INSERT INTO StagedInvasiveStatus (scientific_name, is_invasive) VALUES (?, ?)
+    ON CONFLICT (scientific_name) DO UPDATE SET is_invasive = MAX(is_invasive, excluded.is_invasive)
+"""
+
+# Then merged in one transaction. Existing species are kept as they are, and
+# status rows that already hold the right value are not rewritten, so a
+# re-run only touches what changed.
+MERGE_SPECIES = """
+    INSERT INTO Species (scientific_name, kingdom)
+    SELECT scientific_name, 'Plantae' FROM StagedInvasiveStatus WHERE is_invasive = 1
+    ON CONFLICT (scientific_name) DO NOTHING
+"""
+MERGE_INVASIVE = """
+    INSERT INTO InvasiveStatus (species_id, is_invasive, source_db)
+    SELECT Species.species_id, 1, ?
+    FROM StagedInvasiveStatus JOIN Species USING (scientific_name)
+    WHERE StagedInvasiveStatus.is_invasive = 1
+    ON CONFLICT (species_id, source_db) DO UPDATE SET is_invasive = 1 WHERE is_invasive != 1
+"""
+# Plants this source used to list as invasive and no longer does
+MERGE_NOT_INVASIVE = """
+    UPDATE InvasiveStatus SET is_invasive = 0
+    WHERE source_db = ? AND is_invasive = 1 AND species_id IN (
+        SELECT Species.species_id
+        FROM StagedInvasiveStatus JOIN Species USING (scientific_name)
+        WHERE StagedInvasiveStatus.is_invasive = 0
+    )
+"""
+
+
+def read_rows(path, columns):
+    """Streams (id, {column: value}) from a Darwin Core Archive tab-separated file."""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+        header = next(reader)
+        indexes = [header.index(column) for column in ('id',) + columns]
+        for row in reader:
+            if len(row) < len(header):
+                continue
+            values = [row[i] for i in indexes]
+            yield values[0], dict(zip(columns, values[1:]))
+
+
+def join_rows(taxa, profiles):
+    """Joins the taxon rows with their species-profile rows on id, as a stream.
+
+    The files of an archive list their records in the same order, so rows
+    normally pair up one by one. Rows that arrive out of step are held until
+    their partner turns up; only those are kept in memory. Yields
+    (taxon, profile) pairs, with profile None for a taxon that has none.
+    """
+    pending_taxa, pending_profiles = {}, {}
+    profiles = iter(profiles)
+    for taxon_id, taxon in taxa:
+        if taxon_id in pending_profiles:
+            yield taxon, pending_profiles.pop(taxon_id)
+            continue
+        for profile_id, profile in profiles:
+            if profile_id == taxon_id:
+                yield taxon, profile
+                break
+            if profile_id in pending_taxa:
+                yield pending_taxa.pop(profile_id), profile
+            else:
+                pending_profiles[profile_id] = profile
+        else:
+            pending_taxa[taxon_id] = taxon
+    for profile_id, profile in (profiles if pending_taxa else ()):
+        if profile_id in pending_taxa:
+            yield pending_taxa.pop(profile_id), profile
+    for taxon in pending_taxa.values():
+        yield taxon, None
+
+
+def load(db_file, taxon_file, profile_file, source, batch_size=BATCH_SIZE):
+    """Upserts the invasive plants of one GRIIS checklist. Returns (rows read, rows changed)."""
+    migrate(db_file, verbose=False)
+    conn = connect(db_file, autocommit=True)
+    apply_pragmas(conn, BULK_LOAD_PRAGMAS)
+    start = time.perf_counter()
+    rows_read = plants = unmatched = 0
+    batch = []
+
+    def stage():
+        # Only the temp database is written here, so the main database stays unlocked
+        conn.execute("BEGIN")
+        conn.executemany(STAGE_ROW, batch)
+        conn.execute("COMMIT")
+        batch.clear()
+        print(f"  {rows_read:,} rows read, {plants:,} plants staged "
+              f"({rows_read / (time.perf_counter() - start):,.0f} rows/s)")
 
-    print(f"Reading {PROFILE_FILE}...")
-    try:
-        with open(PROFILE_FILE, 'r', encoding='utf-8') as f:
-            # csv.reader helps us read tab-separated files
-            reader = csv.reader(f, delimiter='\t')
-            header = next(reader) # Skip the header row
-            
-            # Find the column numbers we need
-            id_col = header.index('id')
-            invasive_col = header.index('isInvasive')
-            
-            for row in reader:
-                species_id = row[id_col]
-                invasive_status = row[invasive_col]
-                
-                # We only care about species that are explicitly 'Invasive'
-                if invasive_status == 'Invasive':
-                    species_profiles[species_id] = {
-                        'is_invasive': True
-                    }
-
-    except FileNotFoundError:
-        print(f"ERROR: Cannot find {PROFILE_FILE}. Make sure it's in the same folder.")
-        return
-    except Exception as e:
-        print(f"Error reading {PROFILE_FILE}: {e}")
-        return
-
-    print(f"Found {len(species_profiles)} invasive species in the profile file.")
-
-    # --- Part 2: Connect to the database and insert data ---
-    
-    print(f"Connecting to database {DATABASE_FILE}...")
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    print(f"Reading {TAXON_FILE} and inserting into database...")
-    
-    plants_added = 0
     try:
-        with open(TAXON_FILE, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f, delimiter='\t')
-            header = next(reader) # Skip the header
-            
-            id_col = header.index('id')
-            name_col = header.index('scientificName')
-            kingdom_col = header.index('kingdom')
-
-            for row in reader:
-                species_id = row[id_col]
-                
-                # Check if this ID is in our 'invasive' list
-                if species_id in species_profiles:
-                    kingdom = row[kingdom_col]
-                    
-                    # We only want to add PLANTS
-                    if kingdom == 'Plantae':
-                        scientific_name = row[name_col]
-                        
-                        try:
-                            # Step A: Insert into the 'Species' table
-                            cursor.execute(
-                                "INSERT INTO Species (scientific_name, kingdom) VALUES (?, ?)",
-                                (scientific_name, 'Plantae')
-                            )
-                            
-                            # Get the 'species_id' that the database just created
-                            new_species_id = cursor.lastrowid
-                            
-                            # Step B: Insert into the 'InvasiveStatus' table
-                            cursor.execute(
-                                "INSERT INTO InvasiveStatus (species_id, is_invasive, source_db) VALUES (?, ?, ?)",
-                                (new_species_id, True, 'GRIIS-India')
-                            )
-                            
-                            plants_added += 1
-
-                        except sqlite3.IntegrityError:
-                            # This happens if the 'scientific_name' is already in the database
-                            print(f"Skipping duplicate: {scientific_name}")
-                        except Exception as e:
-                            print(f"Error inserting {scientific_name}: {e}")
-
-    except FileNotFoundError:
-        print(f"ERROR: Cannot find {TAXON_FILE}. Make sure it's in the same folder.")
-        conn.close()
-        return
-    except Exception as e:
-        print(f"Error reading {TAXON_FILE}: {e}")
+        conn.execute(CREATE_STAGING)
+        pairs = join_rows(read_rows(taxon_file, ('scientificName', 'kingdom')),
+                          read_rows(profile_file, ('isInvasive',)))
+        for taxon, profile in pairs:
+            rows_read += 1
+            if profile is None:
+                unmatched += 1
+                continue
+            # We only want PLANTS
+            if taxon['kingdom'] != 'Plantae':
+                continue
+            plants += 1
+            batch.append((taxon['scientificName'], int(profile['isInvasive'] == 'Invasive')))
+            if len(batch) >= batch_size:
+                stage()
+        stage()
+
+        merge_start = time.perf_counter()
+        changes_before = conn.total_changes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(MERGE_SPECIES)
+            species_added = conn.total_changes - changes_before
+            conn.execute(MERGE_INVASIVE, (source,))
+            conn.execute(MERGE_NOT_INVASIVE, (source,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        changed = conn.total_changes - changes_before
+        invasive = conn.execute("SELECT COUNT(*) FROM StagedInvasiveStatus WHERE is_invasive = 1").fetchone()[0]
+        conn.execute("PRAGMA optimize")
+    finally:
         conn.close()
-        return
 
-    # --- Part 3: Save (commit) changes and close ---
-    conn.commit()
-    conn.close()
-    
-    print("\n--- Process Complete ---")
-    print(f"Successfully added {plants_added} invasive plant species to the database.")
+    elapsed = time.perf_counter() - start
+    if unmatched:
+        print(f"{unmatched:,} taxa in {taxon_file} have no row in {profile_file} and were skipped.")
+    print(f"Merged in {time.perf_counter() - merge_start:.1f}s: {species_added:,} new species, "
+          f"{changed - species_added:,} status rows inserted or changed.")
+    print(f"Loaded {rows_read:,} rows in {elapsed:.1f}s ({rows_read / max(elapsed, 1e-9):,.0f} rows/s): "
+          f"{invasive:,} invasive plants, {changed:,} rows changed.")
+    return rows_read, changed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load the invasive plants of a GRIIS checklist (taxon.txt + speciesprofile.txt). Safe to re-run.")
+    parser.add_argument('--db', default=DATABASE_FILE)
+    parser.add_argument('--taxon', default=TAXON_FILE)
+    parser.add_argument('--profile', default=PROFILE_FILE)
+    parser.add_argument('--source', default=SOURCE_DB, help="source_db recorded for this checklist, e.g. GRIIS-Brazil.")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Rows per staging batch.")
+    args = parser.parse_args()
+
+    print(f"Loading {args.taxon} + {args.profile} into {args.db} as '{args.source}'...")
+    try:
+        load(args.db, args.taxon, args.profile, args.source, max(1, args.batch_size))
+    except FileNotFoundError as e:
+        print(f"ERROR: Cannot find {e.filename}.")
+        sys.exit(1)
+    except ValueError as e:
+        # header.index() of a missing column
+        print(f"ERROR: Unexpected file layout: {e}")
+        sys.exit(1)
+
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
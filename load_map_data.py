@@ -1,10 +1,14 @@
-import sqlite3
-import requests
 import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from database import DATABASE_FILE, connect
+from migrations import migrate
+import heatmap
 
-DATABASE_FILE = "medicinal_plants.db"
-
-# The list of 15 plants we want to find map data for.
+# The plants we want map data for.
 # We use the exact names from our database.
 PLANT_NAMES = [
     "Acacia dealbata Link",
@@ -21,7 +25,7 @@ PLANT_NAMES = [
     "Ocimum tenuiflorum",
     "Curcuma longa",
     "Withania somnifera",
-    "Tinospora cordifolia"
+    "Tinospora cordifolia",
     # --- New 11 ---
     "Mangifera indica",
     "Terminalia arjuna",
@@ -39,102 +43,316 @@ PLANT_NAMES = [
 # GBIF API settings
 GBIF_API_URL = "https://api.gbif.org/v1/occurrence/search"
 INDIA_COUNTRY_CODE = "IN" # We only want results from India
+DATA_SOURCE = "GBIF"
 
-def get_species_id(cursor, scientific_name):
-    """Finds the database ID for a given plant name."""
-    try:
-        cursor.execute("SELECT species_id FROM Species WHERE scientific_name = ?", (scientific_name,))
-        result = cursor.fetchone()
-        if result:
-            return result[0]
-    except Exception as e:
-        print(f"Error finding ID for {scientific_name}: {e}")
-    return None
-
-def fetch_gbif_locations(scientific_name):
-    """Fetches up to 100 map coordinates for a species from GBIF."""
-    params = {
-        'scientificName': scientific_name,
-        'country': INDIA_COUNTRY_CODE,
-        'hasCoordinate': 'true', # Only get records that have lat/lon
-        'limit': 100 # Get 100 pins per plant (to keep this fast)
-    }
-    
-    try:
-        response = requests.get(GBIF_API_URL, params=params, timeout=30)
-        response.raise_for_status() # Raise an error for bad responses
-        data = response.json()
-        
-        locations = []
-        if 'results' in data:
-            for record in data['results']:
-                if 'decimalLatitude' in record and 'decimalLongitude' in record:
-                    locations.append({
-                        'lat': record['decimalLatitude'],
-                        'lon': record['decimalLongitude'],
-                        'date': record.get('eventDate', 'unknown')
-                    })
-        return locations
-        
-    except requests.exceptions.RequestException as e:
-        print(f"  [GBIF Error] Could not fetch data for {scientific_name}: {e}")
-        return []
+# GBIF returns at most 300 records per page, and occurrence/search stops
+# paging at offset 100,000 (bigger sets need GBIF's download API)
+PAGE_SIZE = 300
+MAX_OFFSET = 100000
 
-def main():
-    print(f"Connecting to {DATABASE_FILE}...")
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-
-    total_locations_added = 0
-    
-    for plant_name in PLANT_NAMES:
-        print(f"\n--- Processing: {plant_name} ---")
-        
-        # 1. Get the plant's ID from our database
-        species_id = get_species_id(cursor, plant_name)
-        
-        if not species_id:
-            print(f"  Could not find {plant_name} in database. Skipping.")
-            continue
-            
-        # 2. Fetch location data from GBIF
-        print(f"  Fetching locations from GBIF...")
-        locations = fetch_gbif_locations(plant_name)
-        
-        if not locations:
-            print("  No locations found on GBIF.")
+# Species fetched at the same time, and the request rate shared by all of them
+WORKERS = 8
+REQUESTS_PER_SECOND = 5.0
+
+# Failed or throttled requests (HTTP 429 / 5xx) are retried with exponential backoff
+MAX_RETRIES = 5
+RETRY_BACKOFF_SECONDS = 1.0
+REQUEST_TIMEOUT_SECONDS = 30
+
+# Observations written per transaction (with the progress of the pages they came from)
+BATCH_SIZE = 5000
+
+# An occurrence is the same one if it has the same species, point, date and
+# GBIF record key (the unique index from migration 9), so re-runs add nothing twice
+INSERT_OBSERVATION = """
+    INSERT INTO Observations
+        (species_id, latitude, longitude, data_source, timestamp, is_verified, source_record_id)
+    VALUES (?, ?, ?, ?, ?, 1, ?)
+    ON CONFLICT (data_source, source_record_id, species_id, latitude, longitude, timestamp)
+        WHERE source_record_id IS NOT NULL DO NOTHING
+"""
+# Rows loaded before record keys were kept get the key of the matching
+# occurrence instead of a second copy
+ADOPT_LEGACY_OBSERVATION = """
+    UPDATE OR IGNORE Observations SET source_record_id = ?
+    WHERE observation_id = (
+        SELECT observation_id FROM Observations
+        WHERE species_id = ? AND latitude = ? AND longitude = ? AND timestamp = ?
+          AND data_source = ? AND source_record_id IS NULL
+        LIMIT 1
+    )
+"""
+SAVE_PROGRESS = """
+    INSERT INTO HarvestProgress (data_source, country, species_id, next_offset, complete, records_seen, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (data_source, country, species_id) DO UPDATE SET
+        next_offset = excluded.next_offset,
+        complete = excluded.complete,
+        -- A harvest that starts over from offset 0 (--restart) counts from zero again
+        records_seen = CASE WHEN ? THEN excluded.records_seen ELSE records_seen + excluded.records_seen END,
+        updated_at = excluded.updated_at
+"""
+
+
+class RateLimiter:
+    """Spaces out requests from every thread to at most `rate` per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def pause(self, seconds):
+        """Holds back every thread, e.g. after the server asked us to slow down."""
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+class GbifClient:
+    """Fetches occurrence pages from the GBIF search API (or a stand-in at `api_url`)."""
+
+    def __init__(self, api_url, country, limiter, page_size=PAGE_SIZE):
+        self.api_url = api_url
+        self.country = country
+        self.limiter = limiter
+        self.page_size = page_size
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def page(self, scientific_name, offset):
+        """One page of occurrences with coordinates. Returns (records, end_of_records)."""
+        params = {
+            'scientificName': scientific_name,
+            'country': self.country,
+            'hasCoordinate': 'true', # Only get records that have lat/lon
+            'offset': offset,
+            'limit': self.page_size,
+        }
+        for attempt in range(MAX_RETRIES + 1):
+            self.limiter.wait()
+            try:
+                response = self._session().get(self.api_url, params=params, timeout=REQUEST_TIMEOUT_SECONDS)
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    data = response.json()
+                    return data.get('results', []), bool(data.get('endOfRecords', True))
+                error = f"HTTP {response.status_code}"
+                retry_after = response.headers.get('Retry-After', '')
+                delay = float(retry_after) if retry_after.isdigit() else RETRY_BACKOFF_SECONDS * 2 ** attempt
+            except requests.exceptions.RequestException as e:
+                if getattr(e, 'response', None) is not None and e.response.status_code < 500:
+                    raise  # e.g. 400 for a malformed query: retrying won't help
+                error = str(e)
+                delay = RETRY_BACKOFF_SECONDS * 2 ** attempt
+            if attempt < MAX_RETRIES:
+                print(f"  [GBIF] {scientific_name} offset {offset}: {error}, retrying in {delay:.0f}s")
+                self.limiter.pause(delay)
+        raise RuntimeError(f"{scientific_name} offset {offset}: giving up after {MAX_RETRIES + 1} attempts ({error})")
+
+
+def observation_rows(species_id, records):
+    """(species_id, lat, lon, date, record key) for each record that has coordinates."""
+    rows = []
+    for record in records:
+        if record.get('decimalLatitude') is None or record.get('decimalLongitude') is None:
             continue
-            
-        print(f"  Found {len(locations)} locations. Inserting into database...")
-        
-        # 3. Insert locations into our 'Observations' table
-        locations_added_for_this_plant = 0
-        for loc in locations:
+        rows.append((species_id, record['decimalLatitude'], record['decimalLongitude'],
+                     record.get('eventDate') or 'unknown', str(record.get('key', record.get('gbifID', '')))))
+    return rows
+
+
+class Harvester:
+    """Pages through GBIF occurrences for many species at once and stores them.
+
+    Worker threads (one species each) fetch pages under the shared rate
+    limiter and hand them to the calling thread, which writes them in
+    batches. The next offset of every species is saved in HarvestProgress in
+    the same transaction as its observations, so an interrupted run resumes
+    from the last written page, and finished species are skipped next time.
+    """
+
+    def __init__(self, db_file, client, workers=WORKERS, batch_size=BATCH_SIZE):
+        self.db_file = db_file
+        self.client = client
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self._pages = queue.Queue(maxsize=self.workers * 4)
+        self._stop = threading.Event()
+        self.counters = {'pages': 0, 'records': 0, 'inserted': 0, 'species_done': 0, 'species_failed': 0}
+
+    # --- Progress ---
+
+    def plan(self, conn, names, restart=False):
+        """(species_id, name, start offset) for every species that still has pages to fetch."""
+        todo = []
+        for name in names:
+            row = conn.execute("SELECT species_id FROM Species WHERE scientific_name = ?", (name,)).fetchone()
+            if row is None:
+                print(f"  Could not find {name} in database. Skipping.")
+                continue
+            species_id = row[0]
+            progress = conn.execute(
+                "SELECT next_offset, complete FROM HarvestProgress WHERE data_source = ? AND country = ? AND species_id = ?",
+                (DATA_SOURCE, self.client.country, species_id)
+            ).fetchone()
+            if progress is None or restart:
+                todo.append((species_id, name, 0))
+            elif not progress['complete']:
+                todo.append((species_id, name, progress['next_offset']))
+        return todo
+
+    # --- Fetching (worker threads) ---
+
+    def _fetch_species(self, species_id, name, offset):
+        while not self._stop.is_set():
+            records, end_of_records = self.client.page(name, offset)
+            offset += len(records)
+            done = end_of_records or not records or offset >= MAX_OFFSET
+            if done and offset >= MAX_OFFSET and not end_of_records:
+                print(f"  {name}: stopped at GBIF's {MAX_OFFSET:,}-record paging limit")
+            self._put((species_id, offset, done, len(records), observation_rows(species_id, records)))
+            if done:
+                return
+
+    def _put(self, item):
+        while not self._stop.is_set():
             try:
-                cursor.execute(
-                    """INSERT INTO Observations 
-                       (species_id, latitude, longitude, data_source, timestamp, is_verified) 
-                       VALUES (?, ?, ?, ?, ?, ?)""",
-                    (species_id, loc['lat'], loc['lon'], 'GBIF', loc['date'], True)
-                )
-                locations_added_for_this_plant += 1
-            except sqlite3.IntegrityError:
-                pass # Skip duplicates
-            except Exception as e:
-                print(f"    Error inserting location: {e}")
-        
-        print(f"  Successfully added {locations_added_for_this_plant} new locations.")
-        total_locations_added += locations_added_for_this_plant
-        
-        # Be polite to the API - wait 1 second before the next request
-        time.sleep(1) 
-
-    # Save (commit) all changes and close
-    conn.commit()
+                self._pages.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    # --- Writing (calling thread) ---
+
+    def _write(self, conn, pages):
+        rows = [row for page in pages for row in page[4]]
+        progress = {}
+        for species_id, next_offset, done, seen, _ in pages:
+            previous = progress.get(species_id)
+            if previous is None:
+                # A page that started at offset 0 begins a new harvest of the species
+                progress[species_id] = (next_offset, done, seen, next_offset == seen)
+            else:
+                progress[species_id] = (next_offset, done, seen + previous[2], previous[3])
+        finished = [species_id for species_id, (_, done, _, _) in progress.items() if done]
+        now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(ADOPT_LEGACY_OBSERVATION,
+                             [(key, species_id, lat, lon, date, DATA_SOURCE) for species_id, lat, lon, date, key in rows])
+            # rowcount, not total_changes: the R*Tree triggers would count too
+            inserted = conn.executemany(
+                INSERT_OBSERVATION,
+                [(species_id, lat, lon, DATA_SOURCE, date, key) for species_id, lat, lon, date, key in rows]
+            ).rowcount
+            conn.executemany(SAVE_PROGRESS, [
+                (DATA_SOURCE, self.client.country, species_id, next_offset, done, seen, now, from_start)
+                for species_id, (next_offset, done, seen, from_start) in progress.items()
+            ])
+            # The grids of a species are rebuilt once it is complete (bulk loads skip the per-row update)
+            if finished:
+                heatmap.rebuild(conn, finished)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self.counters['pages'] += len(pages)
+        self.counters['records'] += sum(page[3] for page in pages)
+        self.counters['inserted'] += inserted
+        self.counters['species_done'] += len(finished)
+
+    def run(self, todo):
+        """Harvests every (species_id, name, offset) in `todo`. Returns the counters."""
+        conn = connect(self.db_file, autocommit=True)
+        start = time.perf_counter()
+        pending, batch, batch_rows = {}, [], 0
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='gbif')
+        try:
+            for species_id, name, offset in todo:
+                pending[executor.submit(self._fetch_species, species_id, name, offset)] = name
+
+            while pending or not self._pages.empty():
+                try:
+                    page = self._pages.get(timeout=0.2)
+                    batch.append(page)
+                    batch_rows += len(page[4])
+                except queue.Empty:
+                    page = None
+
+                for future in [f for f in pending if f.done()]:
+                    name = pending.pop(future)
+                    if future.exception() is not None:
+                        self.counters['species_failed'] += 1
+                        print(f"  [GBIF Error] {name}: {future.exception()} (will resume from here next run)")
+
+                if batch and (batch_rows >= self.batch_size or page is None or not pending):
+                    self._write(conn, batch)
+                    batch, batch_rows = [], 0
+                    elapsed = time.perf_counter() - start
+                    print(f"  {self.counters['records']:,} records, {self.counters['inserted']:,} new, "
+                          f"{self.counters['species_done']}/{len(todo)} species done "
+                          f"({self.counters['records'] / elapsed:,.0f} records/s)")
+        except KeyboardInterrupt:
+            print("Interrupted: saving the pages fetched so far...")
+            self._stop.set()
+            if batch:
+                self._write(conn, batch)
+            raise
+        finally:
+            self._stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            conn.close()
+        return self.counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Harvest GBIF occurrences for our plants into Observations. "
+                                                 "Resumes where a previous run stopped.")
+    parser.add_argument('--db', default=DATABASE_FILE)
+    parser.add_argument('--api-url', default=GBIF_API_URL, help="Occurrence search endpoint (e.g. a local stand-in).")
+    parser.add_argument('--country', default=INDIA_COUNTRY_CODE)
+    parser.add_argument('--species', action='append', help="Harvest this species (repeatable). Default: PLANT_NAMES.")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="Species fetched at the same time.")
+    parser.add_argument('--rate', type=float, default=REQUESTS_PER_SECOND, help="Requests per second, all workers together.")
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Observations per transaction.")
+    parser.add_argument('--restart', action='store_true', help="Page through every species again from the start.")
+    args = parser.parse_args()
+
+    migrate(args.db, verbose=False)
+    client = GbifClient(args.api_url, args.country, RateLimiter(args.rate), min(PAGE_SIZE, max(1, args.page_size)))
+    harvester = Harvester(args.db, client, args.workers, args.batch_size)
+
+    conn = connect(args.db, readonly=True)
+    todo = harvester.plan(conn, args.species or PLANT_NAMES, restart=args.restart)
     conn.close()
+    if not todo:
+        print("Every species is already harvested (use --restart to fetch them again).")
+        return
+
+    print(f"Harvesting {len(todo)} species from {args.api_url} ({args.workers} workers, {args.rate:g} requests/s)...")
+    start = time.perf_counter()
+    counters = harvester.run(todo)
 
     print("\n--- Map Data Loading Complete ---")
-    print(f"Successfully added a total of {total_locations_added} map coordinates to the database.")
+    print(f"{counters['pages']:,} pages, {counters['records']:,} records in {time.perf_counter() - start:.1f}s: "
+          f"{counters['inserted']:,} new map coordinates, {counters['species_done']} species finished, "
+          f"{counters['species_failed']} failed (re-run to resume them).")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
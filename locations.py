@@ -0,0 +1,111 @@
+import json
+import zlib
+import numpy as np
+
+# A species' observation coordinates, served page by page (keyset pagination on
+# observation_id) and streamed straight from the cursor, so neither the server
+# nor the client ever holds the whole list. Three encodings:
+#
+#   json      {"locations": [{"lat": .., "lon": ..}, ...]}   (the profile's old shape)
+#   columnar  {"lat": [..], "lon": [..]} as integer microdegrees, each value
+#             stored as the difference from the previous one (the first is absolute)
+#   f32       raw little-endian float32 (lat, lon) pairs, 8 bytes per point
+
+FORMATS = ('json', 'columnar', 'f32')
+MIMETYPES = {'json': 'application/json', 'columnar': 'application/json', 'f32': 'application/octet-stream'}
+
+# Rows pulled from SQLite (and encoded) per streamed chunk
+FETCH_SIZE = 2000
+
+MICRODEGREES = 1000000
+
+
+def page_bounds(conn, species_id, after, limit):
+    """(row count, next_after) for one page; next_after is None on the last page."""
+    last = conn.execute(
+        """
+        SELECT observation_id FROM Observations
+        WHERE species_id = ? AND observation_id > ?
+        ORDER BY observation_id LIMIT 1 OFFSET ?
+        """,
+        (species_id, after, limit - 1)
+    ).fetchone()
+    if last is None:
+        count = conn.execute(
+            "SELECT COUNT(*) FROM Observations WHERE species_id = ? AND observation_id > ?", (species_id, after)
+        ).fetchone()[0]
+        return count, None
+
+    more = conn.execute(
+        "SELECT 1 FROM Observations WHERE species_id = ? AND observation_id > ? LIMIT 1", (species_id, last[0])
+    ).fetchone()
+    return limit, last[0] if more else None
+
+
+def iter_coordinates(conn, species_id, after, limit):
+    """Yields (n, 2) float64 arrays of (lat, lon), FETCH_SIZE rows at a time, in observation_id order."""
+    cursor = conn.execute(
+        """
+        SELECT latitude, longitude FROM Observations
+        WHERE species_id = ? AND observation_id > ?
+        ORDER BY observation_id LIMIT ?
+        """,
+        (species_id, after, limit)
+    )
+    try:
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            yield np.array([tuple(row) for row in rows], dtype=np.float64)
+    finally:
+        # A client that hangs up mid-page must not leave the statement open on a pooled connection
+        cursor.close()
+
+
+def encode(chunks, fmt, header):
+    """Turns coordinate chunks into response body pieces. `header` goes at the top of the JSON formats."""
+    if fmt == 'f32':
+        for coords in chunks:
+            yield coords.astype('<f4').tobytes()
+        return
+
+    yield json.dumps(header, separators=(',', ':'))[:-1]
+
+    if fmt == 'json':
+        yield ',"locations":['
+        first = True
+        for coords in chunks:
+            piece = ','.join(f'{{"lat":{lat!r},"lon":{lon!r}}}' for lat, lon in coords.tolist())
+            yield piece if first else ',' + piece
+            first = False
+        yield ']}'
+        return
+
+    # columnar: both columns are needed in order, so the lon deltas are held
+    # back until every lat has been written (4-byte ints, not Python objects)
+    yield ',"encoding":"delta-microdegrees","lat":['
+    lon_parts = []
+    previous = np.zeros(2, dtype=np.int64)
+    first = True
+    for coords in chunks:
+        scaled = np.rint(coords * MICRODEGREES).astype(np.int64)
+        deltas = np.diff(scaled, axis=0, prepend=previous[None, :])
+        previous = scaled[-1]
+        text = ','.join(map(str, deltas[:, 0].tolist()))
+        yield text if first else ',' + text
+        lon_parts.append(deltas[:, 1].astype(np.int32))
+        first = False
+    yield '],"lon":['
+    yield ','.join(','.join(map(str, part.tolist())) for part in lon_parts)
+    yield ']}'
+
+
+def gzip_stream(pieces, level=6):
+    """Gzips a stream of str/bytes pieces on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for piece in pieces:
+        data = compressor.compress(piece.encode('utf-8') if isinstance(piece, str) else piece)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,354 @@
+import time
+import argparse
+from database import DATABASE_FILE, connect
+import heatmap
+
+# Schema changes, in order. Each migration runs once, inside a transaction, and
+# is recorded in the SchemaMigrations table. Add new changes at the end with
+# the next version number; never edit one that has already shipped.
+
+
+def _create_base_tables(conn):
+    """The original four tables (what create_database.py used to create)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS Species (
+            species_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scientific_name TEXT NOT NULL UNIQUE,
+            english_name TEXT,
+            local_name TEXT,
+            kingdom TEXT
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS MedicinalUses (
+            use_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            species_id INTEGER NOT NULL,
+            part_used TEXT,
+            usage_description TEXT NOT NULL,
+            source_db TEXT,
+            FOREIGN KEY (species_id) REFERENCES Species (species_id)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS Observations (
+            observation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            species_id INTEGER NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            data_source TEXT NOT NULL,
+            timestamp TEXT,
+            health_condition TEXT,
+            image_url TEXT,
+            is_verified BOOLEAN DEFAULT 0,
+            FOREIGN KEY (species_id) REFERENCES Species (species_id)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS InvasiveStatus (
+            status_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            species_id INTEGER NOT NULL,
+            is_invasive BOOLEAN NOT NULL DEFAULT 0,
+            source_db TEXT,
+            FOREIGN KEY (species_id) REFERENCES Species (species_id)
+        )
+        """
+    )
+
+
+def _add_species_rich_columns(conn):
+    """The rich-data columns that alter_database.py used to add."""
+    add_columns(conn, 'Species', {
+        'plant_description': 'TEXT',
+        'habitat_type': 'TEXT',
+        'flowering_season': 'TEXT',
+        'general_warnings': 'TEXT',
+    })
+
+
+def _add_foreign_key_indexes(conn):
+    """Covering indexes for the per-species lookups in get_plant_profile."""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_observations_species "
+        "ON Observations (species_id, latitude, longitude)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_medicinal_uses_species "
+        "ON MedicinalUses (species_id, part_used, usage_description)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_invasive_status_species "
+        "ON InvasiveStatus (species_id, is_invasive)"
+    )
+
+
+def _add_observation_rtree(conn):
+    """R*Tree over observation coordinates, kept in sync with Observations by triggers."""
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS ObservationLocations USING rtree (
+            observation_id,
+            min_lat, max_lat,
+            min_lon, max_lon
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO ObservationLocations
+        SELECT observation_id, latitude, latitude, longitude, longitude FROM Observations
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_observations_location_insert
+        AFTER INSERT ON Observations
+        BEGIN
+            INSERT OR REPLACE INTO ObservationLocations
+            VALUES (NEW.observation_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_observations_location_update
+        AFTER UPDATE OF latitude, longitude ON Observations
+        BEGIN
+            UPDATE ObservationLocations
+            SET min_lat = NEW.latitude, max_lat = NEW.latitude,
+                min_lon = NEW.longitude, max_lon = NEW.longitude
+            WHERE observation_id = NEW.observation_id;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_observations_location_delete
+        AFTER DELETE ON Observations
+        BEGIN
+            DELETE FROM ObservationLocations WHERE observation_id = OLD.observation_id;
+        END
+        """
+    )
+
+
+def _add_heatmap_cells(conn):
+    """Precomputed per-species heatmap grids (see heatmap.py), filled from the existing observations."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS HeatmapCells (
+            species_id INTEGER NOT NULL,
+            zoom INTEGER NOT NULL,
+            tile_x INTEGER NOT NULL,
+            tile_y INTEGER NOT NULL,
+            cell INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (species_id, zoom, tile_x, tile_y, cell)
+        ) WITHOUT ROWID
+        """
+    )
+    heatmap.rebuild(conn)
+
+
+def _add_location_paging_index(conn):
+    """Covering index for paging through one species' coordinates in observation_id order."""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_observations_species_paging "
+        "ON Observations (species_id, observation_id, latitude, longitude)"
+    )
+
+
+def _add_verification_columns(conn):
+    """Result of the background AI check of crowdsourced observations."""
+    add_columns(conn, 'Observations', {
+        'verification_status': 'TEXT',   # pending / verified / mismatch / failed (NULL = not checked, e.g. GBIF)
+        'predicted_label': 'TEXT',
+        'label_matches': 'BOOLEAN',
+        'verified_at': 'TEXT',
+    })
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_observations_verification_pending "
+        "ON Observations (verification_status) WHERE verification_status = 'pending'"
+    )
+
+
+def _add_invasive_status_unique_key(conn):
+    """One InvasiveStatus row per species and source, so loaders can upsert instead of duplicating."""
+    conn.execute(
+        "DELETE FROM InvasiveStatus WHERE status_id NOT IN "
+        "(SELECT MIN(status_id) FROM InvasiveStatus GROUP BY species_id, source_db)"
+    )
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_invasive_status_species_source "
+        "ON InvasiveStatus (species_id, source_db)"
+    )
+
+
+def _add_harvest_tracking(conn):
+    """Source record ids on imported observations (the harvester's dedup key) and per-species harvest progress."""
+    add_columns(conn, 'Observations', {'source_record_id': 'TEXT'})
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_observations_source_record "
+        "ON Observations (data_source, source_record_id, species_id, latitude, longitude, timestamp) "
+        "WHERE source_record_id IS NOT NULL"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS HarvestProgress (
+            data_source TEXT NOT NULL,
+            country TEXT NOT NULL,
+            species_id INTEGER NOT NULL,
+            next_offset INTEGER NOT NULL DEFAULT 0,
+            complete BOOLEAN NOT NULL DEFAULT 0,
+            records_seen INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT,
+            PRIMARY KEY (data_source, country, species_id)
+        )
+        """
+    )
+
+
+def _add_heatmap_stale_triggers(conn):
+    """Marks a species' heatmap grids stale when one of its observations is moved or deleted."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS HeatmapStale (species_id INTEGER PRIMARY KEY) WITHOUT ROWID"
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_observations_heatmap_update
+        AFTER UPDATE OF species_id, latitude, longitude ON Observations
+        WHEN OLD.species_id IS NOT NEW.species_id
+          OR OLD.latitude IS NOT NEW.latitude
+          OR OLD.longitude IS NOT NEW.longitude
+        BEGIN
+            INSERT OR IGNORE INTO HeatmapStale VALUES (OLD.species_id);
+            INSERT OR IGNORE INTO HeatmapStale VALUES (NEW.species_id);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_observations_heatmap_delete
+        AFTER DELETE ON Observations
+        BEGIN
+            INSERT OR IGNORE INTO HeatmapStale VALUES (OLD.species_id);
+        END
+        """
+    )
+
+
+MIGRATIONS = [
+    (1, "Create base tables", _create_base_tables),
+    (2, "Add rich-data columns to Species", _add_species_rich_columns),
+    (3, "Index species_id on Observations, MedicinalUses and InvasiveStatus", _add_foreign_key_indexes),
+    (4, "Add R*Tree spatial index over observation coordinates", _add_observation_rtree),
+    (5, "Add precomputed heatmap grids per species", _add_heatmap_cells),
+    (6, "Index Observations for paging locations by species", _add_location_paging_index),
+    (7, "Add AI verification columns to Observations", _add_verification_columns),
+    (8, "Add unique (species_id, source_db) key to InvasiveStatus", _add_invasive_status_unique_key),
+    (9, "Add source record ids to Observations and HarvestProgress for the GBIF harvester", _add_harvest_tracking),
+    (10, "Mark heatmap grids stale when observations are moved or deleted", _add_heatmap_stale_triggers),
+]
+
+
+# --- Helpers for migrations ---
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def add_columns(conn, table, columns):
+    """Adds each missing column. Columns that already exist are left alone."""
+    existing = table_columns(conn, table)
+    for column_name, data_type in columns.items():
+        if column_name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column_name} {data_type}")
+
+
+# --- Runner ---
+
+def _ensure_history_table(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS SchemaMigrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+        """
+    )
+
+
+def current_version(conn):
+    """Highest migration version applied to this database (0 for a new database)."""
+    _ensure_history_table(conn)
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM SchemaMigrations").fetchone()[0]
+
+
+def migrate(db_file=DATABASE_FILE, target=None, verbose=True):
+    """Applies every pending migration up to `target` (default: all). Returns the new version."""
+    conn = connect(db_file, autocommit=True)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        version = current_version(conn)
+        conn.execute("COMMIT")
+
+        for number, description, apply in MIGRATIONS:
+            if number <= version or (target is not None and number > target):
+                continue
+
+            start = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have applied it while we waited for the lock
+                if current_version(conn) >= number:
+                    conn.execute("COMMIT")
+                    continue
+                apply(conn)
+                conn.execute(
+                    "INSERT INTO SchemaMigrations (version, description, applied_at) VALUES (?, ?, ?)",
+                    (number, description, time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()))
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            version = number
+            if verbose:
+                print(f"Applied migration {number}: {description} ({time.perf_counter() - start:.2f}s)")
+
+        return version
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations to the database.")
+    parser.add_argument('--db', default=DATABASE_FILE)
+    parser.add_argument('--target', type=int, help="Stop at this version (default: latest).")
+    parser.add_argument('--status', action='store_true', help="Only show the applied and pending migrations.")
+    args = parser.parse_args()
+
+    if args.status:
+        conn = connect(args.db)
+        version = current_version(conn)
+        conn.close()
+        print(f"{args.db} is at schema version {version}.")
+        for number, description, _ in MIGRATIONS:
+            print(f"  [{'x' if number <= version else ' '}] {number}: {description}")
+        return
+
+    print(f"Migrating {args.db}...")
+    version = migrate(args.db, target=args.target)
+    print(f"--- {args.db} is at schema version {version} ---")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+import os
+import sys
+import time
+import shutil
+import pickle
+import hashlib
+import argparse
+import threading
+
+# Model artifacts live in versioned folders: models/<version>/...
+# models/CURRENT holds the version to serve when none is configured.
+MODEL_DIR = os.environ.get('PLANT_MODEL_DIR', 'models')
+MODEL_VERSION = os.environ.get('PLANT_MODEL_VERSION')
+CURRENT_FILE = 'CURRENT'
+
+SEGMENTER_FILE = 'leaf_segmenter.h5'
+CLASSIFIER_FILE = 'leaf_classifier.pkl'
+KNN_INDEX_FILE = 'leaf_knn.npz'
+RESNET_WEIGHTS_FILE = 'resnet50_notop.weights.h5'
+
+# Quantized models for the 'tflite' backend (made by tflite_convert.py), one pair per precision
+TFLITE_BACKEND = 'tflite'
+TFLITE_QUANTIZATIONS = ('int8', 'float16')
+SEGMENTER_TFLITE_FILE = 'leaf_segmenter.{quantization}.tflite'
+RESNET_TFLITE_FILE = 'resnet50.{quantization}.tflite'
+TFLITE_QUANTIZATION = os.environ.get('PLANT_TFLITE_QUANTIZATION', 'int8')
+# Interpreter threads per model (0 = let TFLite decide)
+TFLITE_THREADS = int(os.environ.get('PLANT_TFLITE_THREADS', 0))
+
+CLASS_INPUT_SHAPE = (224, 224, 3)
+
+
+def resolve_artifact_dir(model_dir=MODEL_DIR, version=MODEL_VERSION):
+    """Works out which artifact folder to load from. Returns (path, version).
+
+    Order: an explicit version, then the version named in models/CURRENT.
+    If neither exists we fall back to the project folder itself (the
+    original layout, with the .h5 and .pkl next to app.py).
+    """
+    if not version:
+        current_path = os.path.join(model_dir, CURRENT_FILE)
+        if os.path.exists(current_path):
+            with open(current_path, 'r', encoding='utf-8') as f:
+                version = f.read().strip()
+
+    if version:
+        return os.path.join(model_dir, version), version
+
+    return '.', 'legacy'
+
+
+def file_digest(path, length=12):
+    """Short SHA-256 of a file, used to tell classifier versions apart."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()[:length]
+
+
+class ModelLoader:
+    """Loads the AI models on a background thread and reports readiness.
+
+    Everything is read from a local artifact folder; nothing is fetched from
+    the network (ResNet50 is built without weights and then filled from
+    RESNET_WEIGHTS_FILE). `on_ready(loader)` is called once every model is
+    loaded and the inference backend is warm. `classifier_engine` picks the
+    head on top of ResNet50: the RandomForest ('forest') or the embedding
+    index in KNN_INDEX_FILE ('knn' / 'prototype', see knn_classifier.py).
+    With the 'tflite' backend the quantized .tflite files are used instead of
+    the Keras models, which are then never loaded.
+    """
+
+    def __init__(self, artifact_dir, version, backend_name, on_ready=None, classifier_engine='forest'):
+        self.artifact_dir = artifact_dir
+        self.version = version
+        self.backend_name = backend_name
+        self.classifier_engine = classifier_engine
+        self.on_ready = on_ready
+
+        self.state = 'pending'
+        self.error = None
+        self.load_times = {}
+        self.started_at = None
+        self.finished_at = None
+        self.classifier_version = None
+        # Which features the backend produces: int8 / float16 TFLite embeddings differ from float32 ones
+        self.feature_version = None
+
+        self.segmentation_model = None
+        self.resnet_model = None
+        self.classification_model = None
+        self.inference_backend = None
+
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def is_ready(self):
+        return self.state == 'ready'
+
+    @property
+    def precision(self):
+        return TFLITE_QUANTIZATION if self.backend_name == TFLITE_BACKEND else 'float32'
+
+    def path(self, filename):
+        return os.path.join(self.artifact_dir, filename)
+
+    def start(self):
+        """Starts loading in the background and returns immediately."""
+        if self._thread is None:
+            self.state = 'loading'
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._load_all, name='model-loader', daemon=True)
+            self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        """Blocks until loading has finished (successfully or not)."""
+        self._ready.wait(timeout)
+        return self.is_ready
+
+    def status(self):
+        """Readiness details for /readyz."""
+        return {
+            'state': self.state,
+            'model_version': self.version,
+            'artifact_dir': self.artifact_dir,
+            'backend': self.backend_name,
+            'precision': self.precision,
+            'classifier_engine': self.classifier_engine,
+            'load_seconds': dict(self.load_times),
+            'error': self.error,
+        }
+
+    def _timed(self, name, fn):
+        start = time.perf_counter()
+        result = fn()
+        self.load_times[name] = round(time.perf_counter() - start, 3)
+        print(f"Loaded {name} in {self.load_times[name]:.2f}s")
+        return result
+
+    def _load_all(self):
+        try:
+            self._timed('tensorflow', self._import_tensorflow)
+            if self.backend_name != TFLITE_BACKEND:
+                self.segmentation_model = self._timed('segmenter', self._load_segmenter)
+                self.resnet_model = self._timed('resnet50', self._load_resnet)
+            self.classification_model = self._timed('classifier', self._load_classifier)
+            # Quantized features can change a label, so the precision is part of the version
+            self.classifier_version = (f"{self.version}:{self.precision}:{self.classifier_engine}:"
+                                       f"{file_digest(self.classifier_path())}")
+            self.feature_version = f"{self.version}:{self.precision}"
+            self.inference_backend = self._timed('warmup', self._build_backend)
+
+            if self.on_ready:
+                self.on_ready(self)
+
+            self.state = 'ready'
+            print(f"All models ready (version '{self.version}', backend '{self.backend_name}').")
+
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            print(f"FATAL ERROR: Could not load models. {e}")
+
+        finally:
+            self.finished_at = time.time()
+            self._ready.set()
+
+    # --- Individual loaders (TensorFlow is only imported here, off the request path) ---
+
+    def _import_tensorflow(self):
+        import tensorflow  # noqa: F401
+
+    def _load_segmenter(self):
+        import tensorflow as tf
+        return tf.keras.models.load_model(
+            self.path(SEGMENTER_FILE),
+            custom_objects={'MeanIoU': tf.keras.metrics.MeanIoU(num_classes=2)}
+        )
+
+    def _load_resnet(self):
+        import tensorflow as tf
+        weights_path = self.path(RESNET_WEIGHTS_FILE)
+        if not os.path.exists(weights_path):
+            raise FileNotFoundError(
+                f"{weights_path} not found. Run `python model_loader.py package --version <name>` "
+                "once on a machine with internet access to create it."
+            )
+        model = tf.keras.applications.ResNet50(
+            weights=None,
+            include_top=False,
+            pooling='avg',
+            input_shape=CLASS_INPUT_SHAPE
+        )
+        model.load_weights(weights_path)
+        return model
+
+    def classifier_path(self):
+        return self.path(CLASSIFIER_FILE if self.classifier_engine == 'forest' else KNN_INDEX_FILE)
+
+    def _load_classifier(self):
+        if self.classifier_engine == 'forest':
+            with open(self.path(CLASSIFIER_FILE), 'rb') as f:
+                return pickle.load(f)
+
+        from knn_classifier import EmbeddingIndexClassifier
+        index_path = self.path(KNN_INDEX_FILE)
+        if not os.path.exists(index_path):
+            raise FileNotFoundError(
+                f"{index_path} not found. Build it with `python knn_classifier.py --index {index_path} add ...`."
+            )
+        head = EmbeddingIndexClassifier.load(index_path, mode=self.classifier_engine)
+        if not len(head):
+            raise ValueError(f"{index_path} holds no reference embeddings.")
+        return head
+
+    def tflite_paths(self, quantization=TFLITE_QUANTIZATION):
+        """(segmenter, resnet50) .tflite paths for one precision."""
+        return (self.path(SEGMENTER_TFLITE_FILE.format(quantization=quantization)),
+                self.path(RESNET_TFLITE_FILE.format(quantization=quantization)))
+
+    def _build_backend(self):
+        if self.backend_name == TFLITE_BACKEND:
+            from inference_backends import TFLiteBackend
+            for path in self.tflite_paths():
+                if not os.path.exists(path):
+                    raise FileNotFoundError(
+                        f"{path} not found. Create it with "
+                        f"`python tflite_convert.py convert --quantization {TFLITE_QUANTIZATION} --calibration <images>`."
+                    )
+            backend = TFLiteBackend(*self.tflite_paths(), num_threads=TFLITE_THREADS or None)
+        else:
+            from inference_backends import make_backend
+            backend = make_backend(self.backend_name, self.segmentation_model, self.resnet_model)
+        backend.warmup()
+        return backend
+
+
+def load_for_tool(backend_name=None, classifier_engine=None):
+    """Loads the configured model version in this process, as the server would, and waits for it.
+
+    For offline tools, which must not import app (that would migrate the
+    database and start the server's background work). The backend and
+    classifier engine default to PLANT_INFERENCE_BACKEND and
+    PLANT_CLASSIFIER_ENGINE. Raises RuntimeError if loading fails.
+    """
+    artifact_dir, version = resolve_artifact_dir()
+    loader = ModelLoader(
+        artifact_dir, version, backend_name or os.environ.get('PLANT_INFERENCE_BACKEND', 'graph'),
+        classifier_engine=classifier_engine or os.environ.get('PLANT_CLASSIFIER_ENGINE', 'forest')
+    )
+    if not loader.start().wait():
+        raise RuntimeError(f"Models failed to load: {loader.error}")
+    return loader
+
+
+# --- Command line: build a versioned artifact folder ---
+
+def package(version, source_dir='.', model_dir=MODEL_DIR, make_current=True):
+    """Copies the trained models into models/<version>/ and saves the ResNet50 weights.
+
+    This is the only step that may touch the network (to download the ImageNet
+    weights once); the server itself never does.
+    """
+    target = os.path.join(model_dir, version)
+    os.makedirs(target, exist_ok=True)
+
+    for filename in (SEGMENTER_FILE, CLASSIFIER_FILE):
+        src = os.path.join(source_dir, filename)
+        if os.path.exists(os.path.join(target, filename)):
+            print(f"{filename} already in {target}. Skipping.")
+        elif os.path.exists(src):
+            shutil.copy2(src, target)
+            print(f"Copied {src} -> {target}")
+        else:
+            print(f"WARNING: {src} not found; add it to {target} by hand.")
+
+    weights_path = os.path.join(target, RESNET_WEIGHTS_FILE)
+    if not os.path.exists(weights_path):
+        import tensorflow as tf
+        print("Saving ImageNet ResNet50 weights (downloads them if they are not cached)...")
+        model = tf.keras.applications.ResNet50(
+            weights='imagenet',
+            include_top=False,
+            pooling='avg',
+            input_shape=CLASS_INPUT_SHAPE
+        )
+        model.save_weights(weights_path)
+        print(f"Saved {weights_path}")
+
+    if make_current:
+        with open(os.path.join(model_dir, CURRENT_FILE), 'w', encoding='utf-8') as f:
+            f.write(version + '\n')
+        print(f"{model_dir}/{CURRENT_FILE} now points to '{version}'.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage versioned model artifacts.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    pkg = sub.add_parser('package', help="Create models/<version>/ from the trained model files.")
+    pkg.add_argument('--version', required=True)
+    pkg.add_argument('--source-dir', default='.')
+    pkg.add_argument('--no-current', action='store_true', help="Do not update models/CURRENT.")
+
+    sub.add_parser('check', help="Load the configured models once and print load times.")
+
+    args = parser.parse_args()
+
+    if args.command == 'package':
+        package(args.version, args.source_dir, make_current=not args.no_current)
+        return
+
+    artifact_dir, version = resolve_artifact_dir()
+    loader = ModelLoader(
+        artifact_dir, version, os.environ.get('PLANT_INFERENCE_BACKEND', 'graph'),
+        classifier_engine=os.environ.get('PLANT_CLASSIFIER_ENGINE', 'forest')
+    ).start()
+    loader.wait()
+    print(loader.status())
+    sys.exit(0 if loader.is_ready else 1)
+
+
+if __name__ == '__main__':
+    main()
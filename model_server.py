@@ -0,0 +1,481 @@
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import struct
+import argparse
+import queue
+import threading
+import socketserver
+from contextlib import contextmanager
+from concurrent.futures import wait as futures_wait
+from collections import Counter
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from inference_scheduler import MicroBatcher, INTERACTIVE
+import batch_inference
+
+# One process owns the models; web workers (app.py with PLANT_MODEL_SERVER set)
+# send it their decoded images. Requests are small JSON messages over a Unix
+# socket; the pixels themselves travel through a shared-memory buffer that
+# belongs to the connection, and the results come back in the same buffer.
+MODEL_SERVER_SOCKET = os.environ.get('PLANT_MODEL_SERVER') or 'plant-models.sock'
+
+BATCH_MAX_SIZE = int(os.environ.get('PLANT_BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get('PLANT_BATCH_MAX_WAIT_MS', 10))
+
+# Idle connections (each with its shared-memory buffer) a web worker keeps for
+# reuse. A call takes one for its duration; a connection that would not fit back
+# in the pool is closed, so threads coming and going never leak sockets or memory.
+CHANNEL_POOL_SIZE = int(os.environ.get('PLANT_MODEL_SERVER_CHANNELS', 8))
+
+# How often a worker asks a server that is still loading (or not running yet) for its status
+STATUS_POLL_SECONDS = 1.0
+
+# Tensor layout of each operation: input shape per image, output shape and dtype per image
+OPERATIONS = {
+    'segment': ((256, 256, 3), (256, 256, 1), np.uint8),
+    'classify': ((224, 224, 3), (2048,), np.float32),
+    # Ranks ResNet50 features with the classifier head; the ranking comes back in the reply
+    'rank': ((2048,), (0,), np.float32),
+}
+
+_LENGTH = struct.Struct('!I')
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    """Reads one length-prefixed JSON message, or returns None if the peer closed the connection."""
+    header = _recv_exactly(sock, _LENGTH.size)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, _LENGTH.unpack(header)[0])
+    return json.loads(data) if data is not None else None
+
+
+def _recv_exactly(sock, size):
+    chunks = bytearray()
+    while len(chunks) < size:
+        chunk = sock.recv(size - len(chunks))
+        if not chunk:
+            return None
+        chunks.extend(chunk)
+    return bytes(chunks)
+
+
+def attach_shared_memory(name):
+    """Opens a worker's shared-memory block without taking ownership of it (the worker unlinks it)."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+# --- Server: owns the models ---
+
+class ModelServer:
+    """Loads the models once and serves segmentation / classification to every web worker.
+
+    Each image of a request is queued on the same MicroBatchers the
+    single-process server uses, so concurrent requests from all workers are
+    stacked into shared forward passes.
+    """
+
+    def __init__(self, socket_path, loader, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.socket_path = socket_path
+        self.loader = loader
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.batchers = {}
+        self.connections = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+        loader.on_ready = self._models_ready
+
+    def _models_ready(self, loader):
+        backend, classifier = loader.inference_backend, loader.classification_model
+        self.batchers = {
+            'segment': MicroBatcher(
+                'segmentation', lambda images: batch_inference.segment_batch(backend, images),
+                max_batch_size=self.max_batch_size, max_wait_ms=self.max_wait_ms
+            ),
+            'classify': MicroBatcher(
+                'classification', lambda leaves: batch_inference.classify_batch(backend, classifier, leaves),
+                max_batch_size=self.max_batch_size, max_wait_ms=self.max_wait_ms
+            ),
+        }
+
+    def status(self):
+        with self._lock:
+            connections = dict(self.connections)
+        return dict(
+            self.loader.status(),
+            classifier_version=self.loader.classifier_version,
+            feature_version=self.loader.feature_version,
+            pid=os.getpid(),
+            connections=connections,
+            batching={batcher.name: batcher.stats() for batcher in self.batchers.values()},
+        )
+
+    def run(self, request, shm):
+        """Runs one segment / classify request whose images are in `shm`; writes the results back there."""
+        op, count = request['op'], int(request['count'])
+        input_shape, output_shape, output_dtype = OPERATIONS[op]
+        if not self.loader.is_ready:
+            raise RuntimeError(f"Models are not ready ({self.loader.state})")
+
+        if op == 'rank':
+            features = np.ndarray((count,) + input_shape, np.float32, buffer=shm.buf).copy()
+            top = batch_inference.rank_batch(self.loader.classification_model, features, int(request['top']))
+            return {'top': top}
+
+        # Copied out of shared memory: if one image fails, the handler may close the
+        # buffer while this request's other images are still queued
+        images = np.ndarray((count,) + input_shape, np.float32, buffer=shm.buf).copy()
+        batcher = self.batchers[op]
+        priority = request.get('priority', INTERACTIVE)
+        # Every image joins the shared queue on its own, next to other workers' images
+        futures = [batcher.submit(image, priority) for image in images]
+        futures_wait(futures)
+        results = [future.result() for future in futures]
+
+        outputs = np.ndarray((count,) + output_shape, output_dtype, buffer=shm.buf)
+        if op == 'segment':
+            outputs[...] = np.stack(results)
+            reply = {}
+        else:
+            outputs[...] = np.stack([features for _, features, _ in results])
+            reply = {'labels': [label for label, _, _ in results],
+                     'confidences': [confidence for _, _, confidence in results]}
+        del outputs
+        return reply
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = _UnixServer(self.socket_path, _ConnectionHandler)
+        self._server.model_server = self
+        os.chmod(self.socket_path, 0o660)
+        print(f"Model server listening on {self.socket_path} (pid {os.getpid()}).")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            for batcher in self.batchers.values():
+                batcher.close()
+
+    def shutdown(self):
+        if self._server is not None:
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    """One worker thread's connection: handles its requests in order until it disconnects."""
+
+    def handle(self):
+        server = self.server.model_server
+        shm = None
+        with server._lock:
+            server.connections['open'] += 1
+            server.connections['total'] += 1
+        try:
+            while True:
+                request = recv_message(self.request)
+                if request is None:
+                    break
+                try:
+                    if request['op'] == 'status':
+                        reply = server.status()
+                    else:
+                        # A connection keeps one buffer; a new name means it had to grow it
+                        if shm is None or shm.name != request['shm']:
+                            if shm is not None:
+                                shm.close()
+                            shm = attach_shared_memory(request['shm'])
+                        reply = server.run(request, shm)
+                    reply['ok'] = True
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e)}
+                send_message(self.request, reply)
+        finally:
+            if shm is not None:
+                shm.close()
+            with server._lock:
+                server.connections['open'] -= 1
+
+
+# --- Client: used by app.py in each web worker ---
+
+class ModelServerClient:
+    """Stands in for ModelLoader in a web worker whose models live in a model server.
+
+    It has the loader's readiness API (start / wait / is_ready / status) and
+    reports ready once the server has loaded its models. `segment()` and
+    `classify()` take the same lists of arrays as the local batch functions.
+    Each call takes a socket connection and shared-memory buffer from a
+    small pool (or opens one when all are in use), so concurrent calls
+    never wait on each other here, and returns it when done.
+    """
+
+    def __init__(self, socket_path, on_ready=None):
+        self.socket_path = socket_path
+        self.on_ready = on_ready
+
+        self.state = 'pending'
+        self.error = None
+        self.version = None
+        self.classifier_version = None
+        self.feature_version = None
+        self.server_status = {}
+
+        self._idle_channels = queue.Queue(maxsize=CHANNEL_POOL_SIZE)
+        self._channels = []
+        self._lock = threading.Lock()
+        self._calls = Counter()
+        self._call_ms = Counter()
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def is_ready(self):
+        return self.state == 'ready'
+
+    def start(self):
+        """Waits for the server in the background and returns immediately."""
+        if self._thread is None:
+            self.state = 'loading'
+            self._thread = threading.Thread(target=self._wait_for_server, name='model-server-client', daemon=True)
+            self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        self._ready.wait(timeout)
+        return self.is_ready
+
+    def status(self):
+        """Readiness details for /readyz: this worker's view plus the server's own status."""
+        return {
+            'state': self.state,
+            'model_server': self.socket_path,
+            'model_version': self.version,
+            'error': self.error,
+            'server': {key: value for key, value in self.server_status.items() if key != 'batching'},
+        }
+
+    def _wait_for_server(self):
+        while True:
+            try:
+                status = self._request({'op': 'status'})
+            except (OSError, RuntimeError) as e:
+                self.error = f"Model server not reachable at {self.socket_path}: {e}"
+                time.sleep(STATUS_POLL_SECONDS)
+                continue
+
+            self.server_status = status
+            if status['state'] == 'failed':
+                self.state, self.error = 'failed', status['error']
+                break
+            if status['state'] == 'ready':
+                self.version = status['model_version']
+                self.classifier_version = status['classifier_version']
+                self.feature_version = status['feature_version']
+                self.error = None
+                try:
+                    if self.on_ready:
+                        self.on_ready(self)
+                    self.state = 'ready'
+                    print(f"Connected to model server at {self.socket_path} (pid {status['pid']}).")
+                except Exception as e:
+                    self.state, self.error = 'failed', str(e)
+                break
+            time.sleep(STATUS_POLL_SECONDS)
+        self._ready.set()
+
+    # --- Inference ---
+
+    def segment(self, images, priority=INTERACTIVE):
+        """U-Net masks for a list of 256x256 images (one (256, 256, 1) uint8 mask each)."""
+        outputs, _ = self._run('segment', images, priority)
+        return list(outputs)
+
+    def classify(self, leaf_arrays, priority=INTERACTIVE):
+        """(label, features, confidence) for each 224x224 leaf, as classify_batch() returns."""
+        outputs, reply = self._run('classify', leaf_arrays, priority)
+        return list(zip(reply['labels'], outputs, reply['confidences']))
+
+    def rank(self, features, top):
+        """The `top` best (label, score) pairs for each feature vector, as batch_inference.rank_batch() returns."""
+        _, reply = self._run('rank', features, INTERACTIVE, top=top)
+        return [[tuple(pair) for pair in row] for row in reply['top']]
+
+    def _run(self, op, arrays, priority, **options):
+        input_shape, output_shape, output_dtype = OPERATIONS[op]
+        count = len(arrays)
+        input_bytes = count * int(np.prod(input_shape)) * 4
+        output_bytes = count * int(np.prod(output_shape)) * np.dtype(output_dtype).itemsize
+
+        start = time.perf_counter()
+        with self._channel() as channel:
+            shm = channel.buffer(max(input_bytes, output_bytes))
+            # The only copy of the pixels: straight into shared memory
+            images = np.ndarray((count,) + input_shape, np.float32, buffer=shm.buf)
+            for i, array in enumerate(arrays):
+                images[i] = array
+            del images
+
+            reply = channel.request(dict(options, op=op, shm=shm.name, count=count, priority=priority))
+            outputs = np.ndarray((count,) + output_shape, output_dtype, buffer=shm.buf).copy()
+
+        with self._lock:
+            self._calls[op] += 1
+            self._call_ms[op] += (time.perf_counter() - start) * 1000.0
+        return outputs, reply
+
+    def _request(self, message):
+        with self._channel() as channel:
+            return channel.request(message)
+
+    @contextmanager
+    def _channel(self):
+        """Checks out an idle channel (or opens one) for one call, then gives it back."""
+        channel = None
+        while channel is None:
+            try:
+                channel = self._idle_channels.get_nowait()
+            except queue.Empty:
+                channel = _Channel(self.socket_path)
+                with self._lock:
+                    self._channels.append(channel)
+            if channel.closed:
+                channel = None
+        try:
+            yield channel
+        finally:
+            self._release(channel)
+
+    def _release(self, channel):
+        if not channel.closed:
+            try:
+                self._idle_channels.put_nowait(channel)
+                return
+            except queue.Full:
+                channel.close()
+        with self._lock:
+            if channel in self._channels:
+                self._channels.remove(channel)
+
+    def stats(self):
+        """Round trips from this worker per operation, plus the server's batching statistics."""
+        try:
+            self.server_status = self._request({'op': 'status'})
+        except (OSError, RuntimeError) as e:
+            self.error = str(e)
+        with self._lock:
+            calls = {op: {'requests': n, 'mean_round_trip_ms': self._call_ms[op] / n} for op, n in self._calls.items()}
+        return {'calls': calls, 'server_batching': self.server_status.get('batching', {})}
+
+    def close(self):
+        with self._lock:
+            channels, self._channels = self._channels, []
+            self._idle_channels = queue.Queue(maxsize=CHANNEL_POOL_SIZE)
+        for channel in channels:
+            channel.close()
+
+
+class _Channel:
+    """One connection to the model server and its shared-memory buffer, used by one call at a time."""
+
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.shm = None
+        self.closed = False
+
+    def buffer(self, size):
+        """The shared-memory block, replaced by a larger one when `size` does not fit."""
+        if self.shm is None or self.shm.size < size:
+            if self.shm is not None:
+                self.shm.close()
+                self.shm.unlink()
+            self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        return self.shm
+
+    def request(self, message):
+        try:
+            send_message(self.sock, message)
+            reply = recv_message(self.sock)
+        except OSError:
+            self.close()
+            raise
+        if reply is None:
+            self.close()
+            raise RuntimeError("Model server closed the connection")
+        if not reply.pop('ok'):
+            raise RuntimeError(f"Model server error: {reply['error']}")
+        return reply
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.sock.close()
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class RemoteScheduler:
+    """Per-image calls to the model server with a MicroBatcher's call signature.
+
+    The batching happens in the server (across every worker), so a worker
+    sends each image as soon as it has it.
+    """
+
+    def __init__(self, name, client, op):
+        self.name = name
+        self.client = client
+        self.op = op
+
+    def __call__(self, item, priority=INTERACTIVE):
+        return getattr(self.client, self.op)([item], priority)[0]
+
+
+def main():
+    from model_loader import ModelLoader, resolve_artifact_dir
+
+    parser = argparse.ArgumentParser(description="Serve the AI models to the web workers over a Unix socket.")
+    parser.add_argument('--socket', default=MODEL_SERVER_SOCKET, help="Socket path (PLANT_MODEL_SERVER in the workers).")
+    args = parser.parse_args()
+
+    artifact_dir, version = resolve_artifact_dir()
+    loader = ModelLoader(
+        artifact_dir, version, os.environ.get('PLANT_INFERENCE_BACKEND', 'graph'),
+        classifier_engine=os.environ.get('PLANT_CLASSIFIER_ENGINE', 'forest')
+    )
+    server = ModelServer(args.socket, loader)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.shutdown())
+    loader.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0 if loader.state != 'failed' else 1)
+
+
+if __name__ == '__main__':
+    main()
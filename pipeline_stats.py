@@ -0,0 +1,84 @@
+import time
+import threading
+from collections import deque, defaultdict
+from inference_scheduler import _percentile
+
+# How many recent samples per stage we keep for the percentile report
+STAGE_SAMPLE_SIZE = 1000
+
+# First-pass confidences are counted in buckets of this width (for tuning the cascade threshold)
+CONFIDENCE_BUCKET = 0.1
+
+
+class StageTimer:
+    """Times the stages of one request: `with timer.stage('segment'): ...`. Results are in `timings` (ms)."""
+
+    def __init__(self):
+        self.timings = {}
+
+    def stage(self, name):
+        return _Stage(self.timings, name)
+
+
+class _Stage:
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + (time.perf_counter() - self.start) * 1000.0
+        return False
+
+
+class PipelineStats:
+    """Aggregates per-image stage timings and how often the cascade exits early.
+
+    `record()` takes one image's StageTimer timings (empty for batch uploads,
+    which are timed per chunk), whether it was answered from the whole-image
+    classification alone, and the confidence of that first pass. `stats()` reports, per stage, the mean / p50 / p95 latency,
+    plus the early-exit share and a histogram of first-pass confidences.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=STAGE_SAMPLE_SIZE))
+        self._totals = defaultdict(float)
+        self._counts = defaultdict(int)
+        self._images = 0
+        self._early_exits = 0
+        self._confidences = defaultdict(int)
+
+    def record(self, timings, early_exit=False, confidence=None):
+        with self._lock:
+            self._images += 1
+            self._early_exits += int(early_exit)
+            for name, ms in timings.items():
+                self._samples[name].append(ms)
+                self._totals[name] += ms
+                self._counts[name] += 1
+            if confidence is not None:
+                bucket = min(int(confidence / CONFIDENCE_BUCKET), int(round(1 / CONFIDENCE_BUCKET)) - 1)
+                self._confidences[round(bucket * CONFIDENCE_BUCKET, 2)] += 1
+
+    def stats(self):
+        with self._lock:
+            stages = {}
+            for name, samples in self._samples.items():
+                ordered = sorted(samples)
+                stages[name] = {
+                    'count': self._counts[name],
+                    'mean_ms': self._totals[name] / self._counts[name],
+                    'p50_ms': _percentile(ordered, 50),
+                    'p95_ms': _percentile(ordered, 95),
+                }
+            return {
+                'images': self._images,
+                'early_exits': self._early_exits,
+                'early_exit_share': (self._early_exits / self._images) if self._images else 0.0,
+                'stages': stages,
+                'first_pass_confidence': {f"{bucket:.1f}": n for bucket, n in sorted(self._confidences.items())},
+            }
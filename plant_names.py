@@ -0,0 +1,26 @@
+# Classifier label -> scientific name in the Species table. Shared by app.py and
+# the offline tools, so they don't have to import the app.
+NAME_MAPPER = {
+    'Alstonia Scholaris diseased (P2a)': 'Alstonia scholaris',
+    'Alstonia Scholaris healthy (P2b)': 'Alstonia scholaris',
+    'Arjun diseased (P1a)': 'Terminalia arjuna',
+    'Arjun healthy (P1b)': 'Terminalia arjuna',
+    'Bael diseased (P4b)': 'Aegle marmelos',
+    'Basil healthy (P8)': 'Ocimum tenuiflorum',
+    'Chinar diseased (P11b)': 'Platanus orientalis',
+    'Chinar healthy (P11a)': 'Platanus orientalis',
+    'Gauva diseased (P3b)': 'Psidium guajava',
+    'Gauva healthy (P3a)': 'Psidium guajava',
+    'Jamun diseased (P5b)': 'Syzygium cumini',
+    'Jamun healthy (P5a)': 'Syzygium cumini',
+    'Jatropha diseased (P6b)': 'Jatropha curcas',
+    'Jatropha healthy (P6a)': 'Jatropha curcas',
+    'Lemon diseased (P10b)': 'Citrus limon',
+    'Lemon healthy (P10a)': 'Citrus limon',
+    'Mango diseased (P0b)': 'Mangifera indica',
+    'Mango healthy (P0a)': 'Mangifera indica',
+    'Pomegranate diseased (P9b)': 'Punica granatum',
+    'Pomegranate healthy (P9a)': 'Punica granatum',
+    'Pongamia Pinnata diseased (P7b)': 'Millettia pinnata',
+    'Pongamia Pinnata healthy (P7a)': 'Millettia pinnata'
+}
@@ -1,10 +1,9 @@
-import sqlite3
 import requests
 import wikipediaapi
 import time
 import os
+from database import DATABASE_FILE, connect
 
-DATABASE_FILE = "medicinal_plants.db"
 TREFLE_API_URL = "https://trefle.io/api/v6/species"
 
 # --- 1. Setup APIs ---
@@ -23,9 +22,7 @@ wiki_api = wikipediaapi.Wikipedia(
 
 def get_db_connection():
     """Connects to the SQLite database."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return connect(DATABASE_FILE)
 
 # --- 2. API Helper Functions ---
 
@@ -0,0 +1,90 @@
+import json
+import time
+import threading
+
+
+class ProfileCache:
+    """In-process cache of assembled species profiles, keyed by scientific name.
+
+    Each profile is kept both as a dict and as its serialised JSON body, so the
+    hot path can send it without touching SQLite or re-encoding it. Profiles
+    only change when an observation is added, and `add_location()` replaces just
+    that species' entry. `ttl_seconds` (0 = never) bounds how stale a profile
+    can get when other processes write to the database.
+    """
+
+    def __init__(self, load_fn, ttl_seconds=0):
+        self.load_fn = load_fn
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._entries = {}  # scientific_name -> (loaded_at, profile, body)
+        self._counters = {'hits': 0, 'misses': 0, 'patches': 0, 'invalidations': 0}
+
+    @staticmethod
+    def serialise(profile):
+        return json.dumps(profile, separators=(',', ':'))
+
+    def warm(self, scientific_names):
+        """Loads every given species up front. Returns how many were cached."""
+        warmed = 0
+        for scientific_name in scientific_names:
+            profile, _ = self._load(scientific_name)
+            if 'error' not in profile:
+                warmed += 1
+        return warmed
+
+    def get(self, scientific_name):
+        """Returns (profile, body) for a species, loading it on a miss.
+
+        Profiles that could not be built (e.g. the species is unknown) are
+        returned but not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(scientific_name)
+            if entry is not None and not self._expired(entry):
+                self._counters['hits'] += 1
+                return entry[1], entry[2]
+            self._counters['misses'] += 1
+
+        return self._load(scientific_name)
+
+    def add_location(self, scientific_name, latitude, longitude):
+        """Patches a cached profile with one new observation."""
+        with self._lock:
+            entry = self._entries.get(scientific_name)
+            if entry is None:
+                return
+            loaded_at, profile, _ = entry
+            # A new dict (and locations list): callers may still be serialising the one get() gave them
+            profile = dict(profile, location_count=profile.get('location_count', 0) + 1)
+            if 'locations' in profile:
+                profile['locations'] = profile['locations'] + [{'lat': latitude, 'lon': longitude}]
+            self._entries[scientific_name] = (loaded_at, profile, self.serialise(profile))
+            self._counters['patches'] += 1
+
+    def invalidate(self, scientific_name=None):
+        """Drops one species (or everything) so the next request reloads it."""
+        with self._lock:
+            if scientific_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(scientific_name, None)
+            self._counters['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            return stats
+
+    def _expired(self, entry):
+        return self.ttl_seconds > 0 and time.time() - entry[0] > self.ttl_seconds
+
+    def _load(self, scientific_name):
+        profile = self.load_fn(scientific_name)
+        body = self.serialise(profile)
+        if 'error' not in profile:
+            with self._lock:
+                self._entries[scientific_name] = (time.time(), profile, body)
+        return profile, body
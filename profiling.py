@@ -0,0 +1,256 @@
+import os
+import sys
+import time
+import random
+import marshal
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from io import StringIO
+from collections import Counter
+
+# How often the stack sampler looks at the profiled threads
+SAMPLE_INTERVAL_MS = 5.0
+
+# Frames kept per tracemalloc allocation, and how many allocation sites are reported
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 30
+
+# A helper thread whose innermost frame is in one of these files is waiting for work, not working
+IDLE_FILES = ('threading.py', 'queue.py', 'selectors.py')
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame):
+    """One stack as 'outer;...;inner' frame names, the format flamegraph.pl and speedscope read."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class RequestProfiler:
+    """Profiles a chosen set of live requests, on demand, without restarting the server.
+
+    `arm()` opens a window: the next `requests` requests (optionally only one
+    route, optionally a random `sample_rate` share of them) are profiled. Each
+    profiled request runs under cProfile, and a sampler thread records the
+    stacks of the request thread plus the helper threads doing its work
+    (e.g. the model batchers), so time spent outside the request thread
+    shows up too. With `memory=True`, tracemalloc follows allocations until
+    the window closes.
+
+    Results are aggregated over the window: `pstats_bytes()` (for
+    `python -m pstats` or snakeviz), `collapsed()` (for flamegraph.pl or
+    speedscope) and `memory()`. While no window is open, `should_profile()`
+    is a single attribute check.
+
+    Only one request is profiled at a time; requests that arrive while
+    another is being profiled run normally and don't use up the window.
+    """
+
+    def __init__(self, helper_threads=(), sample_interval_ms=SAMPLE_INTERVAL_MS):
+        self.helper_threads = tuple(helper_threads)
+        self.sample_interval = max(0.001, float(sample_interval_ms) / 1000.0)
+        self.armed = False
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()
+        self._active = threading.Event()
+        self._sampler = None
+        self._reset(requests=0, sample_rate=1.0, route=None, memory=False)
+
+    def _reset(self, requests, sample_rate, route, memory):
+        self.remaining = requests
+        self.sample_rate = sample_rate
+        self.route = route
+        self.memory_enabled = memory
+        self._stats = None
+        self._stacks = Counter()
+        self._samples = 0
+        self._profiled = Counter()
+        self._profiled_ms = 0.0
+        self._request_thread = None
+        self._memory_peaks = []
+        self._top_allocations = []
+        self._window_started = time.time()
+        self._window_closed = None
+
+    # --- Window control ---
+
+    def arm(self, requests=10, sample_rate=1.0, route=None, memory=False):
+        """Opens a new profiling window (dropping the previous window's results)."""
+        with self._lock:
+            self._close_window()
+            self._reset(max(1, int(requests)), min(1.0, max(0.0, float(sample_rate))), route, bool(memory))
+            if self.memory_enabled and not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.armed = True
+        print(f"Profiling the next {self.remaining} requests"
+              f"{f' to {route}' if route else ''} (sample rate {self.sample_rate}, memory {self.memory_enabled})")
+
+    def disarm(self):
+        """Closes the window early; its results stay available for download."""
+        with self._lock:
+            self._close_window()
+
+    def _close_window(self):
+        """Stops the sampler and tracemalloc. Caller holds self._lock."""
+        if not self.armed:
+            return
+        self.armed = False
+        self._active.set()  # wakes the sampler so it sees the window is closed
+        if self.memory_enabled and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)])
+            self._top_allocations = [
+                {'where': str(stat.traceback[0]), 'size_kb': stat.size / 1024.0, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+            ]
+            tracemalloc.stop()
+        self._window_closed = time.time()
+        print(f"Profiling window closed: {sum(self._profiled.values())} requests profiled")
+
+    # --- Per request ---
+
+    def should_profile(self, route):
+        """Whether this request should be profiled; uses up one request of the window if so."""
+        if not self.armed:
+            return False
+        with self._lock:
+            if not self.armed or self.remaining <= 0 or (self.route and route != self.route):
+                return False
+            if random.random() >= self.sample_rate:
+                return False
+            if not self._busy.acquire(blocking=False):
+                return False
+            self.remaining -= 1
+            return True
+
+    def start(self):
+        """Starts profiling the calling thread. Only after should_profile() returned True (or force_start())."""
+        if self.memory_enabled and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self._request_thread = threading.get_ident()
+        with self._lock:
+            self._ensure_sampler()
+        profile = cProfile.Profile()
+        self._active.set()
+        profile.enable()
+        return profile, time.perf_counter()
+
+    def force_start(self):
+        """Profiles this one request outside any window (e.g. a request sent with the profiling header).
+
+        Returns None if another request is being profiled right now.
+        """
+        if not self._busy.acquire(blocking=False):
+            return None
+        return self.start()
+
+    def stop(self, session, route):
+        profile, started = session
+        profile.disable()
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        self._active.clear()
+        self._request_thread = None
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self._profiled[route] += 1
+            self._profiled_ms += elapsed_ms
+            if self.memory_enabled and tracemalloc.is_tracing():
+                self._memory_peaks.append({'route': route, 'peak_kb': tracemalloc.get_traced_memory()[1] / 1024.0})
+            if self.armed and self.remaining <= 0:
+                self._close_window()
+        self._busy.release()
+
+    # --- Stack sampler ---
+
+    def _ensure_sampler(self):
+        """Starts the sampler thread unless it is running. Caller holds self._lock."""
+        if self._sampler is None or not self._sampler.is_alive():
+            self._sampler = threading.Thread(target=self._sample_stacks, name='profile-sampler', daemon=True)
+            self._sampler.start()
+
+    def _sample_stacks(self):
+        own = threading.get_ident()
+        # Runs while a window is open or a request is being profiled, then exits
+        while True:
+            self._active.wait()
+            if not self.armed and self._request_thread is None:
+                return
+            time.sleep(self.sample_interval)
+            request_thread = self._request_thread
+            if request_thread is None:
+                continue
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                name = names.get(ident, str(ident))
+                if ident == request_thread:
+                    stacks.append(f"request;{_collapse(frame)}")
+                elif name.startswith(self.helper_threads) \
+                        and not frame.f_code.co_filename.endswith(IDLE_FILES):
+                    stacks.append(f"{name.rsplit('_', 1)[0]};{_collapse(frame)}")
+            with self._lock:
+                self._samples += 1
+                self._stacks.update(stacks)
+
+    # --- Results ---
+
+    def status(self):
+        with self._lock:
+            return {
+                'armed': self.armed,
+                'remaining': self.remaining if self.armed else 0,
+                'route': self.route,
+                'sample_rate': self.sample_rate,
+                'memory': self.memory_enabled,
+                'window_started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self._window_started)),
+                'window_closed': (time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self._window_closed))
+                                  if self._window_closed else None),
+                'profiled_requests': dict(self._profiled),
+                'mean_profiled_ms': (self._profiled_ms / sum(self._profiled.values())) if self._profiled else 0.0,
+                'stack_samples': self._samples,
+                'sample_interval_ms': self.sample_interval * 1000.0,
+            }
+
+    def pstats_bytes(self):
+        """The aggregated cProfile stats in the marshal format of `pstats.Stats.dump_stats`, or None."""
+        with self._lock:
+            return marshal.dumps(self._stats.stats) if self._stats is not None else None
+
+    def pstats_text(self, limit=40):
+        """The top `limit` functions by cumulative time, as text."""
+        with self._lock:
+            if self._stats is None:
+                return None
+            stream = StringIO()
+            self._stats.stream = stream
+            self._stats.sort_stats('cumulative').print_stats(limit)
+            return stream.getvalue()
+
+    def collapsed(self):
+        """Sampled stacks as 'thread;outer;...;inner count' lines."""
+        with self._lock:
+            return ''.join(f"{stack} {count}\n" for stack, count in sorted(self._stacks.items()))
+
+    def memory(self):
+        with self._lock:
+            return {
+                'enabled': self.memory_enabled,
+                'tracing': tracemalloc.is_tracing(),
+                'peak_per_request': list(self._memory_peaks),
+                # Filled in when the window closes
+                'top_allocations': list(self._top_allocations),
+            }
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def content_key(image_bytes):
+    """Cache key for an upload: the SHA-256 of its raw bytes."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class ResultCache:
+    """Caches identification results by a hash of the uploaded bytes.
+
+    Two tiers: a bounded in-memory LRU with a TTL, and an optional SQLite file
+    on disk that survives restarts. Concurrent lookups for the same key are
+    coalesced ("single-flight"), so only the first caller runs the pipeline
+    and the others wait for its answer. Every entry is tagged with the
+    classifier's model version; changing the version drops older entries.
+    Values must be JSON-serialisable.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600, disk_path=None, model_version=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self.model_version = model_version
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (stored_at, value)
+        self._inflight = {}           # key -> Future
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+        self._disk = None
+        if disk_path:
+            os.makedirs(os.path.dirname(disk_path) or '.', exist_ok=True)
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute(
+                """
+                CREATE TABLE IF NOT EXISTS Results (
+                    cache_key TEXT PRIMARY KEY,
+                    model_version TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    value TEXT NOT NULL
+                )
+                """
+            )
+            self._disk.commit()
+
+    # --- Versioning ---
+
+    def set_model_version(self, model_version):
+        """Switches to a new classifier version, dropping every entry from older versions."""
+        with self._lock:
+            if model_version == self.model_version:
+                return
+            self.model_version = model_version
+            self._memory.clear()
+            self._counters['invalidations'] += 1
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM Results WHERE model_version != ?", (model_version,))
+                self._disk.commit()
+
+    # --- Lookups ---
+
+    def get(self, key):
+        """Returns the cached value for key, or None. Counts a hit or a miss."""
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self._counters['misses'] += 1
+            return value
+
+    def put(self, key, value):
+        """Stores a value in both tiers under the current model version."""
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_compute(self, key, compute_fn, accept=None):
+        """Returns the cached value for key, running compute_fn() at most once per key at a time.
+
+        A cached (or in-flight) value that `accept(value)` rejects is treated as
+        a miss: it is computed again and replaced.
+        """
+        while True:
+            with self._lock:
+                value = self._lookup(key)
+                if value is not None and (accept is None or accept(value)):
+                    return value
+
+                future = self._inflight.get(key)
+                if future is not None:
+                    self._counters['coalesced'] += 1
+                    leader = False
+                else:
+                    self._counters['misses'] += 1
+                    future = Future()
+                    self._inflight[key] = future
+                    leader = True
+
+            if not leader:
+                value = future.result()
+                if accept is None or accept(value):
+                    return value
+                continue
+
+            try:
+                value = compute_fn()
+            except Exception as e:
+                with self._lock:
+                    del self._inflight[key]
+                future.set_exception(e)
+                raise
+
+            with self._lock:
+                self._store(key, value)
+                del self._inflight[key]
+            future.set_result(value)
+            return value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+            stats['entries'] = len(self._memory)
+            stats['max_entries'] = self.max_entries
+            stats['disk_enabled'] = self._disk is not None
+            stats['model_version'] = self.model_version
+            return stats
+
+    # --- Internals (caller holds self._lock) ---
+
+    def _lookup(self, key):
+        now = time.time()
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            if now - stored_at <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return value
+            del self._memory[key]
+
+        if self._disk is not None:
+            row = self._disk.execute(
+                "SELECT stored_at, value FROM Results WHERE cache_key = ? AND model_version = ?",
+                (key, self.model_version)
+            ).fetchone()
+            if row and now - row[0] <= self.ttl_seconds:
+                value = json.loads(row[1])
+                self._remember(key, row[0], value)
+                self._counters['disk_hits'] += 1
+                return value
+
+        return None
+
+    def _store(self, key, value):
+        now = time.time()
+        self._remember(key, now, value)
+        if self._disk is not None:
+            self._disk.execute(
+                "INSERT OR REPLACE INTO Results (cache_key, model_version, stored_at, value) VALUES (?, ?, ?, ?)",
+                (key, self.model_version, now, json.dumps(value))
+            )
+            self._disk.commit()
+
+    def _remember(self, key, stored_at, value):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = (stored_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._counters['evictions'] += 1
@@ -0,0 +1,168 @@
+import math
+
+# Observations are indexed in the ObservationLocations R*Tree (migration 4),
+# which triggers on Observations keep in sync. Queries first ask the R*Tree
+# for the rows inside a bounding box (a logarithmic lookup), then re-check the
+# exact coordinates, because the R*Tree stores them as 32-bit floats.
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Search boxes are widened by this much (in degrees) so a point exactly on the
+# circle is not lost to rounding in the exact BETWEEN re-check
+BOX_PADDING_DEGREES = 1e-9
+
+# Nearest-first searches start with this radius and double it until `limit`
+# points are inside (or the requested radius is reached), so a query in a dense
+# area reads about `limit` rows instead of every point within the full radius
+NEAR_START_KM = 1.0
+
+OBSERVATION_COLUMNS = """
+    o.observation_id, o.species_id, s.scientific_name, s.english_name,
+    o.latitude, o.longitude, o.data_source, o.timestamp
+"""
+
+
+def parse_bbox(text):
+    """Parses 'min_lon,min_lat,max_lon,max_lat' (the usual map-client order).
+
+    min_lon may be greater than max_lon for a box that crosses the antimeridian.
+    Raises ValueError for anything malformed.
+    """
+    parts = [float(part) for part in text.split(',')]
+    if len(parts) != 4:
+        raise ValueError("bbox must be 'min_lon,min_lat,max_lon,max_lat'")
+    min_lon, min_lat, max_lon, max_lat = parts
+    if not (-90 <= min_lat <= max_lat <= 90):
+        raise ValueError("bbox latitudes must satisfy -90 <= min_lat <= max_lat <= 90")
+    if not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise ValueError("bbox longitudes must be between -180 and 180")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(lat, lon, radius_km):
+    """Smallest lat/lon box that contains the circle, as (min_lon, min_lat, max_lon, max_lat).
+
+    Uses the same sphere as haversine_km(). The circle is widest in longitude
+    not at its centre latitude but where its edge touches a meridian, so
+    dlon comes from asin(sin(r) / cos(lat)), not r / cos(lat).
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angle) + BOX_PADDING_DEGREES
+    min_lat, max_lat = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+
+    ratio = math.sin(angle) / max(math.cos(math.radians(lat)), 1e-12)
+    if max_lat >= 90.0 or min_lat <= -90.0 or angle >= math.pi / 2 or ratio >= 1.0:
+        # The circle reaches a pole: every longitude is inside
+        return -180.0, min_lat, 180.0, max_lat
+
+    dlon = math.degrees(math.asin(ratio)) + BOX_PADDING_DEGREES
+    if dlon >= 180.0:
+        return -180.0, min_lat, 180.0, max_lat
+
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180.0:
+        min_lon += 360.0
+    if max_lon > 180.0:
+        max_lon -= 360.0
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def _lon_ranges(min_lon, max_lon):
+    """A box crossing the antimeridian is searched as two boxes."""
+    if min_lon <= max_lon:
+        return [(min_lon, max_lon)]
+    return [(min_lon, 180.0), (-180.0, max_lon)]
+
+
+def _candidates(conn, bbox, species_ids=None, medicinal_only=False, limit=None):
+    """Rows inside the bbox, found through the R*Tree and re-checked exactly."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    rows = []
+
+    for lo, hi in _lon_ranges(min_lon, max_lon):
+        sql = f"""
+            SELECT {OBSERVATION_COLUMNS}
+            FROM ObservationLocations r
+            JOIN Observations o ON o.observation_id = r.observation_id
+            JOIN Species s ON s.species_id = o.species_id
+            WHERE r.max_lat >= ? AND r.min_lat <= ?
+              AND r.max_lon >= ? AND r.min_lon <= ?
+              AND o.latitude BETWEEN ? AND ?
+              AND o.longitude BETWEEN ? AND ?
+        """
+        params = [min_lat, max_lat, lo, hi, min_lat, max_lat, lo, hi]
+
+        if species_ids:
+            # The unary + keeps SQLite driving the query from the R*Tree, not the species index
+            sql += f" AND +o.species_id IN ({','.join('?' * len(species_ids))})"
+            params.extend(species_ids)
+        if medicinal_only:
+            sql += " AND EXISTS (SELECT 1 FROM MedicinalUses m WHERE m.species_id = o.species_id)"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit - len(rows))
+
+        rows.extend(conn.execute(sql, params).fetchall())
+        if limit is not None and len(rows) >= limit:
+            break
+
+    return rows
+
+
+def _as_dict(row):
+    return {
+        'observation_id': row['observation_id'],
+        'species_id': row['species_id'],
+        'scientific_name': row['scientific_name'],
+        'english_name': row['english_name'],
+        'lat': row['latitude'],
+        'lon': row['longitude'],
+        'data_source': row['data_source'],
+        'timestamp': row['timestamp'],
+    }
+
+
+def species_ids_for_names(conn, scientific_names):
+    """Maps scientific names to species ids, skipping unknown names."""
+    if not scientific_names:
+        return []
+    placeholders = ','.join('?' * len(scientific_names))
+    rows = conn.execute(
+        f"SELECT species_id FROM Species WHERE scientific_name IN ({placeholders})", list(scientific_names)
+    ).fetchall()
+    return [row['species_id'] for row in rows]
+
+
+def observations_in_bbox(conn, bbox, species_ids=None, medicinal_only=False, limit=500):
+    """Observations inside a bounding box, at most `limit` of them."""
+    return [_as_dict(row) for row in _candidates(conn, bbox, species_ids, medicinal_only, limit)]
+
+
+def observations_near(conn, lat, lon, radius_km, species_ids=None, medicinal_only=False, limit=500):
+    """Observations within radius_km of (lat, lon), nearest first, at most `limit` of them.
+
+    Every point within the current search radius is found, so once `limit` of
+    them are in, no point outside it can be nearer and the search stops.
+    """
+    search_km = min(radius_km, NEAR_START_KM)
+    while True:
+        results = []
+        for row in _candidates(conn, radius_bbox(lat, lon, search_km), species_ids, medicinal_only):
+            distance = haversine_km(lat, lon, row['latitude'], row['longitude'])
+            if distance <= search_km:
+                item = _as_dict(row)
+                item['distance_km'] = round(distance, 3)
+                results.append(item)
+        if len(results) >= limit or search_km >= radius_km:
+            break
+        search_km = min(radius_km, search_km * 2)
+
+    results.sort(key=lambda item: item['distance_km'])
+    return results[:limit]
@@ -0,0 +1,178 @@
+import os
+import glob
+import time
+import argparse
+import numpy as np
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+# TensorFlow (and inference_backends) are imported after the database module, as
+# in the server: importing TensorFlow first can leave sqlite3 without the R*Tree module.
+import database  # noqa: F401
+from model_loader import TFLITE_QUANTIZATIONS, load_for_tool
+from image_decode import decode
+from batch_inference import (prepare_segmentation_input, prepare_classification_input, segment_and_crop,
+                             preprocess_resnet_input, segment_batch)
+
+IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png', '*.webp', '*.JPG', '*.JPEG', '*.PNG')
+
+# Calibration images are capped: a few hundred cover the activation ranges
+MAX_CALIBRATION_IMAGES = 200
+
+# Images per forward pass in the parity check
+PARITY_BATCH_SIZE = 16
+
+# Parity gates: the quantized backend is only safe to adopt above both
+MIN_LABEL_AGREEMENT = 0.98
+MIN_MEAN_IOU = 0.90
+
+
+def list_images(folder):
+    paths = sorted({path for pattern in IMAGE_PATTERNS for path in glob.glob(os.path.join(folder, pattern))})
+    if not paths:
+        raise SystemExit(f"No images found in {folder}")
+    return paths
+
+
+def load_float_models():
+    """Loads the configured model version on the float Keras models (the reference pipeline), in this process."""
+    try:
+        return load_for_tool('graph')
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+
+
+def read_pipeline_inputs(loader, paths):
+    """Decodes images into (U-Net input, ResNet50 input of the segmented crop, ResNet50 input of the whole image)."""
+    for path in paths:
+        with open(path, 'rb') as f:
+            img = decode(f.read())
+        seg_input = prepare_segmentation_input(img).astype(np.float32)
+        mask = segment_batch(loader.inference_backend, [seg_input])[0]
+        crop = segment_and_crop(img, mask)
+        yield (seg_input,
+               preprocess_resnet_input(prepare_classification_input(crop)),
+               preprocess_resnet_input(prepare_classification_input(img)))
+
+
+# --- Conversion ---
+
+def convert_model(model, quantization, calibration_inputs):
+    """Converts a Keras model to TFLite bytes. The batch dimension stays open and the I/O stays float32.
+
+    int8: weights and activations are quantized, with activation ranges
+    calibrated on `calibration_inputs`. float16: weights are stored as float16.
+    """
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        converter.representative_dataset = lambda: ([x[np.newaxis]] for x in calibration_inputs)
+    return converter.convert()
+
+
+def convert(quantization, calibration_dir):
+    loader = load_float_models()
+    paths = list_images(calibration_dir)[:MAX_CALIBRATION_IMAGES]
+    print(f"--- Calibrating on {len(paths)} images from {calibration_dir} ---")
+
+    seg_inputs, class_inputs = [], []
+    for seg_input, crop_input, whole_input in read_pipeline_inputs(loader, paths):
+        seg_inputs.append(seg_input)
+        # The cascade classifies whole images too, so both are in the calibration set
+        class_inputs.extend([crop_input, whole_input])
+
+    models = ((loader.segmentation_model, seg_inputs), (loader.resnet_model, class_inputs))
+    for (model, inputs), target in zip(models, loader.tflite_paths(quantization)):
+        start = time.perf_counter()
+        flatbuffer = convert_model(model, quantization, inputs)
+        tmp_path = f"{target}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(flatbuffer)
+        os.replace(tmp_path, target)
+        print(f"Wrote {target} ({len(flatbuffer) / 1e6:.1f} MB) in {time.perf_counter() - start:.1f}s")
+
+
+# --- Accuracy parity ---
+
+def mask_iou(a, b):
+    """Intersection over union of two binary masks (1.0 when both are empty)."""
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def run_pipeline(classifier, backend, seg_inputs, images):
+    """Segmentation, crop and classification of `images` on one backend. Returns (masks, labels, ms per image)."""
+    start = time.perf_counter()
+    masks = (backend.segment(np.stack(seg_inputs)) > 0.5).astype(np.uint8)
+    crops = [prepare_classification_input(segment_and_crop(img, mask)) for img, mask in zip(images, masks)]
+    features = backend.extract_features(preprocess_resnet_input(np.stack(crops)))
+    labels = classifier.predict(features.reshape(len(images), -1))
+    elapsed = (time.perf_counter() - start) * 1000.0 / len(images)
+    return masks, [str(label) for label in labels], elapsed
+
+
+def parity(quantization, images_dir, num_threads, min_label_agreement, min_iou):
+    """Runs a held-out set through the float and the quantized backend. Returns True if both gates pass."""
+    loader = load_float_models()
+    from inference_backends import TFLiteBackend
+    paths = list_images(images_dir)
+    reference = loader.inference_backend
+    candidate = TFLiteBackend(*loader.tflite_paths(quantization), num_threads=num_threads)
+    candidate.warmup()
+
+    ious, agreements, timings = [], [], {'float32': [], quantization: []}
+    for start in range(0, len(paths), PARITY_BATCH_SIZE):
+        images = []
+        for path in paths[start:start + PARITY_BATCH_SIZE]:
+            with open(path, 'rb') as f:
+                images.append(decode(f.read()))
+        seg_inputs = [prepare_segmentation_input(img).astype(np.float32) for img in images]
+
+        ref_masks, ref_labels, ref_ms = run_pipeline(loader.classification_model, reference, seg_inputs, images)
+        new_masks, new_labels, new_ms = run_pipeline(loader.classification_model, candidate, seg_inputs, images)
+        ious.extend(mask_iou(a, b) for a, b in zip(ref_masks, new_masks))
+        agreements.extend(a == b for a, b in zip(ref_labels, new_labels))
+        timings['float32'].append(ref_ms)
+        timings[quantization].append(new_ms)
+
+    label_agreement = float(np.mean(agreements))
+    mean_iou = float(np.mean(ious))
+    print(f"--- {len(paths)} held-out images: float32 vs tflite {quantization} ---")
+    print(f"Same label:  {label_agreement:.3f} (gate {min_label_agreement})")
+    print(f"Mask IoU:    mean {mean_iou:.3f}, min {min(ious):.3f} (gate {min_iou} mean)")
+    for name, values in timings.items():
+        print(f"Pipeline ms per image ({name}): {np.mean(values):.1f}")
+
+    passed = label_agreement >= min_label_agreement and mean_iou >= min_iou
+    print("PASS: safe to serve with PLANT_INFERENCE_BACKEND=tflite" if passed else "FAIL: keep the float backend")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Make quantized TFLite models for the 'tflite' backend and check them.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    conv = sub.add_parser('convert', help="Convert the U-Net and ResNet50 of the configured model version.")
+    conv.add_argument('--quantization', choices=TFLITE_QUANTIZATIONS, default='int8')
+    conv.add_argument('--calibration', required=True, help="Folder of representative leaf photos (used for int8).")
+
+    check = sub.add_parser('parity', help="Compare the quantized backend with the float one on held-out photos.")
+    check.add_argument('--quantization', choices=TFLITE_QUANTIZATIONS, default='int8')
+    check.add_argument('--images', required=True, help="Folder of held-out photos (not the calibration set).")
+    check.add_argument('--threads', type=int, default=0, help="Interpreter threads (0 = TFLite default).")
+    check.add_argument('--min-label-agreement', type=float, default=MIN_LABEL_AGREEMENT)
+    check.add_argument('--min-iou', type=float, default=MIN_MEAN_IOU)
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        convert(args.quantization, args.calibration)
+        return
+    passed = parity(args.quantization, args.images, args.threads or None, args.min_label_agreement, args.min_iou)
+    raise SystemExit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,5 @@
 import sqlite3
-
-DATABASE_FILE = "medicinal_plants.db"
+from database import DATABASE_FILE, connect
 
 # The 12 classes from your 7GB dataset
 new_plants_data = [
@@ -19,7 +18,7 @@ new_plants_data = [
 ]
 
 print(f"Connecting to {DATABASE_FILE}...")
-conn = sqlite3.connect(DATABASE_FILE)
+conn = connect(DATABASE_FILE)
 cursor = conn.cursor()
 
 plants_added = 0
@@ -1,6 +1,5 @@
 import sqlite3
-
-DATABASE_FILE = "medicinal_plants.db"
+from database import DATABASE_FILE, connect
 
 # Medicinal data for the 12 plants from the classification dataset
 new_medicinal_data = [
@@ -19,7 +18,7 @@ new_medicinal_data = [
 
 def main():
     print(f"Connecting to {DATABASE_FILE}...")
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = connect(DATABASE_FILE)
     cursor = conn.cursor()
 
     uses_added = 0
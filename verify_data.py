@@ -1,9 +1,7 @@
-import sqlite3
-
-DATABASE_FILE = "medicinal_plants.db"
+from database import DATABASE_FILE, connect
 
 print(f"Connecting to {DATABASE_FILE}...")
-conn = sqlite3.connect(DATABASE_FILE)
+conn = connect(DATABASE_FILE, readonly=True)
 cursor = conn.cursor()
 
 print("Fetching first 10 invasive plants from the database...")